@@ -0,0 +1,138 @@
+"""Micro-benchmark for aspect detection: full decode + exif_transpose vs. header-only parsing.
+
+Builds a corpus of phone-sized images (JPEG with and without EXIF rotation, PNG, WebP and
+the HEIF family: AVIF via Pillow, HEIC when pillow-heif is installed) or loads your own
+files, checks that both paths agree on the displayed dimensions, and reports the median
+time per image for each.
+
+    python bench_aspect.py --size 4032x3024 --repeat 20
+    python bench_aspect.py --dir ~/Pictures/samples --repeat 5
+"""
+import argparse
+import io
+import os
+import statistics
+import time
+
+from PIL import Image, ImageOps
+
+from input_image import EXIF_ORIENTATION, read_header
+
+MIME_BY_EXT = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png", ".webp": "webp", ".avif": "avif", ".heic": "heic"}
+
+
+def decode_size(data: bytes) -> tuple[int, int]:
+    """The old path: decodes and transposes the whole bitmap to learn its displayed size."""
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        return img.size
+
+
+def header_size(data: bytes) -> tuple[int, int]:
+    width, height, _ = read_header(data)
+    return width, height
+
+
+def _photo(width: int, height: int) -> Image.Image:
+    """A photo-like test image: smooth gradients plus noise, so encoders don't cheat."""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    return Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def _encode(img: Image.Image, fmt: str, orientation: int = None) -> bytes | None:
+    kwargs = {}
+    if orientation:
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        kwargs["exif"] = exif.tobytes()
+    if fmt in ("JPEG", "WEBP", "AVIF", "HEIF"):
+        kwargs["quality"] = 85
+    buf = io.BytesIO()
+    try:
+        img.save(buf, fmt, **kwargs)
+    except (KeyError, OSError, ValueError):
+        return None
+    return buf.getvalue()
+
+
+def build_corpus(width: int, height: int) -> list[tuple[str, bytes]]:
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+    except ImportError:
+        pass
+    img = _photo(width, height)
+    cases = [
+        ("jpeg", "JPEG", None),
+        ("jpeg exif rot90", "JPEG", 6),
+        ("png", "PNG", None),
+        ("webp exif rot90", "WEBP", 6),
+        ("avif exif rot90", "AVIF", 6),
+        ("heic exif rot90", "HEIF", 6),
+    ]
+    corpus = []
+    for name, fmt, orientation in cases:
+        data = _encode(img, fmt, orientation)
+        if data is None:
+            print(f"skipping {name}: no {fmt} encoder in this Pillow build")
+            continue
+        corpus.append((name, data))
+    return corpus
+
+
+def load_corpus(directory: str) -> list[tuple[str, bytes]]:
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in MIME_BY_EXT:
+            with open(os.path.join(directory, name), "rb") as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def median_ms(func, data: bytes, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", default="4032x3024", help="generated image size, WxH")
+    parser.add_argument("--dir", help="benchmark the images in this directory instead")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.dir:
+        corpus = load_corpus(args.dir)
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        corpus = build_corpus(width, height)
+
+    print(f"{'image':<22} {'KB':>7} {'size':>11} {'decode ms':>10} {'header ms':>10} {'speedup':>8}")
+    total_decode = total_header = 0.0
+    for name, data in corpus:
+        try:
+            expected = decode_size(data)
+        except OSError as e:
+            print(f"{name:<22} cannot decode: {e}")
+            continue
+        got = header_size(data)
+        if got != expected:
+            print(f"{name:<22} MISMATCH: header says {got}, decode says {expected}")
+        decode = median_ms(decode_size, data, args.repeat)
+        header = median_ms(header_size, data, args.repeat)
+        total_decode += decode
+        total_header += header
+        print(f"{name:<22} {len(data) / 1024:>7.0f} {'%dx%d' % got:>11} {decode:>10.2f} {header:>10.3f} "
+              f"{decode / header if header else 0:>7.0f}x")
+    if total_header:
+        print(f"{'total':<22} {'':>7} {'':>11} {total_decode:>10.2f} {total_header:>10.3f} "
+              f"{total_decode / total_header:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Benchmark the browser client against the offline Flow stand-in (flow_standin.py).
+
+Starts the stand-in, points a client at it (fresh temporary profile, bundled Chromium by
+default) and runs a burst of generate/upscale jobs, then reports throughput and
+p50/p95 latency per operation.
+
+    python bench_client.py --tabs 3 --jobs 12 --concurrency 6 --images-per-job 2 --upscales 4
+
+Scaling with browser profiles (one Chrome process each; tabs are per profile):
+
+    python bench_client.py --profiles 1 --tabs 2 --jobs 24 --concurrency 24
+    python bench_client.py --profiles 3 --tabs 2 --jobs 24 --concurrency 24
+
+Start-up and refresh time, old navigation vs. readiness wait + request policy, with a slow
+font and analytics script on the stand-in:
+
+    python bench_client.py --jobs 0 --asset-latency 2 --refreshes 5 --navigation-wait networkidle --no-block
+    python bench_client.py --jobs 0 --asset-latency 2 --refreshes 5
+
+Upload paths: multi-file chooser, drop onto the prompt (the chooser takes one file), and a
+page that takes neither, where each tab probes bulk upload once and then uploads per image:
+
+    python bench_client.py --jobs 12 --images-per-job 3
+    python bench_client.py --jobs 12 --images-per-job 3 --single-file-chooser
+    python bench_client.py --jobs 12 --images-per-job 3 --single-file-chooser --no-drop
+"""
+import argparse
+import asyncio
+import io
+import logging
+import math
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+
+import config
+import flow_standin
+from browser_client import WebsiteError
+from browser_shards import ShardedClient
+from memory_governor import sample_profile_usage
+from input_image import InputImage
+
+logger = logging.getLogger("bench")
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile; 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class Results:
+    def __init__(self):
+        self.durations: dict[str, list] = {}
+        self.errors: dict[str, int] = {}
+        self.images_out = 0
+        self.upscale_bytes = 0
+
+    def add(self, operation: str, seconds: float):
+        self.durations.setdefault(operation, []).append(seconds)
+
+    def error(self, operation: str):
+        self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def report(self, wall_seconds: float) -> str:
+        lines = [f"{'operation':<12} {'ok':>5} {'err':>5} {'p50':>8} {'p95':>8} {'max':>8} {'ops/s':>8}"]
+        for operation in sorted(set(self.durations) | set(self.errors)):
+            values = self.durations.get(operation, [])
+            lines.append(
+                f"{operation:<12} {len(values):>5} {self.errors.get(operation, 0):>5} "
+                f"{percentile(values, 50):>7.2f}s {percentile(values, 95):>7.2f}s "
+                f"{max(values, default=0):>7.2f}s {len(values) / wall_seconds if wall_seconds else 0:>8.2f}"
+            )
+        return "\n".join(lines)
+
+
+def make_input_images(count: int) -> list:
+    """Creates `count` small in-memory JPEGs to use as reference images."""
+    images = []
+    for i in range(count):
+        width, height = random.choice([(1200, 1600), (1600, 1200)])
+        buf = io.BytesIO()
+        Image.new("RGB", (width, height), (i * 40 % 256, 120, 200)).save(buf, format="JPEG")
+        images.append(InputImage(buf.getvalue(), "image/jpeg", f"input_{i}.jpg"))
+    return images
+
+
+async def timed(results: Results, operation: str, coro):
+    start = time.perf_counter()
+    try:
+        value = await coro
+    except WebsiteError as e:
+        results.error(operation)
+        logger.warning(f"{operation} rejected by stand-in: {e}")
+        return None
+    except Exception as e:
+        results.error(operation)
+        logger.warning(f"{operation} failed: {e}")
+        return None
+    results.add(operation, time.perf_counter() - start)
+    return value
+
+
+async def run(args):
+    standin = flow_standin.from_arguments(args).start()
+    config.BROWSER_CHANNEL = args.channel
+    config.HEADLESS = not args.headed
+    config.MIN_LATENCY = args.min_latency
+    config.NAVIGATION_WAIT = args.navigation_wait
+    config.BLOCK_RESOURCES = not args.no_block
+    # The stand-in's slow analytics come from a second host name; block it like the real ones
+    config.BLOCK_HOSTS = ",".join(filter(None, [config.BLOCK_HOSTS, standin.third_party_host]))
+
+    results = Results()
+    with tempfile.TemporaryDirectory(prefix="nb_bench_") as workdir:
+        inputs = make_input_images(args.images_per_job)
+        client = ShardedClient(
+            profiles=[os.path.join(workdir, f"profile{i}") for i in range(args.profiles)],
+            pool_size=args.tabs,
+            target_url=standin.target_url,
+        )
+        try:
+            # Startup is timed but not wrapped in timed(): without a browser there is nothing to bench
+            start = time.perf_counter()
+            await client.start()
+            results.add("startup", time.perf_counter() - start)
+            for _ in range(args.refreshes):
+                start = time.perf_counter()
+                await client.shards[0].client._refresh_page(client.page)
+                results.add("refresh", time.perf_counter() - start)
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            prompts = [f"bench prompt {i} {random.randrange(1 << 30):x}" for i in range(args.jobs)]
+            result_ids = {}
+
+            async def generate_job(i: int):
+                async with semaphore:
+                    aspect = args.aspect if args.aspect != "mixed" else random.choice(["portrait", "landscape"])
+                    images = await timed(
+                        results, "generate",
+                        client.generate_image(prompts[i], inputs or None, aspect),
+                    )
+                    if images:
+                        results.images_out += len(images)
+                        result_ids[i] = images[0].result_id
+
+            async def upscale_job(i: int):
+                async with semaphore:
+                    scale = random.choice(["1K", "2K", "4K"])
+                    stream = await timed(results, f"upscale_{scale}", client.upscale_image(prompts[i], 0, scale, result_ids.get(i)))
+                    if stream is not None:
+                        with stream:
+                            results.upscale_bytes += stream.seek(0, io.SEEK_END)
+
+            usage_before = [sample_profile_usage(shard.client.user_data_dir) for shard in client.shards]
+            start = time.perf_counter()
+            await asyncio.gather(*(generate_job(i) for i in range(args.jobs)))
+            await asyncio.gather(*(upscale_job(i % args.jobs) for i in range(args.upscales)))
+            wall = time.perf_counter() - start
+            shard_lines = []
+            for shard, before in zip(client.shards, usage_before):
+                after = sample_profile_usage(shard.client.user_data_dir)
+                if before and after:
+                    shard_lines.append(f"  shard {shard.name}: {(after['cpu_s'] - before['cpu_s']) / wall:.2f} cores, "
+                                       f"{after['memory'] / 1e6:.0f} MB")
+        finally:
+            await client.stop()
+            standin.stop()
+
+    print()
+    print(f"Stand-in: latency={args.latency}s error_rate={args.error_rate} "
+          f"inline_error_rate={args.inline_error_rate} gallery={args.gallery_size}")
+    print(f"Client: profiles={args.profiles} tabs={args.tabs} concurrency={args.concurrency} images/job={args.images_per_job} "
+          f"min_latency={args.min_latency} navigation_wait={args.navigation_wait} block={not args.no_block} "
+          f"asset_latency={args.asset_latency}s")
+    print(results.report(wall))
+    print(f"Wall time {wall:.2f}s, {args.jobs / wall:.2f} generations/s, "
+          f"{results.images_out} images out, {results.upscale_bytes / 1e6:.1f} MB upscaled")
+    for line in shard_lines:
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the browser client against the Flow stand-in")
+    flow_standin.add_arguments(parser)
+    parser.add_argument("--profiles", type=int, default=1, help="browser profiles, one Chrome process each")
+    parser.add_argument("--tabs", type=int, default=config.PAGE_POOL_SIZE, help="tabs per profile")
+    parser.add_argument("--jobs", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=6)
+    parser.add_argument("--images-per-job", type=int, default=0)
+    parser.add_argument("--upscales", type=int, default=0)
+    parser.add_argument("--aspect", choices=["portrait", "landscape", "mixed"], default="mixed")
+    parser.add_argument("--channel", default="", help='browser channel ("" = bundled Chromium, "chrome")')
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument("--min-latency", action="store_true")
+    parser.add_argument("--navigation-wait", choices=["ready", "networkidle"], default=config.NAVIGATION_WAIT)
+    parser.add_argument("--no-block", action="store_true", help="don't install the request policy")
+    parser.add_argument("--refreshes", type=int, default=0, help="page refreshes to time after startup")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    asyncio.run(run(args))
@@ -1,15 +1,22 @@
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 import logging
 import asyncio
 import io
 import config
-from browser_client import NanoBananaClient, WebsiteError
+import metrics
+from browser_client import GeneratedImage, WebsiteError
+from browser_shards import ShardedClient
+from bounded_store import BoundedStore
+from file_cache import FileCache
+from result_cache import ResultCache, parse_fresh_command
+from preprocess import ImagePreprocessor
+from state_db import StateDB
+from input_image import close_images
+from scheduler import JobScheduler, Priority, QueueFullError, QuotaExceededError
 import signal
-import os
 import uuid
 import re
-from PIL import Image
 
 # Setup logging
 logging.basicConfig(
@@ -42,29 +49,25 @@ def parse_aspect_ratio_command(prompt: str) -> tuple[str, str | None]:
     
     return (clean_prompt, aspect_ratio)
 
-def detect_aspect_ratio_from_images(image_paths: list) -> str:
+def detect_aspect_ratio_from_images(images: list) -> str:
     """Analyze images to determine if they are portrait or landscape.
     Returns 'portrait' if all images are portrait, 'landscape' otherwise (default).
     Handles EXIF orientation metadata for rotated images."""
-    if not image_paths:
-        logger.info("No image paths provided for aspect ratio detection")
+    if not images:
+        logger.info("No images provided for aspect ratio detection")
         return "landscape"  # Default
     
-    logger.info(f"Detecting aspect ratio from {len(image_paths)} images: {image_paths}")
+    logger.info(f"Detecting aspect ratio from {len(images)} images")
     orientations = []
-    for path in image_paths:
+    for image in images:
         try:
-            with Image.open(path) as img:
-                # Apply EXIF orientation to get the true visual dimensions
-                # Many phone cameras store images in landscape with EXIF rotation
-                from PIL import ImageOps
-                img = ImageOps.exif_transpose(img)
-                width, height = img.size
-                orientation = "portrait" if height > width else "landscape"
-                logger.info(f"Image {path}: {width}x{height} -> {orientation}")
-                orientations.append(orientation)
+            # InputImage applies the EXIF orientation to get the true visual dimensions
+            width, height = image.size
+            orientation = image.orientation
+            logger.info(f"Image {image.name}: {width}x{height} -> {orientation}")
+            orientations.append(orientation)
         except Exception as e:
-            logger.warning(f"Could not analyze image {path}: {e}")
+            logger.warning(f"Could not analyze image {image.name}: {e}")
             orientations.append("landscape")  # Default on error
     
     # If all images are portrait, return portrait; otherwise landscape
@@ -72,17 +75,199 @@ def detect_aspect_ratio_from_images(image_paths: list) -> str:
     logger.info(f"Aspect ratio detection result: {result} (orientations: {orientations})")
     return result
 
-# Global client
-browser_client = NanoBananaClient()
+# Global client (one browser per profile in USER_DATA_DIRS)
+browser_client = ShardedClient()
+# All browser work goes through the scheduler: one worker per browser tab, across all profiles
+scheduler = JobScheduler(
+    concurrency=browser_client.pool_size,
+    max_depth=config.QUEUE_MAX_DEPTH,
+    quota_burst=config.USER_QUOTA_BURST,
+    quota_per_minute=config.USER_QUOTA_PER_MINUTE,
+)
+metrics.Gauge("nanobanana_queue_depth", "Jobs waiting for a browser tab.", func=lambda: scheduler.depth)
+metrics.Gauge("nanobanana_jobs_running", "Jobs currently running in the browser.", func=lambda: scheduler.running)
+metrics_server = metrics.MetricsServer(config.METRICS_HOST, config.METRICS_PORT) if config.METRICS_PORT else None
+# Downloaded Telegram files, so repeat references to a photo or album skip the download
+file_cache = FileCache(
+    max_bytes=int(config.FILE_CACHE_MAX_MB * 1024 * 1024),
+    disk_dir=config.FILE_CACHE_DIR or None,
+    disk_max_bytes=int(config.FILE_CACHE_DISK_MAX_MB * 1024 * 1024),
+)
+metrics.Gauge("nanobanana_file_cache_memory_bytes", "Bytes held in the file cache memory tier.", func=lambda: file_cache.memory_bytes)
+metrics.Gauge("nanobanana_file_cache_disk_bytes", "Bytes held in the file cache disk tier.", func=lambda: file_cache.disk_bytes)
+# Generated results, so a repeated request (or one identical to a request in flight) skips the browser
+result_cache = ResultCache(
+    max_bytes=int(config.RESULT_CACHE_MAX_MB * 1024 * 1024),
+    ttl_s=config.RESULT_CACHE_TTL_H * 3600,
+    make_image=GeneratedImage,
+    # Errors about the requesting user rather than the request; waiters run it themselves
+    private_errors=(QuotaExceededError, QueueFullError),
+)
+metrics.Gauge("nanobanana_result_cache_bytes", "Bytes held in the result cache.", func=lambda: result_cache.nbytes)
+# Downscales and re-encodes large inputs (process pool) before they're uploaded to the browser
+preprocessor = ImagePreprocessor()
 pending_media_groups = {}
+
+
+class GenerationRecord:
+    """What an Upscale button needs to find its image again."""
+    __slots__ = ("prompt", "chat_id", "image_index", "aspect_ratio", "result_id")
+
+    def __init__(self, prompt: str, chat_id: int = None, image_index: int = 0, aspect_ratio: str = None,
+                 result_id: str = None):
+        self.prompt = prompt
+        self.chat_id = chat_id
+        self.image_index = image_index
+        self.aspect_ratio = aspect_ratio
+        self.result_id = result_id
+
+
+class MediaGroupFile:
+    """One image of an album, as needed to fetch it again."""
+    __slots__ = ("file_id", "file_type", "file_unique_id")
+
+    def __init__(self, file_id: str, file_type: str, file_unique_id: str):
+        self.file_id = file_id
+        self.file_type = file_type
+        self.file_unique_id = file_unique_id
+
+
+HOUR = 3600
 # Cache to store prompts for callbacks to avoid data limits
-# Key: request_id, Value: prompt
-generation_cache = {}
+# Key: request_id, Value: GenerationRecord
+generation_cache = BoundedStore(
+    "generation", config.GENERATION_CACHE_MAX_ENTRIES, config.GENERATION_CACHE_TTL_H * HOUR
+)
 # Cache to store media group file_ids so replies to albums can get all images
-# Key: media_group_id, Value: list of (file_id, file_type) tuples
-media_group_cache = {}
-# Map message_id to media_group_id for lookup when replying
-message_to_media_group = {}
+# Key: media_group_id, Value: list of MediaGroupFile
+media_group_cache = BoundedStore(
+    "media_group", config.MEDIA_GROUP_CACHE_MAX_ENTRIES, config.MEDIA_GROUP_CACHE_TTL_H * HOUR
+)
+# Map (chat_id, message_id) to media_group_id for lookup when replying
+message_to_media_group = BoundedStore(
+    "message_to_media_group", config.MEDIA_GROUP_CACHE_MAX_ENTRIES * 10, config.MEDIA_GROUP_CACHE_TTL_H * HOUR
+)
+
+
+# The stores above are the hot tier; the state DB keeps the same records across restarts
+state_db = StateDB(config.STATE_DB_PATH, retention_days=config.STATE_DB_RETENTION_DAYS)
+
+
+def remember_generation(req_id: str, record: GenerationRecord):
+    generation_cache[req_id] = record
+    state_db.save_request(req_id, record.prompt, record.chat_id, record.image_index, record.aspect_ratio,
+                          record.result_id)
+
+
+async def load_generation(req_id: str) -> GenerationRecord | None:
+    record = generation_cache.get(req_id)
+    if record is None:
+        row = await state_db.load_request(req_id)
+        if row:
+            record = GenerationRecord(row["prompt"], row["chat_id"], row["image_index"], row["aspect_ratio"],
+                                      row["result_id"])
+            generation_cache[req_id] = record
+    return record
+
+
+def remember_media_group_file(message, file_id: str, file_type: str, file_unique_id: str):
+    """Records one album file so replies to any message of the album can use all of its images."""
+    media_group_id = message.media_group_id
+    files = media_group_cache.setdefault(media_group_id, [])
+    if not any(f.file_unique_id == file_unique_id for f in files):
+        files.append(MediaGroupFile(file_id, file_type, file_unique_id))
+    # Map this message to its media_group_id
+    message_to_media_group[(message.chat_id, message.message_id)] = media_group_id
+    state_db.save_media_group_file(media_group_id, message.chat_id, message.message_id, file_id, file_type,
+                                   file_unique_id, len(files) - 1)
+    return files
+
+
+def reserve_album_slot(update: Update) -> int:
+    """Claims the next image position in the message's pending album, before any download is
+    awaited. Album messages are handled concurrently and their downloads finish in any order;
+    the slot keeps the images in message order. Returns the slot for fill_album_slot()."""
+    media_group_id = update.message.media_group_id
+    group = pending_media_groups.get(media_group_id)
+    if group is None:
+        # The pending group owns its images until process_album hands them on
+        group = pending_media_groups[media_group_id] = {
+            'images': [],
+            'reply_images': [],  # Reply images of the first message
+            'prompt': None,
+            'task': None,
+            'downloading': 0,
+            'chat_id': update.effective_chat.id,
+            'user_id': update.effective_user.id if update.effective_user else None,
+            'message_id': update.message.message_id  # Use the first message id for reply
+        }
+    group['images'].append(None)
+    group['downloading'] += 1
+    # Hold the debounce until this download is in too
+    if group['task']:
+        group['task'].cancel()
+        group['task'] = None
+    return len(group['images']) - 1
+
+
+def fill_album_slot(context, update: Update, slot: int, image, reply_images: list, missing_prompt_text: str):
+    """Puts a downloaded album image (None if the download failed) in its slot and, once no
+    download of the album is outstanding, (re)starts the debounce that sends it off."""
+    media_group_id = update.message.media_group_id
+    group = pending_media_groups[media_group_id]
+    group['downloading'] -= 1
+    group['images'][slot] = image
+    if slot == 0:
+        group['reply_images'] = reply_images
+    else:
+        # Only the first message's reply images are kept
+        close_images(reply_images)
+
+    # Capture caption from any message in the group
+    if update.message.caption:
+        group['prompt'] = update.message.caption
+
+    # Reset/Start debounce timer
+    if group['task']:
+        group['task'].cancel()
+        group['task'] = None
+    if not group['downloading']:
+        group['task'] = asyncio.create_task(process_album(context, media_group_id, missing_prompt_text))
+
+
+async def process_album(context, media_group_id, missing_prompt_text: str):
+    await asyncio.sleep(2) # Wait 2 seconds for other photos
+    data = pending_media_groups.pop(media_group_id, None)
+    if data is None:
+        return
+    # Combine reply images with album images
+    all_images = data['reply_images'] + [image for image in data['images'] if image is not None]
+    try:
+        if not data['prompt']:
+            await context.bot.send_message(chat_id=data['chat_id'], text=missing_prompt_text, reply_to_message_id=data['message_id'])
+            return
+
+        await process_generation_internal(context, data['chat_id'], data['prompt'], all_images, data['message_id'], data['user_id'])
+    finally:
+        close_images(all_images)
+
+
+async def find_media_group_files(message) -> list | None:
+    """The cached files of the album `message` belongs to, or None."""
+    key = (message.chat_id, message.message_id)
+    media_group_id = message.media_group_id or message_to_media_group.get(key)
+    if not media_group_id:
+        media_group_id = await state_db.find_media_group(*key)
+        if not media_group_id:
+            return None
+        message_to_media_group[key] = media_group_id
+    files = media_group_cache.get(media_group_id)
+    if files is None:
+        rows = await state_db.load_media_group(media_group_id)
+        if not rows:
+            return None
+        files = media_group_cache[media_group_id] = [MediaGroupFile(**row) for row in rows]
+    return files
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(
@@ -93,53 +278,42 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def extract_images_from_message(message, bot=None) -> list:
     """Extract and download all images from a message (photos or image documents).
     If the message is part of a media group, extracts ALL images from that group.
-    Returns a list of absolute file paths."""
-    image_paths = []
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
+    Returns a list of InputImage objects; the caller owns them and must close them."""
+    images = []
     
     # Check if this message is part of a cached media group
-    msg_id = message.message_id
-    media_group_id = message.media_group_id or message_to_media_group.get(msg_id)
+    group_files = await find_media_group_files(message)
     
-    if media_group_id and media_group_id in media_group_cache:
+    if group_files:
         # Extract all images from the cached media group
-        logger.info(f"Found media group {media_group_id} with {len(media_group_cache[media_group_id])} files")
-        for file_id, file_type in media_group_cache[media_group_id]:
+        logger.info(f"Found media group with {len(group_files)} files")
+        # Fallback: use the bot from the message context
+        bot = bot or message.get_bot()
+        for f in group_files:
             try:
-                if bot:
-                    file_obj = await bot.get_file(file_id)
-                else:
-                    # Fallback: try to get file from message context
-                    file_obj = await message._bot.get_file(file_id)
-                
-                ext = "jpg" if file_type == "photo" else file_type
-                file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.{ext}")
-                await file_obj.download_to_drive(file_path)
-                image_paths.append(os.path.abspath(file_path))
+                mime = "image/jpeg" if f.file_type == "photo" else f"image/{f.file_type}"
+                with metrics.time_stage("bot", "telegram_download"):
+                    images.append(await file_cache.fetch(bot, f.file_id, f.file_unique_id, mime))
             except Exception as e:
-                logger.error(f"Failed to download file {file_id}: {e}")
-        return image_paths
+                logger.error(f"Failed to download file {f.file_id}: {e}")
+        return images
     
     # Single message case - extract directly
     # Handle photos
     if message.photo:
-        photo_file = await message.photo[-1].get_file()
-        file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.jpg")
-        await photo_file.download_to_drive(file_path)
-        image_paths.append(os.path.abspath(file_path))
+        photo = message.photo[-1]
+        with metrics.time_stage("bot", "telegram_download"):
+            images.append(await file_cache.fetch(bot or message.get_bot(), photo.file_id, photo.file_unique_id))
     
     # Handle documents (could be images sent as files)
     if message.document:
         mime = message.document.mime_type or ""
         if mime.startswith("image/"):
-            doc_file = await message.document.get_file()
-            ext = mime.split("/")[-1] if "/" in mime else "jpg"
-            file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.{ext}")
-            await doc_file.download_to_drive(file_path)
-            image_paths.append(os.path.abspath(file_path))
+            doc = message.document
+            with metrics.time_stage("bot", "telegram_download"):
+                images.append(await file_cache.fetch(bot or message.get_bot(), doc.file_id, doc.file_unique_id, mime))
     
-    return image_paths
+    return images
 
 async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     prompt = " ".join(context.args)
@@ -155,118 +329,72 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await process_generation(update, context, prompt, reply_images if reply_images else None)
     finally:
-        # Cleanup reply images
-        for f in reply_images:
-            if os.path.exists(f):
-                try:
-                    os.remove(f)
-                except: pass
+        close_images(reply_images)
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     media_group_id = update.message.media_group_id
-    photo_file = await update.message.photo[-1].get_file()
+    photo = update.message.photo[-1]
     
     # Cache file_id for media group lookups (for reply-to-album support)
     if media_group_id:
-        if media_group_id not in media_group_cache:
-            media_group_cache[media_group_id] = []
         # Store the highest resolution photo's file_id
-        file_id = update.message.photo[-1].file_id
-        if (file_id, "photo") not in media_group_cache[media_group_id]:
-            media_group_cache[media_group_id].append((file_id, "photo"))
-        # Map this message_id to its media_group_id
-        message_to_media_group[update.message.message_id] = media_group_id
-        logger.info(f"Cached photo in media group {media_group_id}, total files: {len(media_group_cache[media_group_id])}")
-    
-    # Create temp directory
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.jpg")
-    await photo_file.download_to_drive(file_path)
-    abs_path = os.path.abspath(file_path)
-    
-    # Extract images from reply_to_message if present
+        files = remember_media_group_file(update.message, photo.file_id, "photo", photo.file_unique_id)
+        logger.info(f"Cached photo in media group {media_group_id}, total files: {len(files)}")
+        slot = reserve_album_slot(update)
+
+    image = None
     reply_images = []
-    if update.message.reply_to_message:
-        reply_images = await extract_images_from_message(update.message.reply_to_message, context.bot)
+    try:
+        with metrics.time_stage("bot", "telegram_download"):
+            image = await file_cache.fetch(context.bot, photo.file_id, photo.file_unique_id)
+
+        # Extract images from reply_to_message if present
+        if update.message.reply_to_message:
+            reply_images = await extract_images_from_message(update.message.reply_to_message, context.bot)
+    finally:
+        if media_group_id:
+            fill_album_slot(context, update, slot, image, reply_images, "Please provide a caption for the album.")
 
     # Single Photo Case
     if not media_group_id:
         if not update.message.caption:
             await update.message.reply_text("Please provide a prompt (caption) with your image.")
-            # Cleanup immediately
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
-            for f in reply_images:
-                if os.path.exists(f):
-                    try: os.remove(f)
-                    except: pass
+            # Release immediately
+            close_images(reply_images + [image])
             return
 
         prompt = update.message.caption
         # Combine reply images with the new image
-        all_images = reply_images + [abs_path]
+        all_images = reply_images + [image]
         try:
             await process_generation(update, context, prompt, all_images)
         finally:
-            for f in all_images:
-                if os.path.exists(f):
-                    try: os.remove(f)
-                    except: pass
+            close_images(all_images)
         return
 
-    # Media Group Case (Album)
-    if media_group_id not in pending_media_groups:
-        pending_media_groups[media_group_id] = {
-            'files': [],
-            'reply_images': reply_images,  # Store reply images from first message
-            'prompt': None,
-            'task': None,
-            'chat_id': update.effective_chat.id,
-            'message_id': update.message.message_id # Use the first message id for reply
-        }
+def queue_status_updater(context, chat_id, reply_to_msg_id, start_text):
+    """Returns an on_position callback for the scheduler that posts a single status message
+    ("You are #N in the queue") and edits it as the queue moves, then to `start_text`."""
+    status_msg = None
 
-    group = pending_media_groups[media_group_id]
-    group['files'].append(abs_path)
-    
-    # Capture caption from any message in the group
-    if update.message.caption:
-        group['prompt'] = update.message.caption
+    async def on_position(position: int):
+        nonlocal status_msg
+        text = start_text if position == 0 else f"⏳ You are #{position} in the queue..."
+        if status_msg is None:
+            status_msg = await context.bot.send_message(chat_id=chat_id, text=text, reply_to_message_id=reply_to_msg_id)
+        elif status_msg.text != text:
+            status_msg = await status_msg.edit_text(text)
 
-    # Reset/Start debounce timer
-    if group['task']:
-        group['task'].cancel()
-    
-    msg_id = update.message.message_id # Keep updating or use first? Using first is fine.
-    
-    async def process_group():
-        await asyncio.sleep(2) # Wait 2 seconds for other photos
-        if media_group_id in pending_media_groups:
-            data = pending_media_groups.pop(media_group_id)
-            # Combine reply images with album files
-            all_files = data.get('reply_images', []) + data['files']
-            try:
-                if not data['prompt']:
-                     await context.bot.send_message(chat_id=data['chat_id'], text="Please provide a caption for the album.", reply_to_message_id=data['message_id'])
-                     return
-                
-                await process_generation_internal(context, data['chat_id'], data['prompt'], all_files, data['message_id'])
-
-            finally:
-                # Cleanup all files
-                for f in all_files:
-                    if os.path.exists(f):
-                        try:
-                            os.remove(f)
-                        except: pass
-    
-    group['task'] = asyncio.create_task(process_group())
+    return on_position
 
-async def process_generation(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str, image_paths: list = None):
+async def process_generation(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str, images: list = None):
     # Wrapper for standard calls
-    await process_generation_internal(context, update.effective_chat.id, prompt, image_paths, update.message.message_id)
+    user_id = update.effective_user.id if update.effective_user else None
+    await process_generation_internal(context, update.effective_chat.id, prompt, images, update.message.message_id, user_id)
 
-async def process_generation_internal(context, chat_id, prompt, image_paths, reply_to_msg_id):
+async def process_generation_internal(context, chat_id, prompt, images, reply_to_msg_id, user_id=None):
+    # /fresh anywhere in the prompt skips the result cache
+    prompt, fresh = parse_fresh_command(prompt)
     # Parse aspect ratio command from prompt (e.g., /portrait, /landscape)
     clean_prompt, explicit_aspect = parse_aspect_ratio_command(prompt)
     
@@ -274,22 +402,61 @@ async def process_generation_internal(context, chat_id, prompt, image_paths, rep
     if explicit_aspect:
         aspect_ratio = explicit_aspect
         logger.info(f"Using explicit aspect ratio: {aspect_ratio}")
-    elif image_paths:
-        aspect_ratio = detect_aspect_ratio_from_images(image_paths)
+    elif images:
+        # Header parsing only, but still off the event loop: a large album is a lot of files
+        with metrics.time_stage("bot", "aspect_detection"):
+            aspect_ratio = await asyncio.to_thread(detect_aspect_ratio_from_images, images)
         logger.info(f"Auto-detected aspect ratio from images: {aspect_ratio}")
     else:
         aspect_ratio = None  # Use website default
     
     aspect_info = f", Aspect: {aspect_ratio}" if aspect_ratio else ""
-    await context.bot.send_message(chat_id=chat_id, text=f"Generating image... (Images input: {len(image_paths) if image_paths else 0}{aspect_info})", reply_to_message_id=reply_to_msg_id)
+    on_position = queue_status_updater(
+        context, chat_id, reply_to_msg_id,
+        f"Generating image... (Images input: {len(images) if images else 0}{aspect_info})",
+    )
 
     try:
-        # Generate (returns a list of io.BytesIO)
-        images_data = await browser_client.generate_image(clean_prompt, image_paths, aspect_ratio)
+        # Generate (returns a list of GeneratedImage streams); cache hits skip the queue
+        cache_key = await result_cache.make_key(clean_prompt, images, aspect_ratio) if result_cache.enabled else None
+        async def generate():
+            # Preprocessing starts once the job is queued, so a full queue or a user over quota
+            # costs no pool time, and it overlaps the wait for a tab
+            prepared = None
+            started = False
+
+            def start_preprocessing():
+                nonlocal prepared
+                prepared = asyncio.ensure_future(preprocessor.prepare(images, aspect_ratio))
+
+            async def run():
+                nonlocal started
+                started = True
+                upload_images = await prepared
+                try:
+                    return await browser_client.generate_image(clean_prompt, upload_images, aspect_ratio)
+                finally:
+                    preprocessor.release(upload_images, images)
+
+            try:
+                return await scheduler.submit(
+                    chat_id, user_id, Priority.GENERATE, run, on_position, on_admitted=start_preprocessing,
+                )
+            finally:
+                # A job that never ran (dropped from the queue) leaves its preparation to us
+                if prepared is not None and not started:
+                    if not prepared.done():
+                        prepared.cancel()
+                    elif not prepared.cancelled():
+                        preprocessor.release(prepared.result(), images)
+
+        images_data = await result_cache.get_or_generate(cache_key, generate, fresh=fresh)
         
         if not images_data:
+            metrics.JOBS_TOTAL.inc(kind="generate", outcome="empty")
             await context.bot.send_message(chat_id=chat_id, text="No images were generated.", reply_to_message_id=reply_to_msg_id)
             return
+        metrics.JOBS_TOTAL.inc(kind="generate", outcome="success")
 
         # Send each image
         for idx, img_stream in enumerate(images_data):
@@ -298,7 +465,8 @@ async def process_generation_internal(context, chat_id, prompt, image_paths, rep
                 img_stream.seek(0)
                 # Create UPSCALE buttons
                 req_id = str(uuid.uuid4())[:8]
-                generation_cache[req_id] = prompt
+                remember_generation(req_id, GenerationRecord(clean_prompt, chat_id, idx, aspect_ratio,
+                                                             getattr(img_stream, "result_id", None)))
                 
                 keyboard = [
                     [
@@ -309,21 +477,35 @@ async def process_generation_internal(context, chat_id, prompt, image_paths, rep
                 ]
                 reply_markup = InlineKeyboardMarkup(keyboard)
 
-                await context.bot.send_photo(
-                    chat_id=chat_id, 
-                    photo=img_stream, 
+                with metrics.time_stage("bot", "send_photo"):
+                    await context.bot.send_photo(
+                        chat_id=chat_id, 
+                        photo=img_stream, 
 
-                    reply_to_message_id=reply_to_msg_id,
-                    reply_markup=reply_markup
-                )
+                        reply_to_message_id=reply_to_msg_id,
+                        reply_markup=reply_markup
+                    )
             except Exception as e:
                 logger.error(f"Failed to send image {idx}: {e}")
     
+    except QueueFullError:
+        metrics.JOBS_TOTAL.inc(kind="generate", outcome="queue_full")
+        logger.warning(f"Queue full, rejecting generation for chat {chat_id}")
+        await context.bot.send_message(chat_id=chat_id, text="The bot is busy right now, please try again in a few minutes.", reply_to_message_id=reply_to_msg_id)
+
+    except QuotaExceededError as e:
+        metrics.JOBS_TOTAL.inc(kind="generate", outcome="quota_exceeded")
+        logger.info(f"User {user_id} over quota (retry in {e.retry_after:.0f}s)")
+        await context.bot.send_message(chat_id=chat_id, text=f"You're sending requests too fast. Please try again in {e.retry_after:.0f}s.", reply_to_message_id=reply_to_msg_id)
+
     except WebsiteError as e:
+        metrics.JOBS_TOTAL.inc(kind="generate", outcome="website_error")
+        metrics.record_website_error("generate", str(e))
         logger.warning(f"Website rejected request: {e}")
         await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Request rejected: {e}", reply_to_message_id=reply_to_msg_id)
                 
     except Exception as e:
+        metrics.JOBS_TOTAL.inc(kind="generate", outcome="failed")
         logger.error(f"Generation failed: {e}")
         await context.bot.send_message(chat_id=chat_id, text="Sorry, something went wrong with the generation.", reply_to_message_id=reply_to_msg_id)
 
@@ -343,7 +525,9 @@ async def upscale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Try to get prompt from cache first
-    prompt = generation_cache.get(req_id)
+    record = await load_generation(req_id)
+    prompt = record.prompt if record else None
+    result_id = record.result_id if record else None
     
     # Fallback: Get prompt from the replied message (Generic/Stateless)
     if not prompt:
@@ -361,29 +545,52 @@ async def upscale_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Could not determine prompt for upscaling (Session expired and original message lost).")
         return
 
-    await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Upscaling image {img_idx+1} to {scale}...", reply_to_message_id=query.message.message_id)
+    on_position = queue_status_updater(
+        context, update.effective_chat.id, query.message.message_id,
+        f"Upscaling image {img_idx+1} to {scale}...",
+    )
+    user_id = update.effective_user.id if update.effective_user else None
 
     try:
-        upscaled_stream = await browser_client.upscale_image(prompt, img_idx, scale)
+        upscaled_stream = await scheduler.submit(
+            update.effective_chat.id, user_id, Priority.UPSCALE,
+            lambda: browser_client.upscale_image(prompt, img_idx, scale, result_id),
+            on_position,
+        )
         
         if not upscaled_stream:
+             metrics.JOBS_TOTAL.inc(kind="upscale", outcome="empty")
              await context.bot.send_message(chat_id=update.effective_chat.id, text="Failed to retrieve upscaled image.")
              return
-
-        upscaled_stream.seek(0)
-        await context.bot.send_document(
-            chat_id=update.effective_chat.id,
-            document=upscaled_stream,
-            filename=f"upscaled_{scale}_{req_id}.png",
-            # caption=f"Upscaled to {scale}", # Optional: User seems to prefer minimal captions, but this is a file.
-            reply_to_message_id=query.message.message_id
-        )
+        metrics.JOBS_TOTAL.inc(kind="upscale", outcome="success")
+
+        # The upscale is a file on disk: hand the open handle to the upload (read_file_handle=False)
+        # so it's streamed in chunks instead of read into memory; closing it frees the file.
+        with upscaled_stream, metrics.time_stage("bot", "send_document"):
+            upscaled_stream.seek(0)
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=InputFile(upscaled_stream, filename=f"upscaled_{scale}_{req_id}.png", read_file_handle=False),
+                # caption=f"Upscaled to {scale}", # Optional: User seems to prefer minimal captions, but this is a file.
+                reply_to_message_id=query.message.message_id
+            )
+
+    except QueueFullError:
+        metrics.JOBS_TOTAL.inc(kind="upscale", outcome="queue_full")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text="The bot is busy right now, please try again in a few minutes.")
+
+    except QuotaExceededError as e:
+        metrics.JOBS_TOTAL.inc(kind="upscale", outcome="quota_exceeded")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"You're sending requests too fast. Please try again in {e.retry_after:.0f}s.")
 
     except WebsiteError as e:
+        metrics.JOBS_TOTAL.inc(kind="upscale", outcome="website_error")
+        metrics.record_website_error("upscale", str(e))
         logger.warning(f"Website rejected upscale request: {e}")
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"⚠️ Upscale rejected: {e}")
 
     except Exception as e:
+        metrics.JOBS_TOTAL.inc(kind="upscale", outcome="failed")
         logger.error(f"Upscaling failed: {e}")
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"Upscaling failed: {e}")
 
@@ -402,10 +609,7 @@ async def handle_text_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
                      reply_msg.document.mime_type.startswith("image/"))
     
     # Also check if this message is part of a cached media group
-    is_in_media_group = (
-        reply_msg.media_group_id in media_group_cache or
-        reply_msg.message_id in message_to_media_group
-    )
+    is_in_media_group = bool(await find_media_group_files(reply_msg))
     
     if not has_photo and not has_image_doc and not is_in_media_group:
         # Not a reply to an image, ignore
@@ -425,11 +629,7 @@ async def handle_text_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         await process_generation(update, context, prompt.strip(), reply_images)
     finally:
-        # Cleanup
-        for f in reply_images:
-            if os.path.exists(f):
-                try: os.remove(f)
-                except: pass
+        close_images(reply_images)
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle documents that are images (sent as files, not compressed)."""
@@ -445,108 +645,77 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Cache file_id for media group lookups (for reply-to-album support)
     if media_group_id:
-        if media_group_id not in media_group_cache:
-            media_group_cache[media_group_id] = []
         # Store the document's file_id
-        file_id = doc.file_id
         ext = mime.split("/")[-1] if "/" in mime else "jpg"
-        if (file_id, ext) not in media_group_cache[media_group_id]:
-            media_group_cache[media_group_id].append((file_id, ext))
-        # Map this message_id to its media_group_id
-        message_to_media_group[update.message.message_id] = media_group_id
-        logger.info(f"Cached document in media group {media_group_id}, total files: {len(media_group_cache[media_group_id])}")
-    
-    # Download the document
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    ext = mime.split("/")[-1] if "/" in mime else "jpg"
-    file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.{ext}")
-    doc_file = await doc.get_file()
-    await doc_file.download_to_drive(file_path)
-    abs_path = os.path.abspath(file_path)
-    
-    # Extract images from reply_to_message if present
+        files = remember_media_group_file(update.message, doc.file_id, ext, doc.file_unique_id)
+        logger.info(f"Cached document in media group {media_group_id}, total files: {len(files)}")
+        slot = reserve_album_slot(update)
+
+    image = None
     reply_images = []
-    if update.message.reply_to_message:
-        reply_images = await extract_images_from_message(update.message.reply_to_message, context.bot)
+    try:
+        # Download the document
+        with metrics.time_stage("bot", "telegram_download"):
+            image = await file_cache.fetch(context.bot, doc.file_id, doc.file_unique_id, mime)
+
+        # Extract images from reply_to_message if present
+        if update.message.reply_to_message:
+            reply_images = await extract_images_from_message(update.message.reply_to_message, context.bot)
+    finally:
+        if media_group_id:
+            fill_album_slot(context, update, slot, image, reply_images, "Please prompt for the album.")
 
     # Single Document Case
     if not media_group_id:
         if not update.message.caption:
             await update.message.reply_text("Please provide a prompt (caption) with your image file.")
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
-            for f in reply_images:
-                if os.path.exists(f):
-                    try: os.remove(f)
-                    except: pass
+            close_images(reply_images + [image])
             return
 
         prompt = update.message.caption
-        all_images = reply_images + [abs_path]
+        all_images = reply_images + [image]
         try:
             await process_generation(update, context, prompt, all_images)
         finally:
-            for f in all_images:
-                if os.path.exists(f):
-                    try: os.remove(f)
-                    except: pass
+            close_images(all_images)
         return
 
-    # Media Group Case (Album of documents)
-    if media_group_id not in pending_media_groups:
-        pending_media_groups[media_group_id] = {
-            'files': [],
-            'reply_images': reply_images,
-            'prompt': None,
-            'task': None,
-            'chat_id': update.effective_chat.id,
-            'message_id': update.message.message_id
-        }
-
-    group = pending_media_groups[media_group_id]
-    group['files'].append(abs_path)
-    
-    if update.message.caption:
-        group['prompt'] = update.message.caption
-
-    if group['task']:
-        group['task'].cancel()
-    
-    async def process_group():
-        await asyncio.sleep(2)
-        if media_group_id in pending_media_groups:
-            data = pending_media_groups.pop(media_group_id)
-            all_files = data.get('reply_images', []) + data['files']
-            try:
-                if not data['prompt']:
-                    await context.bot.send_message(chat_id=data['chat_id'], text="Please prompt for the album.", reply_to_message_id=data['message_id'])
-                    return
-                
-                await process_generation_internal(context, data['chat_id'], data['prompt'], all_files, data['message_id'])
-            finally:
-                for f in all_files:
-                    if os.path.exists(f):
-                        try: os.remove(f)
-                        except: pass
-    
-    group['task'] = asyncio.create_task(process_group())
-
 async def post_init(application):
     """Initializes the browser when the bot application starts."""
+    if metrics_server:
+        await metrics_server.start()
+    await state_db.start()
     await browser_client.start()
+    scheduler.start()
 
 async def post_shutdown(application):
     """Cleans up browser resources when the bot application stops."""
+    await scheduler.stop()
     await browser_client.stop()
+    preprocessor.close()
+    await file_cache.close()
+    await state_db.close()
+    if metrics_server:
+        await metrics_server.stop()
+
+def build_application(token: str, base_url: str = None, base_file_url: str = None, concurrent_updates=None):
+    """Builds the Application with all bot handlers registered.
+
+    `base_url`/`base_file_url` point the bot at a different Bot API server (see fake_telegram.py).
+    Updates are handled concurrently, up to every job the scheduler can hold (queued plus
+    running), so a burst reaches the scheduler and the tab pool at once instead of one
+    handler at a time; pass `concurrent_updates=False` to handle them in order."""
+    builder = ApplicationBuilder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    if base_url:
+        builder = builder.base_url(base_url)
+    if base_file_url:
+        builder = builder.base_file_url(base_file_url)
+    if concurrent_updates is None:
+        concurrent_updates = scheduler.max_depth + scheduler.concurrency
+    if concurrent_updates:
+        builder = builder.concurrent_updates(concurrent_updates)
+    application = builder.build()
 
-if __name__ == '__main__':
-    if not config.TELEGRAM_TOKEN:
-        print("Error: TELEGRAM_TOKEN not found in environment variables.")
-        exit(1)
-
-    application = ApplicationBuilder().token(config.TELEGRAM_TOKEN).post_init(post_init).post_shutdown(post_shutdown).build()
-    
     # Handlers
     application.add_handler(CommandHandler('start', start_command))
     application.add_handler(CommandHandler('img', img_command))
@@ -556,6 +725,14 @@ if __name__ == '__main__':
     application.add_handler(MessageHandler(filters.Document.IMAGE & ~filters.COMMAND, handle_document))
     # Handle text-only replies to images (must be after PHOTO/DOCUMENT handlers to not conflict)
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & filters.REPLY, handle_text_reply))
+    return application
+
+if __name__ == '__main__':
+    if not config.TELEGRAM_TOKEN:
+        print("Error: TELEGRAM_TOKEN not found in environment variables.")
+        exit(1)
+
+    application = build_application(config.TELEGRAM_TOKEN)
 
     print("Bot is running... Press Ctrl+C to stop.")
     
@@ -0,0 +1,116 @@
+import time
+import logging
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+STORE_ENTRIES = metrics.Gauge(
+    "nanobanana_store_entries", "Entries held per bounded store (summed over stores of the same name).", ["store"]
+)
+STORE_EVICTIONS = metrics.Counter(
+    "nanobanana_store_evictions_total", "Entries dropped per bounded store, by reason (ttl or capacity).",
+    ["store", "reason"],
+)
+
+_MISSING = object()
+
+
+class _Entry:
+    __slots__ = ("expires_at", "value")
+
+    def __init__(self, expires_at: float, value):
+        self.expires_at = expires_at
+        self.value = value
+
+
+class BoundedStore:
+    """Dict-like map with LRU eviction beyond `max_entries` and a sliding TTL.
+
+    Every read or write moves an entry to the back and restarts its TTL, so the entries
+    are always ordered by expiry as well as by use: expired ones are trimmed from the
+    front on every write and skipped on reads, and memory stays bounded however long the
+    process runs. Keep values compact (slotted records rather than dicts) since this is
+    where long-lived per-message state accumulates.
+
+    Stores sharing a name (e.g. one per browser shard) add up in the entries gauge."""
+
+    def __init__(self, name: str, max_entries: int, ttl_s: float = None):
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self._items: OrderedDict[object, _Entry] = OrderedDict()
+        # Entries this store has added to the gauge so far
+        self._published = 0
+        STORE_ENTRIES.inc(0, store=name)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def _expiry(self, now: float) -> float:
+        return now + self.ttl_s if self.ttl_s else float("inf")
+
+    def _evict(self, now: float):
+        while self._items:
+            key, entry = next(iter(self._items.items()))
+            if entry.expires_at > now:
+                break
+            del self._items[key]
+            STORE_EVICTIONS.inc(store=self.name, reason="ttl")
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+            STORE_EVICTIONS.inc(store=self.name, reason="capacity")
+        self._publish()
+
+    def _publish(self):
+        STORE_ENTRIES.inc(len(self._items) - self._published, store=self.name)
+        self._published = len(self._items)
+
+    def get(self, key, default=None):
+        entry = self._items.get(key)
+        if entry is None:
+            return default
+        now = time.monotonic()
+        if entry.expires_at <= now:
+            del self._items[key]
+            STORE_EVICTIONS.inc(store=self.name, reason="ttl")
+            self._publish()
+            return default
+        entry.expires_at = self._expiry(now)
+        self._items.move_to_end(key)
+        return entry.value
+
+    def set(self, key, value):
+        now = time.monotonic()
+        self._items[key] = _Entry(self._expiry(now), value)
+        self._items.move_to_end(key)
+        self._evict(now)
+
+    def setdefault(self, key, default):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            self.set(key, default)
+            value = default
+        return value
+
+    def pop(self, key, default=None):
+        entry = self._items.pop(key, None)
+        self._publish()
+        if entry is None or entry.expires_at <= time.monotonic():
+            return default
+        return entry.value
+
+    def purge_expired(self):
+        self._evict(time.monotonic())
@@ -1,27 +1,623 @@
 import asyncio
+import base64
+import hashlib
 import io
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin
 from playwright.async_api import async_playwright, BrowserContext
 # from playwright_stealth import stealth_async
 import logging
+import random
 import config
+import metrics
+from timing import StepTimer
+from bounded_store import BoundedStore
+from scheduler import ByteBudget
+from memory_governor import MemoryGovernor
+from browser_watchdog import BrowserWatchdog
+from request_policy import RequestPolicy
 
 logger = logging.getLogger(__name__)
 
+UPSCALE_DOWNLOADS = metrics.Counter(
+    "nanobanana_upscale_downloads_total",
+    "Upscale downloads by path (cached_url or menu_link = direct fetch, ui = browser download).", ["path"]
+)
+UPSCALE_TARGETS = metrics.Counter(
+    "nanobanana_upscale_targets_total", "How upscale targets were found (index, src or prompt scan).", ["method"]
+)
+UPLOAD_BYTES = metrics.Counter("nanobanana_upload_bytes_total", "Input image bytes uploaded to the browser.")
+UPLOAD_SECONDS_SAVED = metrics.Counter(
+    "nanobanana_upload_seconds_saved_total",
+    "Upload time saved by preprocessing, estimated from each upload's own bytes per second.",
+)
+
+# Name of the page -> Python binding used by the result observer below
+EVENT_BINDING = "__nanoBananaEvent"
+
+# Installed in every page via add_init_script. Watches the DOM and pushes
+# "image" / "toast_error" / "inline_error" events to Python through EVENT_BINDING,
+# so generate_image can wait on events instead of polling the page.
+RESULT_OBSERVER_JS = """
+(() => {
+    if (window.top !== window || window.__nanoBananaObserver) return;
+    window.__nanoBananaObserver = true;
+
+    const emit = (payload) => {
+        try { window.%(binding)s(payload); } catch (e) {}
+    };
+    const seenImages = new Set();
+    const seenToasts = new WeakSet();
+    const seenInline = new WeakSet();
+
+    const reportImage = (img) => {
+        const alt = img.getAttribute('alt') || '';
+        const src = img.getAttribute('src') || '';
+        if (!src || !alt.includes('Flow Image')) return;
+        const key = alt + '\\n' + src;
+        if (seenImages.has(key)) return;
+        seenImages.add(key);
+        emit({type: 'image', alt, src});
+    };
+
+    const TOAST = 'li[data-sonner-toast][data-visible="true"]';
+    const INLINE_ERROR = 'Something went wrong.';
+
+    const checkToast = (toast) => {
+        if (seenToasts.has(toast)) return;
+        const isError = Array.from(toast.querySelectorAll('i')).some((i) => i.textContent.includes('error'));
+        if (!isError) return;
+        seenToasts.add(toast);
+        const title = toast.querySelector('[data-title]');
+        const content = toast.querySelector('[data-content]');
+        let message = (title && title.innerText) || (content && content.innerText) || toast.innerText || '';
+        message = message.trim();
+        if (message.startsWith('error')) message = message.slice(5).trim();
+        emit({type: 'toast_error', message});
+    };
+
+    const checkInline = (div) => {
+        if (seenInline.has(div) || div.textContent.trim() !== INLINE_ERROR) return;
+        if (div.innerText.trim() !== INLINE_ERROR) return;
+        seenInline.add(div);
+        emit({type: 'inline_error', message: INLINE_ERROR});
+    };
+
+    // Only what changed since the last flush is scanned, never the whole document
+    const scanChanged = (el) => {
+        if (!el.isConnected) return;
+        const toast = el.closest(TOAST);
+        if (toast) checkToast(toast);
+        el.querySelectorAll(TOAST).forEach(checkToast);
+        // The error div is the innermost div whose whole text is the message; a changed text
+        // node can sit below it, so walk up while the text is still that short
+        for (let div = el.closest('div'); div && div.textContent.length <= INLINE_ERROR.length + 16;
+             div = div.parentElement && div.parentElement.closest('div')) {
+            checkInline(div);
+        }
+        el.querySelectorAll('div').forEach((div) => {
+            if (div.textContent.length <= INLINE_ERROR.length + 16) checkInline(div);
+        });
+    };
+
+    const changed = new Set();
+    let scheduled = false;
+    const flush = () => {
+        scheduled = false;
+        const roots = Array.from(changed);
+        changed.clear();
+        roots.forEach(scanChanged);
+    };
+
+    const observer = new MutationObserver((mutations) => {
+        for (const m of mutations) {
+            if (m.type === 'characterData') {
+                if (m.target.parentElement) changed.add(m.target.parentElement);
+                continue;
+            }
+            if (m.type === 'attributes') {
+                if (m.target.tagName === 'IMG') reportImage(m.target);
+                else changed.add(m.target);
+                continue;
+            }
+            for (const node of m.addedNodes) {
+                if (node.nodeType === 3 && node.parentElement) changed.add(node.parentElement);
+                if (node.nodeType !== 1) continue;
+                if (node.tagName === 'IMG') reportImage(node);
+                node.querySelectorAll('img[alt*="Flow Image"]').forEach(reportImage);
+                changed.add(node);
+            }
+        }
+        // Toast/inline checks are throttled to one pass over the changed nodes per 100 ms
+        if (!scheduled && changed.size) { scheduled = true; setTimeout(flush, 100); }
+    });
+
+    const start = () => observer.observe(document.documentElement, {
+        childList: true, subtree: true, characterData: true,
+        attributes: true, attributeFilter: ['src', 'alt', 'data-visible'],
+    });
+    if (document.documentElement) start();
+    else document.addEventListener('DOMContentLoaded', start);
+})();
+""" % {"binding": EVENT_BINDING}
+
+# One-shot snapshot of everything the client polls for, so each check costs a single
+# page.evaluate round trip regardless of gallery size. Called with an optional prompt;
+# image indices are positions in document.querySelectorAll('img[alt*="Flow Image"]'),
+# which matches the order of page.locator('img[alt*="Flow Image"]').nth(i).
+DOM_PROBE_JS = """
+(prompt) => {
+    const images = [];
+    document.querySelectorAll('img[alt*="Flow Image"]').forEach((img, index) => {
+        const alt = img.getAttribute('alt') || '';
+        if (prompt == null || alt.includes(prompt)) {
+            images.push({index, alt, src: img.getAttribute('src')});
+        }
+    });
+
+    const toastErrors = [];
+    document.querySelectorAll('li[data-sonner-toast][data-visible="true"]').forEach((toast) => {
+        const isError = Array.from(toast.querySelectorAll('i')).some((i) => i.textContent.includes('error'));
+        if (!isError) return;
+        const title = toast.querySelector('[data-title]');
+        const content = toast.querySelector('[data-content]');
+        let message = (title && title.innerText) || (content && content.innerText) || toast.innerText || '';
+        message = message.trim();
+        if (message.startsWith('error')) message = message.slice(5).trim();
+        toastErrors.push(message);
+    });
+
+    let inlineError = null;
+    const found = document.evaluate(
+        '//div[normalize-space(.)="Something went wrong."]', document, null,
+        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    for (let i = 0; i < found.snapshotLength; i++) {
+        if (found.snapshotItem(i).innerText.trim() === 'Something went wrong.') {
+            inlineError = 'Something went wrong.';
+            break;
+        }
+    }
+
+    // Uploaded reference images are buttons with a "close" icon
+    const uploadedCount = Array.from(document.querySelectorAll('button')).filter(
+        (btn) => Array.from(btn.querySelectorAll('i')).some((i) => i.textContent.includes('close'))
+    ).length;
+
+    return {images, toastErrors, inlineError, uploadedCount};
+}
+"""
+
+# Navigation readiness: resolves to "ready" once the app is usable (prompt box attached and
+# the Images/Videos radios rendered), or early to "blocked" on a 403 / Access Denied page.
+# Used instead of waiting for networkidle, which analytics and long polls can hold off for seconds.
+PAGE_READY_JS = """
+() => {
+    const textarea = document.querySelector('textarea#PINHOLE_TEXT_AREA_ELEMENT_ID');
+    const radio = Array.from(document.querySelectorAll('[role="radio"]')).some(
+        (r) => ((r.getAttribute('aria-label') || '') + r.textContent).includes('Images'));
+    if (textarea && radio) return 'ready';
+    const text = document.title + ' ' + (document.body ? document.body.innerText.slice(0, 2000) : '');
+    if (text.includes('403 Forbidden') || text.includes('Access Denied')) return 'blocked';
+    return false;
+}
+"""
+
+# Cheap health check: is the app usable, or is the page showing a block page instead?
+# Only reads the title and the start of the body text when the prompt box is missing.
+HEALTH_PROBE_JS = """
+() => {
+    const ready = !!document.querySelector('textarea#PINHOLE_TEXT_AREA_ELEMENT_ID');
+    let blocked = false;
+    if (!ready) {
+        const text = document.title + ' ' + (document.body ? document.body.innerText.slice(0, 2000) : '');
+        blocked = text.includes('403 Forbidden') || text.includes('Access Denied');
+    }
+    return {ready, blocked};
+}
+"""
+
+# Resolves once `target` uploaded thumbnails exist or an error toast is visible.
+# Evaluated in-page by wait_for_function, so waiting costs no round trips.
+UPLOADS_SETTLED_JS = """
+(target) => {
+    const hasIcon = (el, text) => Array.from(el.querySelectorAll('i')).some((i) => i.textContent.includes(text));
+    const uploaded = Array.from(document.querySelectorAll('button')).filter((btn) => hasIcon(btn, 'close')).length;
+    if (uploaded >= target) return true;
+    return Array.from(document.querySelectorAll('li[data-sonner-toast][data-visible="true"]')).some((t) => hasIcon(t, 'error'));
+}
+"""
+
+# Reads the page's current generation settings without opening any menus.
+# Values are null when the DOM doesn't show them (e.g. the settings popover is closed).
+SETTINGS_PROBE_JS = """
+() => {
+    const radio = Array.from(document.querySelectorAll('[role="radio"]')).find(
+        (r) => ((r.getAttribute('aria-label') || '') + r.textContent).includes('Images'));
+    const imagesMode = radio ? radio.getAttribute('aria-checked') === 'true' : null;
+
+    let aspectRatio = null;
+    const combo = Array.from(document.querySelectorAll('button[role="combobox"]')).find(
+        (b) => b.textContent.includes('Aspect Ratio'));
+    if (combo) {
+        if (combo.textContent.includes('Portrait')) aspectRatio = 'portrait';
+        else if (combo.textContent.includes('Landscape')) aspectRatio = 'landscape';
+    }
+    return {imagesMode, aspectRatio};
+}
+"""
+
+# Resolves once fewer than `below` uploaded thumbnails remain.
+UPLOADS_REMOVED_JS = """
+(below) => Array.from(document.querySelectorAll('button')).filter(
+    (btn) => Array.from(btn.querySelectorAll('i')).some((i) => i.textContent.includes('close'))
+).length < below
+"""
+
+# Resolves once every <img> with one of the given srcs has finished loading.
+IMAGES_LOADED_JS = """
+(srcs) => srcs.every((src) => Array.from(document.querySelectorAll('img')).some(
+    (img) => img.getAttribute('src') === src && img.complete && img.naturalWidth > 0
+))
+"""
+
+# Reads the asset URLs behind the open Download menu: {"1K": url, "2K": url, ...}.
+# a.href is already absolute; options without a link are left out.
+DOWNLOAD_LINKS_JS = """
+() => {
+    const links = {};
+    document.querySelectorAll('[role="menuitem"], a[download]').forEach((el) => {
+        const match = (el.textContent || '').match(/Download\\s+(\\d+K)/);
+        const href = el.href || el.getAttribute('href');
+        if (match && href) links[match[1]] = href;
+    });
+    return links;
+}
+"""
+
+# Reads a blob: URL in the page (only the page can) and returns it base64-encoded.
+READ_BLOB_JS = """
+async (src) => {
+    const blob = await (await fetch(src)).blob();
+    return await new Promise((resolve) => {
+        const reader = new FileReader();
+        reader.onloadend = () => resolve(reader.result.split(',')[1]);
+        reader.readAsDataURL(blob);
+    });
+}
+"""
+
+# Drops files onto the prompt area as if dragged in from the desktop.
+DROP_FILES_JS = """
+(files) => {
+    const dt = new DataTransfer();
+    for (const f of files) {
+        const bytes = Uint8Array.from(atob(f.data), (c) => c.charCodeAt(0));
+        dt.items.add(new File([bytes], f.name, {type: f.mime}));
+    }
+    const target = document.querySelector('textarea#PINHOLE_TEXT_AREA_ELEMENT_ID');
+    if (!target) return false;
+    for (const type of ['dragenter', 'dragover', 'drop']) {
+        target.dispatchEvent(new DragEvent(type, {bubbles: true, cancelable: true, dataTransfer: dt}));
+    }
+    return true;
+}
+"""
+
+# Marks result images with their DOM key (see ResultLocation), so an upscale can find
+# its image with one attribute selector instead of scanning the gallery.
+RESULT_KEY_ATTR = "data-nb-result"
+TAG_RESULTS_JS = """
+([attr, keys]) => {
+    document.querySelectorAll('img[alt*="Flow Image"]').forEach((img) => {
+        const key = keys[img.getAttribute('src')];
+        if (key) img.setAttribute(attr, key);
+    });
+}
+"""
+
+
+def result_id_for(src: str) -> str:
+    """Stable identifier of a result image: its src, which names the stored media.
+
+    data:/blob: URLs (and absurdly long srcs) are replaced by their digest, which only the
+    in-memory result index can resolve."""
+    if src.startswith(("data:", "blob:")) or len(src) > 1024:
+        return "sha1:" + hashlib.sha1(src.encode()).hexdigest()
+    return src
+
+
+def _css_string(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class GeneratedImage(io.BytesIO):
+    """One generated image's bytes plus the result_id that targets it for upscaling."""
+
+    def __init__(self, data: bytes, result_id: str = None):
+        super().__init__(data)
+        self.result_id = result_id
+
+
+class ResultLocation:
+    """Where a generated image lives: the tab whose gallery shows it, its src and DOM key."""
+    __slots__ = ("tab", "src", "dom_key")
+
+    def __init__(self, tab, src: str, dom_key: str):
+        self.tab = tab
+        self.src = src
+        self.dom_key = dom_key
+
+
+class UpscaledFile(io.FileIO):
+    """An upscale result spooled to disk, for the caller to read in chunks (e.g. streamed
+    straight into the Telegram upload) instead of holding it in memory.
+
+    Owned by the caller: close() deletes the file and hands its bytes back to the
+    in-flight budget. Use it as a context manager."""
+
+    def __init__(self, path: str, budget: ByteBudget = None, reserved: int = 0):
+        super().__init__(path, "rb")
+        self.path = path
+        self.size = os.fstat(self.fileno()).st_size
+        self._budget = budget
+        self._reserved = reserved
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            os.remove(self.path)
+        except OSError as e:
+            logger.warning(f"Failed to delete upscale file {self.path}: {e}")
+        if self._budget is not None:
+            self._budget.release(self._reserved)
+            self._budget = None
+
+
 class WebsiteError(Exception):
     """Raised when the website displays an error or warning toast."""
     pass
 
-class NanoBananaClient:
+class TabBrokenError(WebsiteError):
+    """Raised when the tab's page crashes or closes during a job; the job can run on another tab."""
+    pass
+
+class AccessDeniedError(Exception):
+    """Raised when the site serves its 403 / Access Denied page instead of the app."""
+    pass
+
+class BrowserTab:
+    """A single page in the persistent context that can be leased to one job at a time."""
+
+    def __init__(self, index: int, page):
+        self.index = index
+        self.page = page
+        self.jobs_served = 0
+        # DOM events pushed by RESULT_OBSERVER_JS; bounded so an idle tab can't grow it forever
+        self.events: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        # Recent image responses by URL, so results can be read from the network instead of screenshotted
+        self.image_responses: OrderedDict = OrderedDict()
+        # Last known generation settings of this page ("mode", "aspect_ratio"); cleared on every load
+        self.settings: dict = {}
+        # How images last got attached on this page: "chooser" (multi-file chooser), "drop" or
+        # "single" (per-image flow, bulk didn't work); None = not tried yet. Cleared on every load
+        self.upload_method: str | None = None
+        # CDP session used by the memory governor; dropped whenever the page is replaced
+        self.cdp = None
+        # False once the page crashed, closed or failed a health check (see PagePool.mark_broken)
+        self.healthy = True
+
+    def attach(self, page):
+        """Makes `page` this tab's page and hooks up the per-page handlers."""
+        self.page = page
+        self.cdp = None
+        self.settings.clear()
+        self.upload_method = None
+        self.image_responses.clear()
+        page.on("response", self.record_response)
+        page.on("domcontentloaded", self.invalidate_settings)
+
+    def detach(self):
+        """Unhooks the per-page handlers, e.g. before the page moves to another tab."""
+        for event, handler in (("response", self.record_response), ("domcontentloaded", self.invalidate_settings)):
+            try:
+                self.page.remove_listener(event, handler)
+            except Exception:
+                pass
+
+    async def drop_cdp(self):
+        """Detaches the memory governor's CDP session, if any; it opens a new one when needed."""
+        cdp, self.cdp = self.cdp, None
+        if cdp is not None:
+            try:
+                await cdp.detach()
+            except Exception as e:
+                # Already gone with its page
+                logger.debug(f"[tab {self.index}] Could not detach CDP session: {e}")
+
+    def invalidate_settings(self, *_):
+        """page.on("domcontentloaded") handler: a fresh document has default settings again
+        (and may attach files differently)."""
+        if self.settings:
+            logger.debug(f"[tab {self.index}] Page reloaded, settings cache cleared")
+        self.settings.clear()
+        self.upload_method = None
+
+    def record_response(self, response):
+        """page.on("response") handler: remembers the last few image responses."""
+        try:
+            if response.request.resource_type != "image":
+                return
+        except Exception:
+            return
+        self.image_responses[response.url] = response
+        self.image_responses.move_to_end(response.url)
+        while len(self.image_responses) > 64:
+            self.image_responses.popitem(last=False)
+
+    def push_event(self, event: dict):
+        try:
+            self.events.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def drain_events(self):
+        """Drops events that arrived before the current job started."""
+        while not self.events.empty():
+            self.events.get_nowait()
+
+
+class PagePool:
+    """Hands out BrowserTabs exclusively, one job per tab.
+
+    A caller can ask for a specific tab (e.g. the tab that generated an image it now
+    wants to upscale); otherwise any idle tab is returned. Broken tabs (crashed, closed
+    or failing health checks) are never handed out; the watchdog takes them with
+    acquire_for_repair() and puts them back once their page has been replaced."""
+
     def __init__(self):
+        self.tabs: list[BrowserTab] = []
+        self._idle: list[BrowserTab] = []
+        self._leased: set[BrowserTab] = set()
+        self._cond = asyncio.Condition()
+
+    def add(self, tab: BrowserTab):
+        self.tabs.append(tab)
+        self._idle.append(tab)
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    @property
+    def healthy_count(self) -> int:
+        return sum(1 for tab in self.tabs if tab.healthy)
+
+    def _take(self, tab: BrowserTab) -> BrowserTab:
+        self._idle.remove(tab)
+        self._leased.add(tab)
+        return tab
+
+    async def acquire(self, preferred: BrowserTab = None) -> BrowserTab:
+        async with self._cond:
+            while True:
+                if preferred is not None and preferred in self.tabs and preferred.healthy:
+                    if preferred in self._idle:
+                        return self._take(preferred)
+                elif self._idle:
+                    return self._take(self._idle[0])
+                await self._cond.wait()
+
+    async def try_acquire(self, tab: BrowserTab) -> bool:
+        """Takes `tab` if it is idle right now, without waiting."""
+        async with self._cond:
+            if tab in self._idle:
+                self._take(tab)
+                return True
+            return False
+
+    async def acquire_for_repair(self, tab: BrowserTab):
+        """Waits until a broken tab's current job (if any) has finished, then takes it."""
+        async with self._cond:
+            while tab in self._leased:
+                await self._cond.wait()
+            if tab in self._idle:
+                self._idle.remove(tab)
+            self._leased.add(tab)
+
+    def mark_broken(self, tab: BrowserTab):
+        """Takes a tab out of rotation; safe to call from sync event handlers."""
+        tab.healthy = False
+        if tab in self._idle:
+            self._idle.remove(tab)
+
+    async def release(self, tab: BrowserTab):
+        async with self._cond:
+            self._leased.discard(tab)
+            if tab in self.tabs and tab not in self._idle and tab.healthy:
+                self._idle.append(tab)
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def lease(self, preferred: BrowserTab = None):
+        tab = await self.acquire(preferred)
+        try:
+            yield tab
+        finally:
+            tab.jobs_served += 1
+            await self.release(tab)
+
+
+class NanoBananaClient:
+    def __init__(self, pool_size: int = None, target_url: str = None, user_data_dir: str = None, name: str = "0",
+                 upscale_budget: ByteBudget = None):
         self.playwright = None
+        # Shard name (ShardedClient runs one client per profile), used as a metrics label
+        self.name = name
         self.context = None
-        self.page = None
-        # Specific target URL provided by user
-        self.target_url = "https://labs.google/fx/tools/flow/project/feaf1427-a157-4a61-be71-62b4677ec225"
+        self.page = None  # First tab's page, kept for scripts that drive the browser directly
+        self.pool_size = max(1, pool_size or config.PAGE_POOL_SIZE)
+        self.pool = PagePool()
+        # Remember which tab produced a prompt's images so upscales go back to the same gallery
+        self._prompt_tabs = BoundedStore("prompt_tabs", max_entries=1000, ttl_s=24 * 3600)
+        # result_id -> ResultLocation of every image generated in this process, for upscales
+        self._results = BoundedStore("result_index", max_entries=20000, ttl_s=24 * 3600)
+        # (result_id, scale) -> upscale asset URL seen in a Download menu or download; URLs may
+        # be signed, so they're only trusted for a while (and a failed fetch falls back to the UI)
+        self._upscale_urls = BoundedStore("upscale_urls", max_entries=5000, ttl_s=3600)
+        # Bytes of upscale files handed out and not yet closed (i.e. downloading or uploading);
+        # ShardedClient passes one budget shared by every profile
+        self.upscale_budget = upscale_budget or ByteBudget(
+            "upscale_inflight", int(config.UPSCALE_INFLIGHT_MAX_MB * 1024 * 1024)
+        )
+        self.governor = MemoryGovernor(self)
+        self.watchdog = BrowserWatchdog(self)
+        self.request_policy = RequestPolicy() if config.BLOCK_RESOURCES else None
+        # Primed page kept outside the pool, swapped in when a tab's page dies
+        self._standby: BrowserTab = None
+        self._standby_task: asyncio.Task = None
+        self._stopping = False
+        # Specific target URL provided by user (overridable, e.g. to point at flow_standin.py)
+        self.target_url = target_url or config.TARGET_URL
+        self.user_data_dir = user_data_dir or config.USER_DATA_DIR
 
     async def start(self):
         """Initializes the browser with persistent context and stealth settings."""
-        logger.info(f"Starting Nano Banana Client with Stealth (Persistent: {config.USER_DATA_DIR})...")
+        logger.info(f"Starting Nano Banana Client with Stealth (Persistent: {self.user_data_dir})...")
+        await self._launch()
+
+        # In persistent context, pages might already exist (e.g. from previous session restore), 
+        # or we might need to create one. Usually the first page is opened.
+        pages = list(self.context.pages[:self.pool_size])
+        while len(pages) < self.pool_size:
+            pages.append(await self.context.new_page())
+        self.page = pages[0]
+
+        logger.info(f"Browser started successfully ({self.pool_size} tabs).")
+        
+        # Warm up every tab concurrently so the first burst of jobs doesn't pay navigation cost
+        tabs = [BrowserTab(idx, page) for idx, page in enumerate(pages)]
+        for tab in tabs:
+            self._attach(tab, tab.page)
+        primed = await asyncio.gather(*(self._prime_tab(tab) for tab in tabs))
+        for tab, ok in zip(tabs, primed):
+            self.pool.add(tab)
+            if not ok:
+                # Left to the watchdog, which swaps in a freshly primed page
+                self.pool.mark_broken(tab)
+        self.governor.start()
+        self.watchdog.start()
+        for tab in tabs:
+            if not tab.healthy:
+                self.watchdog.notify_broken(tab)
+
+    async def _launch(self):
+        """Starts Playwright and the persistent context, with the init scripts every page gets."""
+        self._stopping = False
         self.playwright = await async_playwright().start()
         
         # Detect if running in Docker/Linux
@@ -63,8 +659,8 @@ class NanoBananaClient:
         # Use chromium by default, but launch_persistent_context
         # Note: launch_persistent_context launches a browser instance that persists to user_data_dir
         self.context = await self.playwright.chromium.launch_persistent_context(
-            user_data_dir=config.USER_DATA_DIR,
-            channel="chrome",  # Use installed chrome for better stealth
+            user_data_dir=self.user_data_dir,
+            channel=config.BROWSER_CHANNEL or None,  # Use installed chrome for better stealth
             headless=config.HEADLESS,
             args=args,
             user_agent=user_agent,
@@ -76,20 +672,14 @@ class NanoBananaClient:
             ignore_default_args=['--enable-automation'],  # Critical: disable automation flag
         )
         
-        # In persistent context, pages might already exist (e.g. from previous session restore), 
-        # or we might need to create one. Usually the first page is opened.
-        if self.context.pages:
-            self.page = self.context.pages[0]
-        else:
-            self.page = await self.context.new_page()
-
         # Apply minimal stealth scripts that don't cause errors
         # Note: playwright-stealth library was causing "utils is not defined" errors
         # so we use only essential, error-free patches
         logger.info("Applying minimal stealth patches...")
         
         # Only patch webdriver property - this is the most critical detection
-        await self.page.add_init_script("""
+        # Registered on the context so every tab in the pool gets it
+        await self.context.add_init_script("""
             // Remove webdriver property - critical for bot detection
             Object.defineProperty(navigator, 'webdriver', {
                 get: () => undefined,
@@ -97,26 +687,223 @@ class NanoBananaClient:
             });
         """)
 
-        logger.info("Browser started successfully.")
-        
+        # Result observer: pages push DOM events to the owning tab's queue
+        await self.context.expose_binding(EVENT_BINDING, self._on_page_event)
+        await self.context.add_init_script(RESULT_OBSERVER_JS)
+        if self.request_policy:
+            await self.request_policy.install(self.context)
+        context = self.context
+        self.context.on("close", lambda _: self._on_context_closed(context))
+
+    def _attach(self, tab: BrowserTab, page):
+        """tab.attach(page), plus crash/close detection for the watchdog."""
+        tab.attach(page)
+
+        def broken(_=None, why="crashed"):
+            # Ignore pages we replaced or closed ourselves
+            if tab.page is page and not self._stopping and tab in self.pool.tabs:
+                logger.error(f"[tab {tab.index}] Page {why}")
+                self.pool.mark_broken(tab)
+                self.watchdog.notify_broken(tab)
+                # Wakes a job waiting for results on this page
+                tab.push_event({"type": "page_broken", "message": f"Browser page {why}"})
+
+        page.on("crash", broken)
+        page.on("close", lambda _: broken(why="closed"))
+
+    def _on_context_closed(self, context):
+        if self._stopping or context is not self.context:
+            return
+        logger.error("Browser context closed unexpectedly")
+        for tab in self.pool.tabs:
+            self.pool.mark_broken(tab)
+        self.watchdog.notify_context_lost()
+
+    def _on_page_event(self, source, event):
+        """Binding callback for RESULT_OBSERVER_JS events."""
+        page = source.get("page")
+        for tab in self.pool.tabs:
+            if tab.page is page:
+                tab.push_event(event)
+                return
+
+    async def _prime_tab(self, tab: BrowserTab) -> bool:
+        """Navigates a tab to the target URL and switches it to Images mode. Returns False if
+        the navigation failed."""
+        page = tab.page
         # Navigate directly to target URL
         try:
-            import random
-            
-            # Add small random delay
-            delay = random.uniform(1.0, 2.0)
-            await asyncio.sleep(delay)
+            # Add small random delay (skipped in min-latency mode)
+            if not config.MIN_LATENCY:
+                await asyncio.sleep(random.uniform(1.0, 2.0))
             
-            logger.info(f"Navigating to {self.target_url}")
-            await self.page.goto(self.target_url, wait_until="networkidle", timeout=30000)
-            logger.info("Navigation completed")
+            logger.info(f"[tab {tab.index}] Navigating to {self.target_url}")
+            with metrics.time_stage("browser", "navigate"):
+                await page.goto(self.target_url, wait_until=self._navigation_wait_until(), timeout=30000)
+                state = await self._wait_until_ready(page)
+            if state == "blocked":
+                logger.error(f"[tab {tab.index}] Still detected as bot (403 Forbidden).")
+                return False
+            logger.info(f"[tab {tab.index}] Navigation completed")
                 
         except Exception as e:
-            logger.error(f"Failed initial navigation: {e}")
+            logger.error(f"[tab {tab.index}] Failed initial navigation: {e}")
+            return False
+
+        if await self._ensure_images_mode(page):
+            tab.settings["mode"] = "Images"
+        return True
+
+    async def probe_health(self, page, timeout_s: float = None) -> dict | None:
+        """Runs HEALTH_PROBE_JS with a timeout; None if the page didn't answer (crashed,
+        closed or hung)."""
+        timeout_s = timeout_s or config.HEALTH_PROBE_TIMEOUT_S
+        try:
+            return await asyncio.wait_for(page.evaluate(HEALTH_PROBE_JS), timeout=timeout_s)
+        except Exception as e:
+            logger.debug(f"Health probe failed: {e}")
+            return None
+
+    # --- standby page and recovery -----------------------------------------
+
+    def warm_standby_soon(self):
+        """Starts priming a standby page in the background, unless one exists or is on its way."""
+        if not config.STANDBY_PAGE or self._stopping or self._standby is not None:
+            return
+        if self._standby_task is None or self._standby_task.done():
+            self._standby_task = asyncio.create_task(self._warm_standby())
+
+    async def _warm_standby(self):
+        page = None
+        try:
+            page = await self.context.new_page()
+            standby = BrowserTab("standby", page)
+            standby.attach(page)
+            if await self._prime_tab(standby) and not self._stopping:
+                self._standby = standby
+                logger.info("Standby page ready")
+                return
+        except Exception as e:
+            logger.warning(f"Could not prepare standby page: {e}")
+        if page is not None:
+            await self._close_page(page)
+
+    @property
+    def standby(self) -> BrowserTab | None:
+        return self._standby
+
+    async def discard_standby(self):
+        standby, self._standby = self._standby, None
+        if standby is not None:
+            await self._close_page(standby.page)
+
+    async def _close_page(self, page):
+        try:
+            await page.close()
+        except Exception as e:
+            logger.debug(f"Error closing page: {e}")
+
+    async def replace_page(self, tab: BrowserTab) -> str:
+        """Gives a tab the caller holds a new, primed page and closes the old one.
+
+        Takes the warm standby page if it passes a health probe (recovery in about one
+        round trip), otherwise opens and primes a page now. Returns "standby" or "cold";
+        raises if no working page could be made."""
+        standby, self._standby = self._standby, None
+        probe = await self.probe_health(standby.page) if standby is not None else None
+        if probe and probe["ready"]:
+            page, settings, source = standby.page, dict(standby.settings), "standby"
+            standby.detach()
+        else:
+            if standby is not None:
+                await self._close_page(standby.page)
+            fresh = BrowserTab(tab.index, await self.context.new_page())
+            if not await self._prime_tab(fresh):
+                await self._close_page(fresh.page)
+                raise RuntimeError(f"Could not prime a new page for tab {tab.index}")
+            page, settings, source = fresh.page, dict(fresh.settings), "cold"
+
+        old_page = tab.page
+        await tab.drop_cdp()
+        tab.detach()
+        self._attach(tab, page)
+        tab.settings.update(settings)
+        if old_page is self.page:
+            self.page = page
+        await self._close_page(old_page)
+        logger.info(f"[tab {tab.index}] Switched to a new page ({source})")
+        self.warm_standby_soon()
+        return source
+
+    async def restart_browser(self) -> list[bool]:
+        """Relaunches the browser after the context died and gives every tab a new primed
+        page. The caller must hold every tab. Returns whether each tab was primed."""
+        logger.warning("Restarting the browser...")
+        self._stopping = True
+        if self._standby_task:
+            self._standby_task.cancel()
+        self._standby = None
+        try:
+            await self.context.close()
+        except Exception as e:
+            logger.debug(f"Error closing context: {e}")
+        try:
+            await self.playwright.stop()
+        except Exception as e:
+            logger.debug(f"Error stopping playwright: {e}")
+
+        await self._launch()
+        pages = list(self.context.pages[:len(self.pool.tabs)])
+        while len(pages) < len(self.pool.tabs):
+            pages.append(await self.context.new_page())
+        for tab, page in zip(self.pool.tabs, pages):
+            tab.detach()
+            self._attach(tab, page)
+        self.page = pages[0]
+        primed = await asyncio.gather(*(self._prime_tab(tab) for tab in self.pool.tabs))
+        self.warm_standby_soon()
+        return list(primed)
+
+    async def recycle_tab(self, tab: BrowserTab, reopen: bool = False, reason: str = "manual") -> bool:
+        """Frees a tab's memory if it is idle: reloads the page, or (reopen=True) replaces it
+        with a fresh page (the standby when one is warm). Returns True if the tab was recycled,
+        False if it was busy or the recycle failed (the tab then goes to the watchdog)."""
+        if not await self.pool.try_acquire(tab):
+            return False
+        try:
+            logger.info(f"[tab {tab.index}] Recycling ({reason}): {'reopen' if reopen else 'reload'}")
+            with metrics.time_stage("browser", "recycle_tab"):
+                await tab.drop_cdp()
+                if reopen:
+                    await self.replace_page(tab)
+                else:
+                    await self._prime_tab(tab)
+            return True
+        except Exception as e:
+            logger.error(f"[tab {tab.index}] Recycling failed: {e}")
+            self.pool.mark_broken(tab)
+            self.watchdog.notify_broken(tab)
+            return False
+        finally:
+            tab.drain_events()
+            await self.pool.release(tab)
+
+    def _ensure_available(self):
+        if not self.pool.tabs:
+            # Try to recover or just fail
+            raise RuntimeError("Browser not started")
+        if not self.pool.healthy_count:
+            raise RuntimeError("Browser is recovering, please try again shortly")
 
     async def stop(self):
         """Closes the browser."""
         logger.info("Stopping browser client...")
+        self._stopping = True
+        await self.watchdog.stop()
+        await self.governor.stop()
+        if self._standby_task:
+            self._standby_task.cancel()
+            await asyncio.gather(self._standby_task, return_exceptions=True)
         try:
             if self.context:
                 await self.context.close()
@@ -131,128 +918,105 @@ class NanoBananaClient:
             
         logger.info("Browser stopped.")
 
-    async def _refresh_page(self):
+    async def _pace(self):
+        """Short human-like pause between UI actions; a no-op in min-latency mode.
+        This is pacing only - correctness always comes from waiting on the UI itself."""
+        if not config.MIN_LATENCY and config.HUMAN_PACING_S > 0:
+            await asyncio.sleep(random.uniform(0.5, 1.0) * config.HUMAN_PACING_S)
+
+    def _navigation_wait_until(self) -> str:
+        # "ready" (default): only wait for the DOM, then for PAGE_READY_JS
+        return "networkidle" if config.NAVIGATION_WAIT == "networkidle" else "domcontentloaded"
+
+    async def _wait_until_ready(self, page, timeout: float = 30000) -> str:
+        """Waits until the app is usable; returns "ready", or "blocked" for a block page."""
+        handle = await page.wait_for_function(PAGE_READY_JS, polling=100, timeout=timeout)
+        return await handle.json_value()
+
+    async def _refresh_page(self, page):
         """Refreshes the page and waits for it to load."""
-        if not self.page:
+        if not page:
             return
         
         try:
             logger.info("Refreshing page...")
-            await self.page.reload(wait_until="networkidle")
-            await asyncio.sleep(2)  # Wait for UI to settle
-            logger.info("Page refreshed successfully")
+            with metrics.time_stage("browser", "refresh"):
+                await page.reload(wait_until=self._navigation_wait_until())
+                state = await self._wait_until_ready(page)  # Wait for UI to settle
+            logger.info(f"Page refreshed ({state})")
         except Exception as e:
             logger.error(f"Failed to refresh page: {e}")
 
-    async def _check_for_inline_generation_error(self) -> tuple[bool, str | None]:
+    async def _probe(self, page, prompt: str = None) -> dict:
+        """Runs DOM_PROBE_JS and returns its snapshot (images matching prompt, toast errors,
+        inline error, uploaded image count) from a single round trip."""
+        return await page.evaluate(DOM_PROBE_JS, prompt)
+
+    async def _check_for_inline_generation_error(self, page, snapshot: dict = None) -> tuple[bool, str | None]:
         """Check for inline generation errors (e.g., 'Something went wrong.' displayed in result area).
         This is different from toast errors - it appears inside the image generation result container.
         Returns (has_error, error_message)."""
-        if not self.page:
+        if not page:
             return (False, None)
         
         try:
-            # Look for the error message pattern shown in the HTML structure
-            # The error appears in a div with specific text content
-            error_divs = self.page.locator('div').filter(has_text="Something went wrong.")
-            
-            count = await error_divs.count()
-            if count > 0:
-                # Verify it's the actual error message, not just any div containing this text
-                for i in range(count):
-                    div = error_divs.nth(i)
-                    try:
-                        text = await div.inner_text()
-                        # Check if this div is the actual error message (text should be exactly or very close to the error)
-                        if text.strip() == "Something went wrong.":
-                            logger.warning("Detected inline generation error: Something went wrong.")
-                            return (True, "Something went wrong.")
-                    except:
-                        pass
+            snapshot = snapshot or await self._probe(page)
+            if snapshot["inlineError"]:
+                logger.warning(f"Detected inline generation error: {snapshot['inlineError']}")
+                return (True, snapshot["inlineError"])
         except Exception as e:
             logger.debug(f"Error checking for inline generation error: {e}")
         
         return (False, None)
 
-    async def _check_for_toast_error(self) -> tuple[bool, str | None]:
+    async def _check_for_toast_error(self, page, snapshot: dict = None) -> tuple[bool, str | None]:
         """Check for error/warning toast messages on the page.
         Returns (has_error, error_message).
         Automatically refreshes the page if 'Something went wrong' is detected."""
-        if not self.page:
+        if not page:
             return (False, None)
         
         try:
-            # Look for any visible sonner toast
-            all_toasts = self.page.locator('li[data-sonner-toast][data-visible="true"]')
-            
-            toast_count = await all_toasts.count()
-            if toast_count > 0:
-                for i in range(toast_count):
-                    toast = all_toasts.nth(i)
-                    
-                    # Check if this toast contains an error icon
-                    # The error icon is an <i> element with text content "error"
-                    error_icon = toast.locator('i').filter(has_text="error")
-                    
-                    if await error_icon.count() > 0:
-                        # This is an error toast - extract the message
-                        message = None
-                        
-                        # Try data-title div first
-                        title_el = toast.locator('[data-title]')
-                        if await title_el.count() > 0:
-                            message = await title_el.inner_text()
-                        
-                        # If no title, try data-content
-                        if not message:
-                            content_el = toast.locator('[data-content]')
-                            if await content_el.count() > 0:
-                                message = await content_el.inner_text()
-                        
-                        # Fallback: get inner text of the whole toast
-                        if not message:
-                            message = await toast.inner_text()
-                        
-                        # Clean up the message
-                        if message:
-                            message = message.strip()
-                            # Remove any "error" icon text that might be included
-                            if message.startswith("error"):
-                                message = message[5:].strip()
-                        
-                        logger.info(f"Detected error toast: {message}")
-                        
-                        # Auto-refresh on "Something went wrong" error
-                        if message and "Something went wrong" in message:
-                            logger.warning("Detected 'Something went wrong' error - refreshing page...")
-                            await self._refresh_page()
-                        
-                        return (True, message or "Unknown error from website")
+            snapshot = snapshot or await self._probe(page)
+            if snapshot["toastErrors"]:
+                message = snapshot["toastErrors"][0]
+                logger.info(f"Detected error toast: {message}")
+                
+                # Auto-refresh on "Something went wrong" error
+                if message and "Something went wrong" in message:
+                    logger.warning("Detected 'Something went wrong' error - refreshing page...")
+                    await self._refresh_page(page)
+                
+                return (True, message or "Unknown error from website")
                 
         except Exception as e:
             logger.debug(f"Error checking for toast: {e}")
         
         return (False, None)
 
-    async def _clear_prompt_and_images(self):
+    async def _clear_prompt_and_images(self, page):
         """Clears the prompt textarea and removes all uploaded images to reset state."""
-        if not self.page:
+        if not page:
             return
         
         try:
             # Clear the prompt textarea
-            prompt_input = self.page.locator("textarea#PINHOLE_TEXT_AREA_ELEMENT_ID")
+            prompt_input = page.locator("textarea#PINHOLE_TEXT_AREA_ELEMENT_ID")
             if await prompt_input.count() > 0:
                 await prompt_input.fill("")
                 logger.info("Cleared prompt textarea")
         except Exception as e:
             logger.warning(f"Failed to clear prompt: {e}")
         
+        await self._remove_uploaded_images(page)
+
+    async def _remove_uploaded_images(self, page):
+        """Removes all uploaded reference images from the prompt area."""
         try:
             # Find and click all close buttons on uploaded images
             # These are buttons with a "close" icon
-            close_buttons = self.page.locator("button").filter(
-                has=self.page.locator("i", has_text="close")
+            close_buttons = page.locator("button").filter(
+                has=page.locator("i", has_text="close")
             )
             
             count = await close_buttons.count()
@@ -264,46 +1028,72 @@ class NanoBananaClient:
                         btn = close_buttons.nth(i)
                         if await btn.is_visible():
                             await btn.click()
-                            await asyncio.sleep(0.3)  # Brief pause between removals
+                            # Wait for the thumbnail to actually go away before the next click
+                            await page.wait_for_function(UPLOADS_REMOVED_JS, arg=i + 1, timeout=3000)
                     except Exception as e:
                         logger.debug(f"Failed to click close button {i}: {e}")
                 
                 logger.info("Removed uploaded images")
         except Exception as e:
             logger.warning(f"Failed to clear images: {e}")
-        
-        # Wait for UI to settle
-        await asyncio.sleep(0.5)
 
-    async def _set_aspect_ratio(self, aspect_ratio: str):
+    async def _apply_settings(self, tab: BrowserTab, aspect_ratio: str = None):
+        """Brings the tab to Images mode and the requested aspect ratio, touching the
+        settings UI only for values that actually differ from the page's current state.
+
+        The cached state is checked against whatever the DOM shows (one evaluate); values
+        the DOM doesn't expose are trusted from the cache, which is cleared on reload."""
+        page = tab.page
+        try:
+            observed = await page.evaluate(SETTINGS_PROBE_JS)
+            if observed["imagesMode"] is not None:
+                tab.settings["mode"] = "Images" if observed["imagesMode"] else "other"
+            if observed["aspectRatio"]:
+                tab.settings["aspect_ratio"] = observed["aspectRatio"]
+        except Exception as e:
+            logger.debug(f"Settings probe failed, trusting cache: {e}")
+
+        if aspect_ratio and tab.settings.get("aspect_ratio") != aspect_ratio:
+            if await self._set_aspect_ratio(page, aspect_ratio):
+                tab.settings["aspect_ratio"] = aspect_ratio
+            else:
+                tab.settings.pop("aspect_ratio", None)
+        elif aspect_ratio:
+            logger.info(f"Aspect ratio already {aspect_ratio}, skipping settings")
+
+        if tab.settings.get("mode") != "Images":
+            if await self._ensure_images_mode(page):
+                tab.settings["mode"] = "Images"
+            else:
+                tab.settings.pop("mode", None)
+
+    async def _set_aspect_ratio(self, page, aspect_ratio: str) -> bool:
         """Set the aspect ratio in Nano Banana settings.
-        aspect_ratio should be 'landscape' or 'portrait'."""
-        if not self.page or aspect_ratio not in ("landscape", "portrait"):
-            return
+        aspect_ratio should be 'landscape' or 'portrait'. Returns whether it was applied."""
+        if not page or aspect_ratio not in ("landscape", "portrait"):
+            return False
         
         logger.info(f"Setting aspect ratio to: {aspect_ratio}")
         
         try:
             # Click the Settings button (tune icon)
-            settings_btn = self.page.locator("button").filter(
-                has=self.page.locator("i", has_text="tune")
+            settings_btn = page.locator("button").filter(
+                has=page.locator("i", has_text="tune")
             ).first
             
             await settings_btn.wait_for(state="visible", timeout=5000)
             await settings_btn.click()
             logger.info("Clicked Settings button")
-            await asyncio.sleep(0.5)
             
             # Wait for the settings modal/popover to appear
             # Look for the Aspect Ratio combobox
-            aspect_ratio_btn = self.page.locator('button[role="combobox"]').filter(
-                has=self.page.locator("span", has_text="Aspect Ratio")
+            aspect_ratio_btn = page.locator('button[role="combobox"]').filter(
+                has=page.locator("span", has_text="Aspect Ratio")
             ).first
             
             await aspect_ratio_btn.wait_for(state="visible", timeout=5000)
             await aspect_ratio_btn.click()
             logger.info("Clicked Aspect Ratio dropdown")
-            await asyncio.sleep(0.3)
             
             # Select the appropriate option
             if aspect_ratio == "landscape":
@@ -312,200 +1102,123 @@ class NanoBananaClient:
                 option_text = "Portrait (9:16)"
             
             # The options appear in a dropdown/popover
-            option = self.page.get_by_text(option_text, exact=True)
+            option = page.get_by_text(option_text, exact=True)
             await option.wait_for(state="visible", timeout=3000)
             await option.click()
             logger.info(f"Selected {option_text}")
-            await asyncio.sleep(0.3)
+            # The option list closes once the choice is applied
+            await option.wait_for(state="hidden", timeout=3000)
             
             # Close the settings modal by clicking outside or pressing Escape
-            await self.page.keyboard.press("Escape")
-            await asyncio.sleep(0.3)
+            await page.keyboard.press("Escape")
+            await aspect_ratio_btn.wait_for(state="hidden", timeout=3000)
+            return True
             
         except Exception as e:
             logger.warning(f"Failed to set aspect ratio: {e}")
             # Try to close any open modal
             try:
-                await self.page.keyboard.press("Escape")
+                await page.keyboard.press("Escape")
             except:
                 pass
+            return False
 
-    async def generate_image(self, prompt: str, image_paths: list = None, aspect_ratio: str = None):
-        """
-        Generates an image from a text prompt and optional image inputs.
-        aspect_ratio: 'landscape' or 'portrait' to set the output aspect ratio.
-        """
-        if not self.page:
-            # Try to recover or just fail
-            raise RuntimeError("Browser not started")
-
-        logger.info(f"Attempting to generate image for prompt: {prompt} (Images: {len(image_paths) if image_paths else 0}, Aspect: {aspect_ratio or 'default'})")
-        
-        # Set aspect ratio if specified
-        if aspect_ratio:
-            await self._set_aspect_ratio(aspect_ratio)
-        
-        # Verification check - are we forbidden?
-        try:
-            content = await self.page.content()
-            if "403 Forbidden" in content or "Access Denied" in content:
-                logger.error("Still detected as bot (403 Forbidden).")
-                raise Exception("Access Denied by Google Labs")
-        except Exception as e:
-             # If page is closed, this might fail
-             logger.error(f"Error checking page content: {e}")
-             raise
-
-        # 1. Switch to Images mode if needed
+    async def _ensure_images_mode(self, page) -> bool:
+        """Switches the page to Images mode if it isn't already. Returns whether it is in Images mode."""
         try:
             # Check if Images button is selected
-            images_btn = self.page.get_by_role("radio", name="Images")
+            images_btn = page.get_by_role("radio", name="Images")
             if await images_btn.count() > 0:
                 is_checked = await images_btn.get_attribute("aria-checked")
                 if is_checked != "true":
                     logger.info("Switching to Images mode...")
                     await images_btn.click()
-                    await asyncio.sleep(1) # Wait for switch
+                    # Wait for switch
+                    await page.get_by_role("radio", name="Images", checked=True).wait_for(state="visible", timeout=5000)
+                return True
         except Exception as e:
             logger.warning(f"Failed to switch to Images mode (might already be in correct mode or selector changed): {e}")
+        return False
+
+    async def generate_image(self, prompt: str, images: list = None, aspect_ratio: str = None):
+        """
+        Generates an image from a text prompt and optional image inputs.
+        Returns a list of GeneratedImage streams; each carries the result_id to upscale it by.
+        images: InputImage objects to attach as references (borrowed, not closed here).
+        aspect_ratio: 'landscape' or 'portrait' to set the output aspect ratio.
+        Runs on the first idle tab of the pool; concurrent calls run on separate tabs. If the
+        tab's page crashes or closes meanwhile, the job runs once more on another tab.
+        """
+        for attempt in range(2):
+            self._ensure_available()
+            async with self.pool.lease() as tab:
+                logger.info(f"[tab {tab.index}] Leased for generation")
+                timer = StepTimer(f"generate tab {tab.index}", operation="generate")
+                try:
+                    result = await self._generate_on_page(tab, prompt, images, aspect_ratio, timer)
+                except Exception as e:
+                    # A crashed or closed page is out of the pool; one more go on another tab
+                    if attempt or tab.healthy:
+                        raise
+                    logger.warning(f"[tab {tab.index}] {e}, retrying on another tab")
+                    continue
+                finally:
+                    logger.info(timer.report())
+                self._prompt_tabs[prompt] = tab
+                return result
+
+    async def _generate_on_page(self, tab: BrowserTab, prompt: str, images: list = None, aspect_ratio: str = None,
+                                timer: StepTimer = None):
+        """Runs one generation on a tab the caller has leased exclusively."""
+        page = tab.page
+        timer = timer or StepTimer(f"generate tab {tab.index}")
+        logger.info(f"Attempting to generate image for prompt: {prompt} (Images: {len(images) if images else 0}, Aspect: {aspect_ratio or 'default'})")
+        
+        # Verification check - are we forbidden? (and is the page still alive?)
+        probe = await self.probe_health(page)
+        if probe is None:
+            logger.error(f"[tab {tab.index}] Page is not responding")
+            self.pool.mark_broken(tab)
+            self.watchdog.notify_broken(tab)
+            raise Exception("Browser page is not responding")
+        if probe["blocked"]:
+            logger.error("Still detected as bot (403 Forbidden).")
+            raise AccessDeniedError("Access Denied by Google Labs")
+
+        # 1. Switch to Images mode and set aspect ratio, if needed (cached per tab)
+        with timer.step("settings"):
+            await self._apply_settings(tab, aspect_ratio)
 
         # 2. Enter prompt (Now done BEFORE uploads as requested)
         try:
-            prompt_input = self.page.locator("textarea#PINHOLE_TEXT_AREA_ELEMENT_ID")
-            await prompt_input.fill(prompt)
+            with timer.step("fill_prompt"):
+                prompt_input = page.locator("textarea#PINHOLE_TEXT_AREA_ELEMENT_ID")
+                await prompt_input.fill(prompt)
             logger.info("Filled prompt")
         except Exception as e:
             logger.error(f"Failed to find prompt input: {e}")
             raise
 
         # 1.5 Handle Image Uploads
-        if image_paths:
-            logger.info(f"Uploading {len(image_paths)} images: {image_paths}")
-            for idx, img_path in enumerate(image_paths):
-                try:
-                    logger.info(f"Uploading image {idx+1}/{len(image_paths)}: {img_path}")
-                    
-                    # 1. Click the main "Add" prompt image button (the plus icon)
-                    # We use a strict selector to avoid clicking the "Close" button of existing images
-                    # Strategy: Get all buttons that have an 'add' icon, excluding those with 'close' icon
-                    # The user provided HTML shows specific classes but we stick to structure for robustness.
-                    
-                    # Wait for any potential animations
-                    await asyncio.sleep(1)
-
-                    add_btn_locator = self.page.locator("button").filter(
-                        has=self.page.locator("i", has_text="add")
-                    ).filter(
-                        has_not=self.page.locator("i", has_text="close")
-                    ).last
-
-                    # Verify we found it
-                    if await add_btn_locator.count() == 0:
-                        logger.warning("Could not find 'Add' button with 'add' icon. Dumping debug info...")
-                        # Fallback try less strict
-                        add_btn_locator = self.page.locator("button").filter(has=self.page.locator("i", has_text="add")).last
-
-                    await add_btn_locator.wait_for(state="visible", timeout=5000)
-                    
-                    # Ensure we are not clicking something disabled
-                    # await add_btn.wait_for(state="enabled") # Optional
-                    
-                    await add_btn_locator.click()
-                    logger.info("Clicked Add button")
-                    await asyncio.sleep(1)
+        if images:
+            with timer.step("upload"):
+                await self._upload_images(tab, images, timer)
 
-                    # Get current count of uploaded images to wait for change
-                    # Uploaded images are identified by having a "close" icon
-                    uploaded_items_locator = self.page.locator("button").filter(has=self.page.locator("i", has_text="close"))
-                    initial_count = await uploaded_items_locator.count()
-                    logger.info(f"Current uploaded images count: {initial_count}")
-
-                    # 2. Click the specific "Upload" button
-                    # User provided HTML shows the Upload button is in a container with data-index="0".
-                    # We target this specifically to avoid clicking any gallery images (which would be at index 1+).
-                    upload_btn = self.page.locator('div[data-index="0"] button').filter(
-                        has=self.page.locator("i", has_text="upload")
-                    ).filter(
-                        has_text="Upload"
-                    ).first
-                    
-                    # Wait for it to appear
-                    await upload_btn.wait_for(state="visible", timeout=5000)
-                    
-                    # Start waiting for file chooser before clicking "Upload"
-                    async with self.page.expect_file_chooser() as fc_info:
-                        await upload_btn.click()
-                    
-                    file_chooser = await fc_info.value
-                    await file_chooser.set_files([img_path]) # Set single file
-                    logger.info(f"File selected: {img_path}")
-                    
-                    # 3. Handle "Crop and Save"
-                    crop_save_btn = self.page.get_by_role("button", name="Crop and Save")
-                    try:
-                        await crop_save_btn.wait_for(state="visible", timeout=10000)
-                        await crop_save_btn.click()
-                        logger.info("Clicked Crop and Save")
-                    except Exception as e:
-                        logger.warning(f"Crop and Save button not found or timed out: {e}")
-
-                    # Wait for upload to process (dynamic wait)
-                    logger.info("Waiting for upload to complete (count increase)...")
-                    try:
-                        # Poll for count increase
-                        # We use a loop because simple explicit waits for count can be tricky without assertions library
-                        # or we can use wait_for_function
-                        
-                        async def check_count():
-                            current = await uploaded_items_locator.count()
-                            return current > initial_count
-                        
-                        # Custom poll
-                        max_retries = 60 # 60 seconds max
-                        uploaded = False
-                        for _ in range(max_retries):
-                            # Check for error toasts first
-                            has_error, error_msg = await self._check_for_toast_error()
-                            if has_error:
-                                logger.error(f"Website error during upload: {error_msg}")
-                                await self._clear_prompt_and_images()
-                                raise WebsiteError(error_msg)
-                            
-                            if await check_count():
-                                uploaded = True
-                                break
-                            await asyncio.sleep(1)
-                        
-                        if not uploaded:
-                            logger.warning("Upload count did not increase within timeout.")
-                        else:
-                            logger.info("Upload confirmed (count increased).")
-                            
-                        # Small buffer for UI settlement
-                        await asyncio.sleep(1)
-
-                    except WebsiteError:
-                        raise  # Re-raise WebsiteError
-                    except Exception as e:
-                         logger.error(f"Error waiting for upload completion: {e}")
-
-                    
-                except Exception as e:
-                    logger.error(f"Failed to upload image {img_path}: {e}")
-                    # Continue to next image
+        # Capture the gallery state before clicking Create, so anything that shows up
+        # afterwards is ours. Stale observer events from earlier jobs are dropped.
+        tab.drain_events()
+        initial_data = await self._find_images_by_prompt_matches(page, prompt)
+        initial_srcs = set(item["src"] for item in initial_data)
+        logger.info(f"Initial matching images count: {len(initial_data)}")
 
         # 3. Click Create
         try:
-            # Wait a bit for validation/button enablement
-            await asyncio.sleep(0.5)
-            create_btn = self.page.get_by_role("button", name="Create")
-            # Ensure it's enabled
-            await create_btn.wait_for(state="visible")
-            if await create_btn.is_disabled():
-                 logger.warning("Create button is disabled, trying to wait...")
-                 await create_btn.wait_for(state="enabled", timeout=5000)
-            
-            await create_btn.click()
+            with timer.step("create"):
+                await self._pace()
+                create_btn = page.get_by_role("button", name="Create")
+                # click() waits for the button to be visible and enabled (validation done)
+                await create_btn.click(timeout=10000)
+            created_at = timer.since_start()
             logger.info("Clicked Create button")
         except Exception as e:
             logger.error(f"Failed to click Create button: {e}")
@@ -515,162 +1228,476 @@ class NanoBananaClient:
         logger.info("Waiting for generation result...")
         
         # Strategy: 
-        # 1. Find all images where alt text contains the prompt (Robust filtering).
-        # 2. Compare 'src' attributes before and after to strictly identify NEW images.
+        # 1. The in-page observer (RESULT_OBSERVER_JS) reports every new Flow Image and error.
+        # 2. Keep images whose alt contains the prompt and whose src wasn't there before.
         # This handles repeated prompts and ordering (prepend vs append) correctly.
 
         try:
-             # Capture initial state
-             initial_data = await self._find_images_by_prompt_matches(prompt)
-             initial_srcs = set(item["src"] for item in initial_data)
-             logger.info(f"Initial matching images count: {len(initial_data)}")
-
-             # Wait loop
-             import time
-             start_time = time.time()
-             max_wait = config.TIMEOUT_MS / 1000
-             
-             new_items = []
-             
-             while time.time() - start_time < max_wait:
-                 # Check for error toasts first
-                 has_error, error_msg = await self._check_for_toast_error()
-                 if has_error:
+             loop = asyncio.get_running_loop()
+             deadline = loop.time() + config.TIMEOUT_MS / 1000
+             new_srcs = []
+
+             while True:
+                 remaining = deadline - loop.time()
+                 if remaining <= 0:
+                     break
+                 if not tab.healthy:
+                     raise TabBrokenError("Browser page crashed or closed during generation")
+                 try:
+                     event = await asyncio.wait_for(tab.events.get(), timeout=remaining)
+                 except asyncio.TimeoutError:
+                     break
+
+                 if event.get("type") == "page_broken":
+                     raise TabBrokenError(event["message"])
+
+                 if event.get("type") == "toast_error":
+                     error_msg = event.get("message") or "Unknown error from website"
                      logger.error(f"Website error during generation: {error_msg}")
-                     await self._clear_prompt_and_images()
+                     # Auto-refresh on "Something went wrong" error
+                     if "Something went wrong" in error_msg:
+                         await self._refresh_page(page)
+                     await self._clear_prompt_and_images(page)
                      raise WebsiteError(error_msg)
-                 
-                 # Check for inline generation errors (e.g., "Something went wrong." in result area)
-                 has_inline_error, inline_error_msg = await self._check_for_inline_generation_error()
-                 if has_inline_error:
+
+                 if event.get("type") == "inline_error":
+                     inline_error_msg = event.get("message")
                      logger.error(f"Inline generation error detected: {inline_error_msg}")
-                     await self._refresh_page()
-                     await self._clear_prompt_and_images()
+                     await self._refresh_page(page)
+                     await self._clear_prompt_and_images(page)
                      raise WebsiteError(inline_error_msg)
-                 
-                 current_data = await self._find_images_by_prompt_matches(prompt)
-                 
-                 # Identify new SRCs
-                 potential_new = [item for item in current_data if item["src"] not in initial_srcs]
-                 
+
+                 if event.get("type") != "image":
+                     continue
+                 src = event.get("src")
+                 if prompt not in (event.get("alt") or "") or src in initial_srcs or src in new_srcs:
+                     continue
+                 new_srcs.append(src)
+                 if len(new_srcs) == 1:
+                     timer.record("first_image", timer.since_start() - created_at)
+
                  # We expect usually 2 images
-                 if len(potential_new) >= 2:
-                     new_items = potential_new
-                     # Small settlement wait
-                     await asyncio.sleep(2)
+                 if len(new_srcs) >= 2:
+                     timer.record("all_images", timer.since_start() - created_at)
                      break
-                 
-                 if len(potential_new) >= 1:
-                     # Check if we waited long enough for a second one?
-                     # Let's wait a bit more aggressively if we have at least one
-                     if not new_items:
-                         # Use this as current best candidate
-                         new_items = potential_new
-                         logger.info("Found 1 image, waiting for potential second...")
-                     else:
-                         # We already had candidates, update if we found more
-                         if len(potential_new) > len(new_items):
-                             new_items = potential_new
-                 
-                 await asyncio.sleep(1)
+                 # Found 1 image: give the second one a bounded grace period instead of the full timeout
+                 logger.info("Found 1 image, waiting for potential second...")
+                 deadline = min(deadline, loop.time() + config.SECOND_IMAGE_GRACE_S)
+
+             # Resolve the reported srcs to elements (also catches anything the observer missed)
+             current_data = await self._find_images_by_prompt_matches(page, prompt)
+             new_items = [item for item in current_data if item["src"] not in initial_srcs]
 
              if not new_items:
                  logger.error("Timeout: No new images matches found.")
                  raise Exception("Generation Timed Out - No images found matching prompt")
 
+             # Settlement: wait until the new images have actually finished loading
+             try:
+                 with timer.step("settle"):
+                     await page.wait_for_function(IMAGES_LOADED_JS, arg=[item["src"] for item in new_items], timeout=10000)
+             except Exception as e:
+                 logger.warning(f"New images did not finish loading: {e}")
+
              logger.info(f"Found {len(new_items)} new images.")
 
+             # Index the results so upscales can go straight to them
+             locations = self._index_results(tab, new_items)
+             try:
+                 await page.evaluate(TAG_RESULTS_JS, [RESULT_KEY_ATTR, {loc.src: loc.dom_key for loc in locations.values()}])
+             except Exception as e:
+                 logger.warning(f"Could not tag result images: {e}")
+
              # Capture images
              new_image_streams = []
-             import io
 
              for item in new_items:
-                 img = item["element"]
-                 src = item["src"]
-                 
                  try:
-                     # Wait for visible
-                     await img.wait_for(state="visible", timeout=5000)
-                     await img.scroll_into_view_if_needed()
-                     
-                     logger.info(f"Capturing new image: {src[:50]}...")
-                     data = await img.screenshot(type="png")
-                     new_image_streams.append(io.BytesIO(data))
+                     with timer.step("capture"):
+                         data = await self._capture_image(tab, item)
+                     result_id = result_id_for(item["src"]) if item["src"] else None
+                     new_image_streams.append(GeneratedImage(data, result_id))
                  except Exception as e:
-                     logger.error(f"Failed to capture image {src[:30]}: {e}")
+                     logger.error(f"Failed to capture image {(item['src'] or '')[:30]}: {e}")
 
              return new_image_streams
 
-
+        except WebsiteError:
+            raise
         except Exception as e:
             logger.error(f"Failed to wait/capture result: {e}")
             # Fallback: Dump page again for debugging if failed
             try:
-                html = await self.page.content()
+                html = await page.content()
                 with open("debug_page_dump_failed_v2.html", "w", encoding="utf-8") as f:
                     f.write(html)
             except: pass
             raise Exception("Generation Timed Out or Failed")
 
-    async def _find_images_by_prompt_matches(self, prompt: str):
+    async def _upload_images(self, tab: BrowserTab, images: list, timer: StepTimer = None):
+        """Attaches all reference images to the prompt.
+
+        One image goes straight through the file chooser. Several go up in one go (multi-file
+        chooser, or a synthetic drop onto the prompt area) unless bulk upload already failed
+        on this page. Until a bulk mechanism has worked on the page, it gets
+        UPLOAD_PROBE_TIMEOUT_S to show a first thumbnail; if it doesn't land every image, the
+        partial upload is removed and the per-image flow takes over. The tab remembers what
+        worked until the page reloads."""
+        page = tab.page
+        logger.info(f"Uploading {len(images)} images: {images}")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        if len(images) > 1 and tab.upload_method != "single":
+            try:
+                method = await self._upload_images_bulk(page, images, tab.upload_method)
+                if method:
+                    if method != tab.upload_method:
+                        logger.info(f"[tab {tab.index}] Bulk upload works on this page ({method})")
+                    tab.upload_method = method
+                    self._record_upload(images, loop.time() - started)
+                    return
+                logger.warning("Bulk upload incomplete, falling back to per-image upload")
+            except WebsiteError:
+                raise
+            except Exception as e:
+                logger.warning(f"Bulk upload failed, falling back to per-image upload: {e}")
+            # Don't pay for the probe again until the page reloads
+            tab.upload_method = "single"
+            await self._remove_uploaded_images(page)
+            started = loop.time()
+        await self._upload_images_one_by_one(page, images, timer)
+        self._record_upload(images, loop.time() - started)
+
+    @staticmethod
+    def _record_upload(images: list, seconds: float):
+        """Counts uploaded bytes and, for preprocessed images, the time the original bytes
+        would have taken at this upload's rate."""
+        uploaded = sum(image.nbytes for image in images)
+        UPLOAD_BYTES.inc(uploaded)
+        saved = sum(image.source_nbytes - image.nbytes for image in images if image.source_nbytes)
+        if uploaded and saved > 0:
+            UPLOAD_SECONDS_SAVED.inc(seconds * saved / uploaded)
+
+    async def _open_upload_menu(self, page):
+        """Clicks the prompt's "Add" button and returns the "Upload" button of the menu it opens."""
+        # 1. Click the main "Add" prompt image button (the plus icon)
+        # We use a strict selector to avoid clicking the "Close" button of existing images
+        # Strategy: Get all buttons that have an 'add' icon, excluding those with 'close' icon
+        # The user provided HTML shows specific classes but we stick to structure for robustness.
+        add_btn_locator = page.locator("button").filter(
+            has=page.locator("i", has_text="add")
+        ).filter(
+            has_not=page.locator("i", has_text="close")
+        ).last
+
+        # Verify we found it
+        if await add_btn_locator.count() == 0:
+            logger.warning("Could not find 'Add' button with 'add' icon. Dumping debug info...")
+            # Fallback try less strict
+            add_btn_locator = page.locator("button").filter(has=page.locator("i", has_text="add")).last
+
+        await add_btn_locator.wait_for(state="visible", timeout=5000)
+        await add_btn_locator.click()
+        logger.info("Clicked Add button")
+
+        # 2. The specific "Upload" button
+        # User provided HTML shows the Upload button is in a container with data-index="0".
+        # We target this specifically to avoid clicking any gallery images (which would be at index 1+).
+        upload_btn = page.locator('div[data-index="0"] button').filter(
+            has=page.locator("i", has_text="upload")
+        ).filter(
+            has_text="Upload"
+        ).first
+        await upload_btn.wait_for(state="visible", timeout=5000)
+        return upload_btn
+
+    async def _wait_for_uploads(self, page, target_count: int, timeout_s: float = 60) -> bool:
+        """Waits until `target_count` thumbnails are attached, confirming any "Crop and Save"
+        dialogs that appear along the way. Raises WebsiteError on an error toast.
+        Returns whether the target count was reached."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout_s
+        crop_save_btn = page.get_by_role("button", name="Crop and Save")
+
+        while True:
+            remaining_ms = (deadline - loop.time()) * 1000
+            if remaining_ms <= 0:
+                break
+            settled = asyncio.ensure_future(
+                page.wait_for_function(UPLOADS_SETTLED_JS, arg=target_count, timeout=remaining_ms)
+            )
+            crop = asyncio.ensure_future(crop_save_btn.first.wait_for(state="visible", timeout=remaining_ms))
+            done, pending = await asyncio.wait({settled, crop}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+            if crop in done and not crop.exception():
+                # 3. Handle "Crop and Save"
+                await crop_save_btn.first.click()
+                logger.info("Clicked Crop and Save")
+                continue
+            # Settled, or timed out
+            break
+
+        snapshot = await self._probe(page)
+        # Check for error toasts first
+        has_error, error_msg = await self._check_for_toast_error(page, snapshot)
+        if has_error:
+            logger.error(f"Website error during upload: {error_msg}")
+            await self._clear_prompt_and_images(page)
+            raise WebsiteError(error_msg)
+        return snapshot["uploadedCount"] >= target_count
+
+    async def _upload_images_bulk(self, page, images: list, method: str = None) -> str | None:
+        """Uploads all images in one go, through `method` ("chooser" or "drop") if it's known to
+        work on this page, else whichever the file chooser allows. Returns the method if every
+        thumbnail showed up, None otherwise."""
+        initial_count = (await self._probe(page))["uploadedCount"]
+        target_count = initial_count + len(images)
+        expected = method
+
+        if method != "drop":
+            upload_btn = await self._open_upload_menu(page)
+            # Start waiting for file chooser before clicking "Upload"
+            async with page.expect_file_chooser() as fc_info:
+                await upload_btn.click()
+            file_chooser = await fc_info.value
+            if file_chooser.is_multiple():
+                await file_chooser.set_files([image.as_file_payload() for image in images])
+                method = "chooser"
+                logger.info(f"Selected {len(images)} files in one chooser")
+            else:
+                # Chooser only takes one file: drop them all onto the prompt area instead
+                await page.keyboard.press("Escape")
+                method = "drop"
+        if method == "drop":
+            files = [
+                {"name": image.name, "mime": image.mime_type, "data": base64.b64encode(image.data).decode("ascii")}
+                for image in images
+            ]
+            if not await page.evaluate(DROP_FILES_JS, files):
+                return None
+            logger.info(f"Dropped {len(images)} files onto the prompt area")
+
+        if method != expected:
+            # A page that ignores this mechanism shows nothing; don't sit out the full timeout
+            if not await self._wait_for_uploads(page, initial_count + 1, timeout_s=config.UPLOAD_PROBE_TIMEOUT_S):
+                logger.warning(f"No thumbnail {config.UPLOAD_PROBE_TIMEOUT_S:g}s after the {method} upload")
+                return None
+        logger.info("Waiting for all uploads to complete...")
+        if not await self._wait_for_uploads(page, target_count):
+            return None
+        logger.info(f"Bulk upload confirmed ({len(images)} images).")
+        return method
+
+    async def _upload_images_one_by_one(self, page, images: list, timer: StepTimer = None):
+        """Per-image upload flow: Add -> Upload -> file chooser -> Crop and Save, per image."""
+        timer = timer or StepTimer("upload")
+        for idx, image in enumerate(images):
+            try:
+                with timer.step("upload_image"):
+                    logger.info(f"Uploading image {idx+1}/{len(images)}: {image.name}")
+                    await self._pace()
+
+                    # Get current count of uploaded images to wait for change
+                    # Uploaded images are identified by having a "close" icon
+                    initial_count = (await self._probe(page))["uploadedCount"]
+                    logger.info(f"Current uploaded images count: {initial_count}")
+
+                    upload_btn = await self._open_upload_menu(page)
+                
+                    # Start waiting for file chooser before clicking "Upload"
+                    async with page.expect_file_chooser() as fc_info:
+                        await upload_btn.click()
+                
+                    file_chooser = await fc_info.value
+                    await file_chooser.set_files([image.as_file_payload()]) # Set single file
+                    logger.info(f"File selected: {image.name}")
+
+                    # Wait for upload to process (dynamic wait)
+                    logger.info("Waiting for upload to complete (count increase)...")
+                    if await self._wait_for_uploads(page, initial_count + 1):
+                        logger.info("Upload confirmed (count increased).")
+                    else:
+                        logger.warning("Upload count did not increase within timeout.")
+
+            except WebsiteError:
+                raise  # Re-raise WebsiteError
+            except Exception as e:
+                logger.error(f"Failed to upload image {image.name}: {e}")
+                # Continue to next image
+
+    async def _capture_image(self, tab: BrowserTab, item: dict) -> bytes:
+        """Returns the original bytes of a result image.
+
+        In "network" capture mode the bytes come from the response the page already received,
+        the data:/blob: URL itself, or a re-fetch through the context's request API (shares the
+        login cookies). Element screenshots are only the fallback, since they re-encode the
+        image and are capped at on-screen resolution."""
+        page = tab.page
+        src = item["src"] or ""
+
+        if config.CAPTURE_MODE == "network" and src:
+            try:
+                if src.startswith("data:"):
+                    header, _, payload = src.partition(",")
+                    data = base64.b64decode(payload) if header.endswith(";base64") else payload.encode()
+                    logger.info(f"Captured image from data URL ({len(data)} bytes)")
+                    return data
+
+                if src.startswith("blob:"):
+                    data = base64.b64decode(await page.evaluate(READ_BLOB_JS, src))
+                    logger.info(f"Captured image from blob URL ({len(data)} bytes)")
+                    return data
+
+                url = urljoin(page.url, src)
+                response = tab.image_responses.get(url)
+                if response is not None:
+                    try:
+                        data = await response.body()
+                        logger.info(f"Captured image from network response ({len(data)} bytes): {url[:50]}...")
+                        return data
+                    except Exception as e:
+                        logger.debug(f"Response body no longer available for {url[:50]}: {e}")
+
+                response = await self.context.request.get(url, timeout=30000)
+                if response.ok:
+                    data = await response.body()
+                    logger.info(f"Fetched image via request context ({len(data)} bytes): {url[:50]}...")
+                    return data
+                logger.warning(f"Fetching image returned HTTP {response.status}, falling back to screenshot")
+            except Exception as e:
+                logger.warning(f"Network capture failed for {src[:50]}, falling back to screenshot: {e}")
+
+        img = item["element"]
+        # Wait for visible
+        await img.wait_for(state="visible", timeout=5000)
+        await img.scroll_into_view_if_needed()
+        
+        logger.info(f"Capturing new image: {src[:50]}...")
+        return await img.screenshot(type="png")
+
+    def _index_results(self, tab: BrowserTab, items: list) -> dict:
+        """Records where each new result lives; returns {result_id: ResultLocation}."""
+        locations = {}
+        for item in items:
+            src = item["src"]
+            if not src:
+                continue
+            result_id = result_id_for(src)
+            location = ResultLocation(tab, src, hashlib.sha1(src.encode()).hexdigest()[:16])
+            self._results[result_id] = location
+            locations[result_id] = location
+        return locations
+
+    async def _locate_result(self, page, result_id: str, location: ResultLocation = None):
+        """Finds a result image by identifier: the DOM key its tab tagged it with, then its
+        src. Returns None if neither matches (e.g. the element was re-rendered away)."""
+        candidates = []
+        if location is not None and location.tab.page is page:
+            candidates.append(("index", page.locator(f'img[{RESULT_KEY_ATTR}="{location.dom_key}"]')))
+        src = location.src if location is not None else None
+        if src is None and not result_id.startswith("sha1:"):
+            src = result_id
+        if src:
+            candidates.append(("src", page.locator(f'img[alt*="Flow Image"][src={_css_string(src)}]')))
+        for method, locator in candidates:
+            if await locator.count() > 0:
+                UPSCALE_TARGETS.inc(method=method)
+                return locator.first
+        return None
+
+    async def _find_images_by_prompt_matches(self, page, prompt: str, snapshot: dict = None):
         """Helper to find all matching image elements and their SRCs for a given prompt."""
-        if not self.page:
+        if not page:
             return []
             
-        # We look for images with "Flow Image" first to narrow down
-        candidates = await self.page.locator('img[alt*="Flow Image"]').all()
-        matches = []
-        for img in candidates:
-            try:
-                alt = await img.get_attribute("alt")
-                src = await img.get_attribute("src")
-                # Check if prompt is in alt
-                if alt and prompt in alt:
-                    matches.append({"element": img, "src": src})
-            except:
-                pass # Element might have detached
-        return matches
+        snapshot = snapshot or await self._probe(page, prompt)
+        gallery = page.locator('img[alt*="Flow Image"]')
+        return [
+            {"element": gallery.nth(item["index"]), "src": item["src"], "alt": item["alt"]}
+            for item in snapshot["images"]
+        ]
 
-    async def upscale_image(self, prompt: str, image_index: int, scale_option: str):
+    async def upscale_image(self, prompt: str, image_index: int, scale_option: str, result_id: str = None):
         """
-        Upscales an image (identified by prompt and index) using the specified option (1K, 2K, 4K).
-        Returns the downloaded file bytes.
+        Upscales an image using the specified option (1K, 2K, 4K).
+        Returns an UpscaledFile (on disk, read it in chunks); the caller must close it.
+        The image is identified by result_id (from GeneratedImage) when given, otherwise by
+        prompt and index, which is what records from before result ids existed carry.
+        Prefers the tab that generated the image, since only that tab is sure to show it.
         """
+        self._ensure_available()
+
+        location = self._results.get(result_id) if result_id else None
+        preferred = location.tab if location is not None else self._prompt_tabs.get(prompt)
+        async with self.pool.lease(preferred) as tab:
+            logger.info(f"[tab {tab.index}] Leased for upscale")
+            timer = StepTimer(f"upscale {scale_option} tab {tab.index}", operation="upscale")
+            try:
+                result = await self._upscale_on_page(tab.page, prompt, image_index, scale_option, timer,
+                                                     result_id, location)
+                metrics.UPSCALE_SECONDS.observe(timer.since_start(), scale=scale_option)
+                return result
+            finally:
+                logger.info(timer.report())
+
+    async def _upscale_on_page(self, page, prompt: str, image_index: int, scale_option: str, timer: StepTimer = None,
+                               result_id: str = None, location: ResultLocation = None):
+        """Runs one upscale on a page the caller has leased exclusively."""
+        timer = timer or StepTimer(f"upscale {scale_option}")
         logger.info(f"Attempting to upscale image {image_index} for prompt '{prompt}' to {scale_option}")
-        
-        matches = await self._find_images_by_prompt_matches(prompt)
-        
-        if not matches or len(matches) <= image_index:
-             raise Exception(f"Image not found for prompt '{prompt}' at index {image_index}")
+        direct = config.UPSCALE_MODE == "direct"
+
+        # Fast path: this image's asset URL for the scale is already known, so skip the UI entirely
+        cached_url = self._upscale_urls.get((result_id, scale_option)) if direct and result_id else None
+        if cached_url:
+            with timer.step("direct_fetch"):
+                upscaled = await self._download_upscale(page, cached_url)
+            if upscaled is not None:
+                UPSCALE_DOWNLOADS.inc(path="cached_url")
+                return upscaled
 
-        target_img_data = matches[image_index]
-        target_img_element = target_img_data["element"]
+        with timer.step("find_target"):
+            target_img_element = await self._locate_result(page, result_id, location) if result_id else None
+            if target_img_element is None:
+                # No identifier, or it's gone from the page: fall back to scanning the gallery
+                if result_id:
+                    logger.warning(f"Result {result_id[:60]} not on the page, falling back to prompt match")
+                matches = await self._find_images_by_prompt_matches(page, prompt)
+                if not matches or len(matches) <= image_index:
+                    raise Exception(f"Image not found for prompt '{prompt}' at index {image_index}")
+                UPSCALE_TARGETS.inc(method="prompt_scan")
+                target_img_element = matches[image_index]["element"]
 
-        # Ensure visible
-        await target_img_element.scroll_into_view_if_needed()
+        with timer.step("locate_button"):
+            # Ensure visible
+            await target_img_element.scroll_into_view_if_needed()
 
-        # Locate the Download button associated with this image.
-        # Assumes the button is a sibling or in the same container.
-        # We try to find the closest common container.
-        # Strategy: Go to parent, checks for button with text "Download".
+            # Locate the Download button associated with this image.
+            # Assumes the button is a sibling or in the same container.
+            # We try to find the closest common container.
+            # Strategy: Go to parent, checks for button with text "Download".
         
-        # User provided snippet: <button ...>...Download...</button>
-        # We will look for a button with text "Download" near the image.
+            # User provided snippet: <button ...>...Download...</button>
+            # We will look for a button with text "Download" near the image.
         
-        # Method 1: Get parent chain and find button
-        # This is a heuristic.
-        download_btn = target_img_element.locator("xpath=..").locator("button").filter(has_text="Download").first
+            # Method 1: Get parent chain and find button
+            # This is a heuristic.
+            download_btn = target_img_element.locator("xpath=..").locator("button").filter(has_text="Download").first
         
-        # Verify if it exists, if not, try one level higher
-        if await download_btn.count() == 0:
-             download_btn = target_img_element.locator("xpath=../..").locator("button").filter(has_text="Download").first
+            # Verify if it exists, if not, try one level higher
+            if await download_btn.count() == 0:
+                 download_btn = target_img_element.locator("xpath=../..").locator("button").filter(has_text="Download").first
              
-        if await download_btn.count() == 0:
-             # Look for the button globally but scoped to the area? Hard without container class.
-             # Let's assume the previous logic found it.
-             raise Exception("Could not find Download button for the image.")
+            if await download_btn.count() == 0:
+                 # Look for the button globally but scoped to the area? Hard without container class.
+                 # Let's assume the previous logic found it.
+                 raise Exception("Could not find Download button for the image.")
 
-        await download_btn.click()
+        with timer.step("open_menu"):
+            await download_btn.click()
         logger.info("Clicked Download button, waiting for menu...")
         
         # Wait for menu options
@@ -679,54 +1706,148 @@ class NanoBananaClient:
         
         option_text = f"Download {scale_option}" # e.g. "Download 2K"
         
-        option_btn = self.page.get_by_text(option_text, exact=False)
+        option_btn = page.get_by_text(option_text, exact=False)
         
         try:
-            await option_btn.wait_for(state="visible", timeout=3000)
+            with timer.step("menu_visible"):
+                await option_btn.wait_for(state="visible", timeout=3000)
         except:
              # Maybe strict match issue?
              logger.warning(f"Option '{option_text}' not found, dumping page for debug...")
-             # await self.page.screenshot(path="debug_menu_missing.png")
+             # await page.screenshot(path="debug_menu_missing.png")
              raise Exception(f"Upscale option '{option_text}' not found in menu.")
 
         # Click and start download with error checking
         # First check for any existing errors
-        has_error, error_msg = await self._check_for_toast_error()
+        has_error, error_msg = await self._check_for_toast_error(page)
         if has_error:
             logger.error(f"Website error before upscale: {error_msg}")
             raise WebsiteError(error_msg)
+
+        # Fast path: the menu options link to the assets, so fetch the one we want directly
+        # (every scale's link is remembered, so a later upscale of this image skips the menu)
+        if direct:
+            try:
+                links = await page.evaluate(DOWNLOAD_LINKS_JS)
+            except Exception as e:
+                logger.debug(f"Could not read Download menu links: {e}")
+                links = {}
+            if result_id:
+                for scale, url in links.items():
+                    # data:/blob: links are either huge or die with the document; don't keep them
+                    if url.startswith(("http://", "https://")):
+                        self._upscale_urls[(result_id, scale)] = url
+            if links.get(scale_option):
+                with timer.step("direct_fetch"):
+                    upscaled = await self._download_upscale(page, links[scale_option])
+                if upscaled is not None:
+                    await page.keyboard.press("Escape")
+                    UPSCALE_DOWNLOADS.inc(path="menu_link")
+                    return upscaled
         
+        # Chromium writes the whole file before we learn its size: reserve an estimate up front
+        with timer.step("budget_wait"):
+            reserved = await self.upscale_budget.acquire(self._upscale_estimate)
         try:
-            async with self.page.expect_download(timeout=120000) as download_info:
-                await option_btn.click()
-                logger.info(f"Clicked {option_text}, waiting for download...")
-            
-            download = await download_info.value
-            
-        except Exception as e:
-            # Check for error toast if download failed
-            has_error, error_msg = await self._check_for_toast_error()
-            if has_error:
-                logger.error(f"Website error during upscale: {error_msg}")
-                raise WebsiteError(error_msg)
-            raise
-        
-        path = await download.path()
-        logger.info(f"Download complete: {path}")
-        
-        # Read file to bytes
-        with open(path, "rb") as f:
-            file_data = f.read()
-        
-        # Cleanup temp file
+            try:
+                with timer.step("download"):
+                    async with page.expect_download(timeout=120000) as download_info:
+                        await option_btn.click()
+                        logger.info(f"Clicked {option_text}, waiting for download...")
+
+                    download = await download_info.value
+
+            except Exception as e:
+                # Check for error toast if download failed
+                has_error, error_msg = await self._check_for_toast_error(page)
+                if has_error:
+                    logger.error(f"Website error during upscale: {error_msg}")
+                    raise WebsiteError(error_msg)
+                raise
+
+            UPSCALE_DOWNLOADS.inc(path="ui")
+            if result_id and download.url.startswith(("http://", "https://")):
+                # Next time this image is upscaled at this scale, fetch the URL directly
+                self._upscale_urls[(result_id, scale_option)] = download.url
+
+            with timer.step("read_file"):
+                # Chromium already streamed it to disk: hand that file over without reading it
+                path = await download.path()
+                logger.info(f"Download complete: {path}")
+                held, reserved = reserved, 0
+                reserved = await self._resize_reservation(held, os.path.getsize(path))
+                upscaled = UpscaledFile(path, self.upscale_budget, reserved)
+                # The file owns the reservation now
+                reserved = 0
+                return upscaled
+        finally:
+            self.upscale_budget.release(reserved)
+
+    def _spool(self, data: bytes, reserved: int) -> UpscaledFile:
+        fd, path = tempfile.mkstemp(prefix="upscale-", suffix=".bin")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return UpscaledFile(path, self.upscale_budget, reserved)
+
+    @property
+    def _upscale_estimate(self) -> int:
+        return int(config.UPSCALE_SIZE_ESTIMATE_MB * 1024 * 1024)
+
+    async def _resize_reservation(self, held: int, size: int) -> int:
+        """Turns `held` bytes reserved on an estimate into a reservation for the real `size`;
+        returns it. A shortfall is waited for with nothing held (ByteBudget lets a file larger
+        than the whole cap through once nothing else is in flight), so downloads settling at
+        the same time can't wait on each other. Callers zero their own count first, since the
+        held bytes are gone once this is called."""
+        if size <= held:
+            self.upscale_budget.release(held - size)
+            return size
+        self.upscale_budget.release(held)
+        return await self.upscale_budget.acquire(size)
+
+    async def _download_upscale(self, page, url: str) -> UpscaledFile | None:
+        """Downloads an upscale asset without the download UI, to a file on disk.
+
+        http(s) URLs go through the browser context's request API, so they carry the
+        browser's cookies, proxy and TLS settings. That API hands over the body in one piece:
+        UPSCALE_SIZE_ESTIMATE_MB is reserved from the in-flight budget before the request and
+        settled against the real size afterwards. data:/blob: URLs (only seen in the page's
+        own links) are decoded in memory. The body is written to disk on a worker thread.
+        Returns None if the URL didn't yield an image, so the caller can fall back to
+        clicking through the menu."""
+        url = urljoin(page.url, url)
+        reserved = 0
         try:
-            import os
-            os.remove(path)
-            logger.info(f"Deleted temp file: {path}")
+            if url.startswith(("data:", "blob:")):
+                if url.startswith("blob:"):
+                    data = base64.b64decode(await page.evaluate(READ_BLOB_JS, url))
+                else:
+                    header, _, payload = url.partition(",")
+                    data = base64.b64decode(payload) if header.endswith(";base64") else payload.encode()
+                reserved = await self.upscale_budget.acquire(len(data))
+            else:
+                reserved = await self.upscale_budget.acquire(self._upscale_estimate)
+                response = await self.context.request.get(url, timeout=120000)
+                try:
+                    content_type = response.headers.get("content-type", "")
+                    if response.status != 200 or not content_type.startswith(("image/", "application/octet-stream")):
+                        logger.warning(f"Direct upscale fetch got HTTP {response.status} ({content_type}), using the UI")
+                        return None
+                    data = await response.body()
+                finally:
+                    await response.dispose()
+                held, reserved = reserved, 0
+                reserved = await self._resize_reservation(held, len(data))
+            upscaled = await asyncio.to_thread(self._spool, data, reserved)
+            # The file owns the reservation now
+            reserved = 0
+            logger.info(f"Downloaded upscale directly ({upscaled.size} bytes): {url[:50]}...")
+            return upscaled
         except Exception as e:
-            logger.warning(f"Failed to delete temp file {path}: {e}")
-            
-        return io.BytesIO(file_data)
+            logger.warning(f"Direct upscale download failed for {url[:50]}, using the UI: {e}")
+            return None
+        finally:
+            self.upscale_budget.release(reserved)
 
 
 if __name__ == "__main__":
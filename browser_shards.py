@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import time
+import config
+import metrics
+from bounded_store import BoundedStore
+from browser_client import AccessDeniedError, NanoBananaClient, WebsiteError
+from scheduler import ByteBudget
+
+logger = logging.getLogger(__name__)
+
+SHARD_OUTSTANDING = metrics.Gauge("nanobanana_shard_outstanding_jobs", "Jobs running or waiting on each shard.", ["shard"])
+SHARD_AVAILABLE = metrics.Gauge(
+    "nanobanana_shard_available", "1 while a shard takes new jobs (started, healthy, not cooling down).", ["shard"]
+)
+SHARD_JOBS = metrics.Counter("nanobanana_shard_jobs_total", "Jobs routed to each shard, by kind.", ["shard", "kind"])
+SHARD_COOLDOWNS = metrics.Counter(
+    "nanobanana_shard_cooldowns_total", "Shards taken out of rotation, by reason (quota or blocked).", ["shard", "reason"]
+)
+
+
+def profile_dirs() -> list[str]:
+    """The profile directories to run, from USER_DATA_DIRS (else just USER_DATA_DIR)."""
+    dirs = [d.strip() for d in (config.USER_DATA_DIRS or "").split(",") if d.strip()]
+    return dirs or [config.USER_DATA_DIR]
+
+
+class Shard:
+    __slots__ = ("client", "outstanding", "cooldown_until", "started")
+
+    def __init__(self, client: NanoBananaClient):
+        self.client = client
+        self.outstanding = 0
+        self.cooldown_until = 0.0
+        self.started = False
+
+    @property
+    def name(self) -> str:
+        return self.client.name
+
+    @property
+    def capacity(self) -> int:
+        return self.client.pool.healthy_count if self.started else 0
+
+    @property
+    def cooling_down(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+    def load(self) -> float:
+        """Outstanding work per healthy tab, counting the job about to be added."""
+        return (self.outstanding + 1) / max(1, self.capacity)
+
+
+class ShardedClient:
+    """Spreads browser work over several browser profiles, one NanoBananaClient (persistent
+    context, Chrome process, account) each, so throughput grows with the profiles a host
+    can run instead of stopping at one Chrome process.
+
+    New generations go to the shard with the least outstanding work per healthy tab. Shards
+    that aren't started, have no healthy tab, or are cooling down are skipped. A shard cools
+    down for `cooldown_s` when its account hits a quota-like error (`quota_patterns` in a
+    WebsiteError) or gets the Access Denied page. If every shard is out, the least loaded
+    one with a healthy tab still gets the job. Upscales go to the shard that generated the
+    image. With more than one shard, result_ids are prefixed with the shard name
+    ("1/<result_id>") so that still works after a restart.
+
+    Exposes the parts of the NanoBananaClient interface the bot uses (start, stop,
+    generate_image, upscale_image, pool_size)."""
+
+    def __init__(self, profiles: list[str] = None, pool_size: int = None, target_url: str = None,
+                 cooldown_s: float = None, quota_patterns: str = None):
+        profiles = profiles or profile_dirs()
+        # One in-flight upscale cap for the process, however many profiles run
+        self.upscale_budget = ByteBudget("upscale_inflight", int(config.UPSCALE_INFLIGHT_MAX_MB * 1024 * 1024))
+        self.shards = [
+            Shard(NanoBananaClient(pool_size=pool_size, target_url=target_url, user_data_dir=path, name=str(i),
+                                   upscale_budget=self.upscale_budget))
+            for i, path in enumerate(profiles)
+        ]
+        self._by_name = {shard.name: shard for shard in self.shards}
+        self.pool_size = sum(shard.client.pool_size for shard in self.shards)
+        self.cooldown_s = cooldown_s if cooldown_s is not None else config.SHARD_COOLDOWN_S
+        patterns = quota_patterns if quota_patterns is not None else config.SHARD_QUOTA_PATTERNS
+        self.quota_patterns = [p.strip().lower() for p in patterns.split(",") if p.strip()]
+        # Prompt -> shard that generated it, for upscales without a result_id
+        self._prompt_shards = BoundedStore("prompt_shards", max_entries=1000, ttl_s=24 * 3600)
+        for shard in self.shards:
+            SHARD_OUTSTANDING.set(0, shard=shard.name)
+
+    @property
+    def page(self):
+        """First shard's first page, for scripts that drive the browser directly."""
+        return self.shards[0].client.page
+
+    def _update_gauges(self):
+        for shard in self.shards:
+            SHARD_OUTSTANDING.set(shard.outstanding, shard=shard.name)
+            SHARD_AVAILABLE.set(1 if shard.capacity and not shard.cooling_down else 0, shard=shard.name)
+
+    # --- lifecycle ---------------------------------------------------------
+
+    async def _start_shard(self, shard: Shard):
+        try:
+            await shard.client.start()
+            shard.started = True
+        except Exception as e:
+            logger.error(f"[shard {shard.name}] Failed to start ({shard.client.user_data_dir}): {e}")
+
+    async def start(self):
+        """Starts every profile's browser concurrently. Raises only if none started."""
+        await asyncio.gather(*(self._start_shard(shard) for shard in self.shards))
+        started = [shard for shard in self.shards if shard.started]
+        self._update_gauges()
+        if not started:
+            raise RuntimeError("No browser profile could be started")
+        if len(self.shards) > 1:
+            logger.info(f"Browser shards: {len(started)}/{len(self.shards)} profiles started, "
+                        f"{sum(s.client.pool_size for s in started)} tabs")
+
+    async def stop(self):
+        await asyncio.gather(*(shard.client.stop() for shard in self.shards if shard.started), return_exceptions=True)
+        for shard in self.shards:
+            shard.started = False
+        self._update_gauges()
+
+    # --- routing -----------------------------------------------------------
+
+    def _pick(self) -> Shard:
+        usable = [shard for shard in self.shards if shard.capacity]
+        if not usable:
+            # Let the client say why (not started / recovering)
+            return next((shard for shard in self.shards if shard.started), self.shards[0])
+        ready = [shard for shard in usable if not shard.cooling_down] or usable
+        # Ties go to the lower index, so a lightly loaded host keeps using the first profiles
+        return min(ready, key=Shard.load)
+
+    def _cool_down(self, shard: Shard, reason: str, message: str):
+        if len(self.shards) < 2 or self.cooldown_s <= 0:
+            return
+        shard.cooldown_until = time.monotonic() + self.cooldown_s
+        SHARD_COOLDOWNS.inc(shard=shard.name, reason=reason)
+        logger.warning(f"[shard {shard.name}] Out of rotation for {self.cooldown_s:.0f}s ({reason}): {message}")
+
+    async def _run(self, shard: Shard, kind: str, call):
+        shard.outstanding += 1
+        SHARD_JOBS.inc(shard=shard.name, kind=kind)
+        self._update_gauges()
+        try:
+            return await call
+        except WebsiteError as e:
+            if any(pattern in str(e).lower() for pattern in self.quota_patterns):
+                self._cool_down(shard, "quota", str(e))
+            raise
+        except AccessDeniedError as e:
+            self._cool_down(shard, "blocked", str(e))
+            raise
+        finally:
+            shard.outstanding -= 1
+            self._update_gauges()
+
+    def _split_result_id(self, result_id: str | None) -> tuple[Shard | None, str | None]:
+        if result_id and len(self.shards) > 1:
+            name, sep, inner = result_id.partition("/")
+            if sep and name in self._by_name:
+                return self._by_name[name], inner
+        return None, result_id
+
+    async def generate_image(self, prompt: str, images: list = None, aspect_ratio: str = None):
+        """NanoBananaClient.generate_image on the least loaded shard."""
+        shard = self._pick()
+        results = await self._run(shard, "generate", shard.client.generate_image(prompt, images, aspect_ratio))
+        self._prompt_shards[prompt] = shard
+        if len(self.shards) > 1:
+            for image in results or []:
+                if image.result_id:
+                    image.result_id = f"{shard.name}/{image.result_id}"
+        return results
+
+    async def upscale_image(self, prompt: str, image_index: int, scale_option: str, result_id: str = None):
+        """NanoBananaClient.upscale_image on the shard that generated the image."""
+        shard, result_id = self._split_result_id(result_id)
+        shard = shard or self._prompt_shards.get(prompt) or self._pick()
+        return await self._run(shard, "upscale",
+                               shard.client.upscale_image(prompt, image_index, scale_option, result_id))
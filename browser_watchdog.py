@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HEALTHY_TABS = metrics.Gauge("nanobanana_browser_healthy_tabs", "Pool tabs currently in rotation, per shard.", ["shard"])
+STANDBY_READY = metrics.Gauge(
+    "nanobanana_browser_standby_ready", "1 while a primed standby page is waiting, per shard.", ["shard"]
+)
+RECOVERIES = metrics.Counter(
+    "nanobanana_browser_recoveries_total",
+    "Browser recoveries by kind (standby, cold = new page primed on the spot, restart = relaunch) and outcome.",
+    ["kind", "outcome"],
+)
+
+
+class BrowserWatchdog:
+    """Keeps the client's page pool alive.
+
+    Crashed or closed pages are reported by Playwright events (see NanoBananaClient._attach)
+    and recovered right away: the tab gets the warm standby page, which is already sitting
+    on the target URL, so a dead tab is back within a health probe rather than a cold
+    navigation. If the whole context goes away the browser is relaunched. Every
+    `interval_s` idle tabs and the standby page also get a cheap health probe (one evaluate
+    with a timeout), which catches hung pages that never fire an event. Failed recoveries
+    are retried on the next check."""
+
+    def __init__(self, client, interval_s: float = None):
+        self.client = client
+        self.interval_s = interval_s if interval_s is not None else config.HEALTH_CHECK_INTERVAL_S
+        self._task: asyncio.Task = None
+        self._repairs: dict = {}
+        self._restart: asyncio.Task = None
+        # Set when a relaunch failed, so the next check tries again
+        self._restart_pending = False
+
+    def start(self):
+        self.client.warm_standby_soon()
+        if self._task or self.interval_s <= 0:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Browser watchdog started (every {self.interval_s:.0f}s)")
+
+    async def stop(self):
+        tasks = [t for t in [self._task, self._restart, *self._repairs.values()] if t]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = self._restart = None
+        self._repairs.clear()
+
+    def _update_gauges(self):
+        HEALTHY_TABS.set(self.client.pool.healthy_count, shard=self.client.name)
+        STANDBY_READY.set(1 if self.client.standby is not None else 0, shard=self.client.name)
+
+    # --- event-driven recovery ---------------------------------------------
+
+    def notify_broken(self, tab):
+        """Schedules recovery of a tab already marked broken (one repair per tab at a time)."""
+        self._update_gauges()
+        if self._restart and not self._restart.done():
+            return
+        task = self._repairs.get(tab)
+        if task is None or task.done():
+            self._repairs[tab] = asyncio.create_task(self._repair(tab))
+
+    def notify_context_lost(self):
+        self._update_gauges()
+        if self._restart is None or self._restart.done():
+            self._restart = asyncio.create_task(self._restart_browser())
+
+    async def _repair(self, tab):
+        pool = self.client.pool
+        await pool.acquire_for_repair(tab)
+        try:
+            with metrics.time_stage("browser", "recover_tab"):
+                kind = await self.client.replace_page(tab)
+            tab.healthy = True
+            RECOVERIES.inc(kind=kind, outcome="success")
+        except Exception as e:
+            logger.error(f"[tab {tab.index}] Recovery failed, will retry: {e}")
+            RECOVERIES.inc(kind="cold", outcome="failed")
+        finally:
+            tab.drain_events()
+            await pool.release(tab)
+            self._update_gauges()
+
+    async def _restart_browser(self):
+        pool = self.client.pool
+        # Let in-flight repairs finish (they fail fast on a dead context), then hold every tab
+        repairs = [t for t in self._repairs.values() if not t.done()]
+        await asyncio.gather(*repairs, return_exceptions=True)
+        for tab in pool.tabs:
+            await pool.acquire_for_repair(tab)
+        try:
+            with metrics.time_stage("browser", "restart"):
+                primed = await self.client.restart_browser()
+            for tab, ok in zip(pool.tabs, primed):
+                tab.healthy = ok
+            # Tabs that didn't prime are repaired one by one from the next check on
+            self._restart_pending = False
+            RECOVERIES.inc(kind="restart", outcome="success" if any(primed) else "failed")
+        except Exception as e:
+            logger.error(f"Browser restart failed, will retry: {e}")
+            self._restart_pending = True
+            RECOVERIES.inc(kind="restart", outcome="failed")
+        finally:
+            for tab in pool.tabs:
+                tab.drain_events()
+                await pool.release(tab)
+            self._update_gauges()
+
+    # --- periodic checks ---------------------------------------------------
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.warning(f"Browser watchdog check failed: {e}")
+
+    async def check(self):
+        client, pool = self.client, self.client.pool
+        if self._restart and not self._restart.done():
+            return
+        if self._restart_pending:
+            self.notify_context_lost()
+            return
+
+        for tab in list(pool.tabs):
+            if not tab.healthy:
+                self.notify_broken(tab)
+                continue
+            # Only idle tabs are probed; a busy tab is evidently being used
+            if not await pool.try_acquire(tab):
+                continue
+            probe = None
+            try:
+                probe = await client.probe_health(tab.page)
+            finally:
+                if probe is None:
+                    pool.mark_broken(tab)
+                await pool.release(tab)
+            if probe is None:
+                logger.warning(f"[tab {tab.index}] Failed health probe")
+                self.notify_broken(tab)
+
+        standby = client.standby
+        if standby is not None:
+            probe = await client.probe_health(standby.page)
+            if not probe or not probe["ready"]:
+                logger.warning("Standby page failed health probe, replacing it")
+                await client.discard_standby()
+        client.warm_standby_soon()
+        self._update_gauges()
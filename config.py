@@ -6,8 +6,96 @@ load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 HEADLESS = os.getenv("HEADLESS", "False").lower() == "true"
 USER_DATA_DIR = os.getenv("USER_DATA_DIR", "./user_data")
+# Several browser profiles (comma-separated dirs, one Chrome process and account each) to spread
+# jobs over; empty = just USER_DATA_DIR. A profile that hits a quota-like error (any of
+# SHARD_QUOTA_PATTERNS in the message) or the Access Denied page sits out SHARD_COOLDOWN_S.
+USER_DATA_DIRS = os.getenv("USER_DATA_DIRS", "")
+SHARD_COOLDOWN_S = float(os.getenv("SHARD_COOLDOWN_S", "600"))
+SHARD_QUOTA_PATTERNS = os.getenv("SHARD_QUOTA_PATTERNS", "quota,limit,too many requests,try again later")
+# Flow project page the client drives; point it at flow_standin.py for offline benchmarks
+TARGET_URL = os.getenv("TARGET_URL", "https://labs.google/fx/tools/flow/project/feaf1427-a157-4a61-be71-62b4677ec225")
+# Browser channel for launch_persistent_context ("chrome" = installed Chrome; empty = bundled Chromium)
+BROWSER_CHANNEL = os.getenv("BROWSER_CHANNEL", "chrome")
 TIMEOUT_MS = 120000  # 60 seconds timeout for generation
 URL = "https://labs.google/flow/nano-banana"  # Placeholder URL - User didn't specify exact URL, verifying assumption
 # Actually, the user described "Google Labs Flow's Nano Banana interface".
 # I will assume a URL or just navigate to google labs and handle redirection.
 # Wait, let's keep it configurable.
+# Number of browser tabs kept open in each persistent context; each tab runs one job at a time
+PAGE_POOL_SIZE = int(os.getenv("PAGE_POOL_SIZE", "3"))
+# Job scheduler: max jobs waiting for a browser tab, and per-user token bucket quota
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", "50"))
+USER_QUOTA_BURST = float(os.getenv("USER_QUOTA_BURST", "5"))
+USER_QUOTA_PER_MINUTE = float(os.getenv("USER_QUOTA_PER_MINUTE", "10"))
+# Once the first result image appears, how long to wait for the second one (seconds)
+SECOND_IMAGE_GRACE_S = float(os.getenv("SECOND_IMAGE_GRACE_S", "15"))
+# How result images are captured: "network" (original bytes, full resolution) or "screenshot"
+CAPTURE_MODE = os.getenv("CAPTURE_MODE", "network").lower()
+# How upscales are downloaded: "direct" (fetch the asset URL through the browser context into
+# a temp file) or "ui" (click the menu option and let Chromium save the download)
+UPSCALE_MODE = os.getenv("UPSCALE_MODE", "direct").lower()
+# Cap on upscale bytes in flight (downloaded but not yet uploaded to Telegram); 0 = no cap
+UPSCALE_INFLIGHT_MAX_MB = float(os.getenv("UPSCALE_INFLIGHT_MAX_MB", "256"))
+# Size reserved from that cap per upscale before its size is known (settled once it is)
+UPSCALE_SIZE_ESTIMATE_MB = float(os.getenv("UPSCALE_SIZE_ESTIMATE_MB", "32"))
+# Min-latency mode: no startup jitter and no human-like pacing between UI actions
+MIN_LATENCY = os.getenv("MIN_LATENCY", "False").lower() == "true"
+# Upper bound (seconds) of the human-like pause between UI actions when MIN_LATENCY is off
+HUMAN_PACING_S = float(os.getenv("HUMAN_PACING_S", "0.3"))
+# How long a bulk upload (multi-file chooser or drop) may take to show its first thumbnail on a
+# tab where it hasn't worked yet, before the images go through the per-image flow instead
+UPLOAD_PROBE_TIMEOUT_S = float(os.getenv("UPLOAD_PROBE_TIMEOUT_S", "5"))
+# Memory governor: how often tab/browser memory is sampled (seconds, 0 disables it), and the
+# thresholds that get an idle tab reloaded or reopened (0 disables a threshold)
+MEMORY_CHECK_INTERVAL_S = float(os.getenv("MEMORY_CHECK_INTERVAL_S", "60"))
+TAB_MAX_JS_HEAP_MB = float(os.getenv("TAB_MAX_JS_HEAP_MB", "512"))
+TAB_MAX_DOM_NODES = int(os.getenv("TAB_MAX_DOM_NODES", "150000"))
+BROWSER_MAX_MEMORY_MB = float(os.getenv("BROWSER_MAX_MEMORY_MB", "3072"))
+# How navigations (start-up, tab priming, refreshes) wait: "ready" = DOM loaded and the prompt
+# box and Images radio present, "networkidle" = the old wait for all network activity to stop
+NAVIGATION_WAIT = os.getenv("NAVIGATION_WAIT", "ready").lower()
+# Request policy (context.route): resource types and hosts (incl. subdomains) whose requests are
+# aborted, and hosts that are never blocked. BLOCK_RESOURCES=false removes the route entirely.
+BLOCK_RESOURCES = os.getenv("BLOCK_RESOURCES", "True").lower() == "true"
+BLOCK_RESOURCE_TYPES = os.getenv("BLOCK_RESOURCE_TYPES", "font,media,ping")
+BLOCK_HOSTS = os.getenv(
+    "BLOCK_HOSTS",
+    "google-analytics.com,analytics.google.com,googletagmanager.com,doubleclick.net,googlesyndication.com",
+)
+ALLOW_HOSTS = os.getenv("ALLOW_HOSTS", "")
+# Browser watchdog: health probe interval and timeout (seconds; interval 0 disables the
+# periodic probe), and whether to keep a primed standby page to swap in for a dead tab
+HEALTH_CHECK_INTERVAL_S = float(os.getenv("HEALTH_CHECK_INTERVAL_S", "30"))
+HEALTH_PROBE_TIMEOUT_S = float(os.getenv("HEALTH_PROBE_TIMEOUT_S", "5"))
+STANDBY_PAGE = os.getenv("STANDBY_PAGE", "True").lower() == "true"
+# Prometheus-style metrics endpoint (http://METRICS_HOST:METRICS_PORT/metrics); port 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+# Cache of downloaded Telegram files (keyed by file_unique_id): memory budget, plus an
+# optional disk tier (empty FILE_CACHE_DIR disables it)
+FILE_CACHE_MAX_MB = float(os.getenv("FILE_CACHE_MAX_MB", "64"))
+FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", "")
+FILE_CACHE_DISK_MAX_MB = float(os.getenv("FILE_CACHE_DISK_MAX_MB", "512"))
+# Input preprocessing on a process pool: images whose longest edge or size is over the budget
+# are resized and re-encoded (jpeg, webp or png; images with transparency stay png) before
+# upload, and with PREPROCESS_CROP center-cropped to the requested aspect ratio.
+# PREPROCESS_WORKERS=0 means one per CPU, up to 4.
+PREPROCESS_IMAGES = os.getenv("PREPROCESS_IMAGES", "True").lower() == "true"
+PREPROCESS_MAX_EDGE = int(os.getenv("PREPROCESS_MAX_EDGE", "2048"))
+PREPROCESS_FORMAT = os.getenv("PREPROCESS_FORMAT", "jpeg")
+PREPROCESS_QUALITY = int(os.getenv("PREPROCESS_QUALITY", "88"))
+PREPROCESS_MAX_KB = float(os.getenv("PREPROCESS_MAX_KB", "1536"))
+PREPROCESS_CROP = os.getenv("PREPROCESS_CROP", "False").lower() == "true"
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0"))
+# Opt-in cache of generated results (same prompt, input images and aspect ratio): memory budget
+# (0 disables it, along with coalescing identical in-flight requests) and hours a result is reused
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "0"))
+RESULT_CACHE_TTL_H = float(os.getenv("RESULT_CACHE_TTL_H", "6"))
+# Bounded per-message state: Upscale button records and album file lists (entries, hours idle)
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "20000"))
+GENERATION_CACHE_TTL_H = float(os.getenv("GENERATION_CACHE_TTL_H", "72"))
+MEDIA_GROUP_CACHE_MAX_ENTRIES = int(os.getenv("MEDIA_GROUP_CACHE_MAX_ENTRIES", "5000"))
+MEDIA_GROUP_CACHE_TTL_H = float(os.getenv("MEDIA_GROUP_CACHE_TTL_H", "48"))
+# SQLite file for state that must survive restarts (Upscale buttons, albums); empty disables it
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.db")
+STATE_DB_RETENTION_DAYS = float(os.getenv("STATE_DB_RETENTION_DAYS", "30"))
@@ -0,0 +1,386 @@
+"""Local stand-in for the Telegram Bot API, for end-to-end load tests of bot.py.
+
+Point python-telegram-bot at it with
+    ApplicationBuilder().base_url(server.api_url).base_file_url(server.file_url)
+(or bot.build_application(token, server.api_url, server.file_url)).
+
+Implements the subset of the Bot API the bot uses:
+
+- getMe, getUpdates (long polling), getFile and file downloads under /file/bot<token>/
+- sendMessage, sendPhoto, sendDocument, editMessageText, editMessageCaption and
+  answerCallbackQuery, which are recorded (see `calls`, `counts` and `add_listener`)
+- any other method answers {"ok": true, "result": true}
+
+and generates synthetic user traffic: commands, photos and image documents with captions,
+albums (media groups), replies to earlier messages and inline-button presses.
+All traffic methods are thread-safe and return the message dicts they created.
+"""
+import io
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Nano Banana", "username": "nano_banana_test_bot"}
+
+# Methods whose calls are kept in `calls` and passed to listeners
+RECORDED_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "editMessageText", "editMessageCaption", "answerCallbackQuery",
+}
+
+
+def _parse_body(content_type: str, body: bytes) -> tuple[dict, dict]:
+    """Returns (params, files) for a Bot API request body.
+
+    python-telegram-bot sends form-encoded or multipart requests whose values are strings
+    (nested objects JSON-encoded); file parts are returned as bytes."""
+    params, files = {}, {}
+    if not body:
+        return params, files
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename() is not None:
+                files[name] = payload
+            else:
+                params[name] = payload.decode()
+    elif content_type.startswith("application/json"):
+        params = {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.loads(body).items()}
+    else:
+        params = {k: v[-1] for k, v in parse_qs(body.decode(), keep_blank_values=True).items()}
+    return params, files
+
+
+def _json_param(params: dict, name: str):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def _int_param(params: dict, name: str):
+    value = params.get(name)
+    return int(value) if value not in (None, "") else None
+
+
+class FakeTelegram:
+    """Threaded HTTP server speaking enough of the Bot API to run bot.py against."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, token: str = TOKEN, api_latency_s: float = 0.0):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.api_latency_s = api_latency_s
+        self._lock = threading.Lock()
+        self._updates_ready = threading.Condition(self._lock)
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        # file_id -> {"data", "file_unique_id", "mime_type"}
+        self.files: dict[str, dict] = {}
+        # (chat_id, message_id) -> message dict, for edits and callback queries
+        self.messages: dict[tuple, dict] = {}
+        self.calls: list[dict] = []
+        self.counts: dict[str, int] = {}
+        self._listeners = []
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def api_url(self) -> str:
+        """Value for ApplicationBuilder.base_url (the token is appended by the library)."""
+        return self.base_url + "/bot"
+
+    @property
+    def file_url(self) -> str:
+        """Value for ApplicationBuilder.base_file_url."""
+        return self.base_url + "/file/bot"
+
+    def add_listener(self, callback):
+        """`callback(call)` runs on the server thread for every recorded bot call.
+
+        `call` is {"method", "chat_id", "reply_to", "params", "files", "result", "time"}."""
+        self._listeners.append(callback)
+
+    # --- files -------------------------------------------------------------
+
+    def add_file(self, data: bytes, mime_type: str = "image/jpeg") -> dict:
+        """Stores `data` and returns its {"file_id", "file_unique_id", "file_size"}."""
+        file_id = "F" + uuid.uuid4().hex
+        unique_id = uuid.uuid4().hex[:16]
+        with self._lock:
+            self.files[file_id] = {"data": data, "file_unique_id": unique_id, "mime_type": mime_type}
+        return {"file_id": file_id, "file_unique_id": unique_id, "file_size": len(data)}
+
+    def _photo_sizes(self, data: bytes, mime_type: str = "image/jpeg") -> list:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                width, height = img.size
+        except Exception:
+            width = height = 0
+        return [dict(self.add_file(data, mime_type), width=width, height=height)]
+
+    def _document(self, data: bytes, mime_type: str, file_name: str) -> dict:
+        return dict(self.add_file(data, mime_type), file_name=file_name, mime_type=mime_type)
+
+    # --- synthetic traffic -------------------------------------------------
+
+    @staticmethod
+    def user(user_id: int, name: str = None) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": name or f"User{user_id}"}
+
+    def _new_message(self, chat_id: int, sender: dict, **fields) -> dict:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group",
+                     **({"first_name": sender["first_name"]} if chat_id > 0 else {"title": f"Chat {chat_id}"})},
+            "from": sender,
+        }
+        message.update({k: v for k, v in fields.items() if v is not None})
+        with self._lock:
+            self.messages[(chat_id, message["message_id"])] = message
+        return message
+
+    def push_update(self, update: dict) -> dict:
+        with self._updates_ready:
+            update["update_id"] = next(self._update_ids)
+            self._updates.append(update)
+            self._updates_ready.notify_all()
+        return update
+
+    def send_text(self, chat_id: int, user: dict, text: str, reply_to: dict = None) -> dict:
+        """A user text message. A leading /command gets its bot_command entity."""
+        entities = None
+        if text.startswith("/"):
+            command = text.split()[0]
+            entities = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        message = self._new_message(chat_id, user, text=text, entities=entities, reply_to_message=reply_to)
+        self.push_update({"message": message})
+        return message
+
+    def send_photo(self, chat_id: int, user: dict, data: bytes, caption: str = None,
+                   media_group_id: str = None, reply_to: dict = None) -> dict:
+        message = self._new_message(
+            chat_id, user, photo=self._photo_sizes(data), caption=caption,
+            media_group_id=media_group_id, reply_to_message=reply_to,
+        )
+        self.push_update({"message": message})
+        return message
+
+    def send_document(self, chat_id: int, user: dict, data: bytes, mime_type: str = "image/png",
+                      file_name: str = "image.png", caption: str = None, media_group_id: str = None,
+                      reply_to: dict = None) -> dict:
+        message = self._new_message(
+            chat_id, user, document=self._document(data, mime_type, file_name), caption=caption,
+            media_group_id=media_group_id, reply_to_message=reply_to,
+        )
+        self.push_update({"message": message})
+        return message
+
+    def send_album(self, chat_id: int, user: dict, images: list, caption: str = None,
+                   reply_to: dict = None, spacing_s: float = 0.0) -> list:
+        """A media group of photos; the caption goes on the first one, as Telegram clients do."""
+        media_group_id = str(uuid.uuid4().int)[:18]
+        messages = []
+        for i, data in enumerate(images):
+            if i and spacing_s:
+                time.sleep(spacing_s)
+            messages.append(self.send_photo(
+                chat_id, user, data, caption=caption if i == 0 else None,
+                media_group_id=media_group_id, reply_to=reply_to,
+            ))
+        return messages
+
+    def press_button(self, user: dict, message: dict, data: str) -> dict:
+        """A callback query from an inline button on `message` (normally a bot message)."""
+        return self.push_update({"callback_query": {
+            "id": uuid.uuid4().hex,
+            "from": user,
+            "chat_instance": str(message["chat"]["id"]),
+            "data": data,
+            "message": message,
+        }})
+
+    # --- bot API -----------------------------------------------------------
+
+    def _get_updates(self, params: dict) -> list:
+        offset = _int_param(params, "offset") or 0
+        limit = _int_param(params, "limit") or 100
+        deadline = time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_ready:
+            # Updates below the offset are confirmed and can go
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._updates_ready.wait(remaining)
+            return self._updates[:limit]
+
+    def _bot_message(self, params: dict, files: dict, **fields) -> dict:
+        chat_id = _int_param(params, "chat_id")
+        reply = _json_param(params, "reply_parameters") or {}
+        reply_to_id = reply.get("message_id") or _int_param(params, "reply_to_message_id")
+        with self._lock:
+            reply_to = self.messages.get((chat_id, reply_to_id))
+        return self._new_message(
+            chat_id, BOT_USER, reply_to_message=reply_to,
+            reply_markup=_json_param(params, "reply_markup"), **fields,
+        )
+
+    def _edit_message(self, params: dict, **fields) -> dict:
+        key = (_int_param(params, "chat_id"), _int_param(params, "message_id"))
+        with self._lock:
+            message = self.messages.get(key)
+            if message is None:
+                raise KeyError("message to edit not found")
+            message.update(fields, edit_date=int(time.time()))
+            if "reply_markup" in params:
+                message["reply_markup"] = _json_param(params, "reply_markup")
+            return dict(message)
+
+    def call(self, method: str, params: dict, files: dict):
+        """Dispatches one Bot API method; returns the `result` payload."""
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getFile":
+            file_id = params.get("file_id")
+            with self._lock:
+                stored = self.files.get(file_id)
+            if stored is None:
+                raise KeyError("file not found")
+            return {"file_id": file_id, "file_unique_id": stored["file_unique_id"],
+                    "file_size": len(stored["data"]), "file_path": f"files/{file_id}"}
+        if method == "sendMessage":
+            return self._bot_message(params, files, text=params.get("text", ""))
+        if method == "sendPhoto":
+            data = files.get("photo") or b""
+            return self._bot_message(params, files, photo=self._photo_sizes(data, "image/png"),
+                                     caption=params.get("caption"))
+        if method == "sendDocument":
+            data = files.get("document") or b""
+            return self._bot_message(params, files, document=self._document(data, "image/png", "document.png"),
+                                     caption=params.get("caption"))
+        if method == "editMessageText":
+            return self._edit_message(params, text=params.get("text", ""))
+        if method == "editMessageCaption":
+            return self._edit_message(params, caption=params.get("caption", ""))
+        return True
+
+    def _record(self, method: str, params: dict, files: dict, result):
+        reply = _json_param(params, "reply_parameters") or {}
+        call = {
+            "method": method,
+            "chat_id": _int_param(params, "chat_id"),
+            "reply_to": reply.get("message_id") or _int_param(params, "reply_to_message_id"),
+            "params": params,
+            "files": {name: len(data) for name, data in files.items()},
+            "result": result,
+            "time": time.monotonic(),
+        }
+        with self._lock:
+            self.calls.append(call)
+            self.counts[method] = self.counts.get(method, 0) + 1
+        for listener in self._listeners:
+            try:
+                listener(call)
+            except Exception as e:
+                logger.warning(f"Fake Telegram listener failed: {e}")
+
+    def start(self):
+        fake = self
+        api_prefix = f"/bot{self.token}/"
+        file_prefix = f"/file/bot{self.token}/"
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug("fake telegram: " + format % args)
+
+            def _send(self, status: int, body: bytes, content_type: str):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status: int, payload: dict):
+                self._send(status, json.dumps(payload).encode(), "application/json")
+
+            def _api(self, body: bytes):
+                path = unquote(urlparse(self.path).path)
+                if not path.startswith(api_prefix):
+                    self._send_json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return
+                method = path[len(api_prefix):]
+                params, files = _parse_body(self.headers.get("Content-Type", ""), body)
+                params.update({k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()})
+                if fake.api_latency_s and method != "getUpdates":
+                    time.sleep(fake.api_latency_s)
+                try:
+                    result = fake.call(method, params, files)
+                except KeyError as e:
+                    self._send_json(400, {"ok": False, "error_code": 400, "description": f"Bad Request: {e.args[0]}"})
+                    return
+                if method in RECORDED_METHODS:
+                    fake._record(method, params, files, result)
+                self._send_json(200, {"ok": True, "result": result})
+
+            def do_GET(self):
+                path = unquote(urlparse(self.path).path)
+                if path.startswith(file_prefix):
+                    file_id = path[len(file_prefix):].split("/")[-1]
+                    with fake._lock:
+                        stored = fake.files.get(file_id)
+                    if stored is None:
+                        self._send(404, b"not found", "text/plain")
+                    else:
+                        self._send(200, stored["data"], stored["mime_type"])
+                    return
+                self._api(b"")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self._api(self.rfile.read(length))
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        logger.info(f"Fake Telegram Bot API serving {self.api_url}")
+        return self
+
+    def stop(self):
+        if self._server:
+            with self._updates_ready:
+                self._updates_ready.notify_all()
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+from input_image import InputImage
+
+logger = logging.getLogger(__name__)
+
+FILE_CACHE_REQUESTS = metrics.Counter(
+    "nanobanana_file_cache_requests_total", "Telegram file lookups by the tier that answered.", ["tier"]
+)
+# file_unique_id is URL-safe base64; anything else stays out of the disk tier
+_SAFE_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+class CachedFile:
+    __slots__ = ("unique_id", "data", "mime_type", "metadata")
+
+    def __init__(self, unique_id: str, data: bytes, mime_type: str, metadata: dict = None):
+        self.unique_id = unique_id
+        self.data = data
+        self.mime_type = mime_type
+        self.metadata = metadata if metadata is not None else {}
+
+
+class FileCache:
+    """Content-addressed cache of downloaded Telegram files, keyed by file_unique_id.
+
+    file_unique_id identifies the content itself (unlike file_id it's the same for every
+    message that carries the file), so replies to the same photo or album hit the cache
+    and skip both getFile and the download. Decoded metadata (dimensions, EXIF orientation)
+    is cached alongside the bytes.
+
+    Memory tier: LRU under `max_bytes`. Entries evicted from it spill to the optional disk
+    tier (`disk_dir`, LRU under `disk_max_bytes`), which also survives restarts once close()
+    has flushed the memory tier. Disk I/O runs in order on one worker thread."""
+
+    def __init__(self, max_bytes: int, disk_dir: str = None, disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir if disk_dir and disk_max_bytes > 0 else None
+        self.disk_max_bytes = disk_max_bytes
+        self._memory: OrderedDict[str, CachedFile] = OrderedDict()
+        self.memory_bytes = 0
+        # unique_id -> size on disk, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self.disk_bytes = 0
+        self._executor = None
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._scan_disk()
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="file-cache")
+
+    def __len__(self):
+        return len(self._memory)
+
+    # --- disk tier ---------------------------------------------------------
+
+    def _paths(self, unique_id: str) -> tuple[str, str]:
+        base = os.path.join(self.disk_dir, unique_id)
+        return base + ".bin", base + ".json"
+
+    def _scan_disk(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            unique_id, ext = os.path.splitext(name)
+            if ext != ".bin" or not _SAFE_ID.match(unique_id):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_mtime, unique_id, stat.st_size))
+        for _, unique_id, size in sorted(entries):
+            self._disk[unique_id] = size
+            self.disk_bytes += size
+        logger.info(f"File cache: {len(self._disk)} files ({self.disk_bytes / 1e6:.1f} MB) on disk in {self.disk_dir}")
+
+    def _read_disk(self, unique_id: str) -> CachedFile | None:
+        data_path, meta_path = self._paths(unique_id)
+        try:
+            with open(data_path, "rb") as f:
+                data = f.read()
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            os.utime(data_path)
+        except (OSError, ValueError) as e:
+            logger.debug(f"File cache: could not read {unique_id} from disk: {e}")
+            return None
+        return CachedFile(unique_id, data, meta.get("mime_type", "image/jpeg"), meta.get("metadata") or {})
+
+    def _write_disk(self, entry: CachedFile):
+        data_path, meta_path = self._paths(entry.unique_id)
+        try:
+            if not os.path.exists(data_path):
+                with open(data_path + ".tmp", "wb") as f:
+                    f.write(entry.data)
+                os.replace(data_path + ".tmp", data_path)
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"mime_type": entry.mime_type, "metadata": entry.metadata}, f)
+            os.replace(meta_path + ".tmp", meta_path)
+        except OSError as e:
+            logger.warning(f"File cache: could not write {entry.unique_id} to disk: {e}")
+
+    def _delete_disk(self, unique_id: str):
+        for path in self._paths(unique_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _spill(self, entry: CachedFile) -> list:
+        """Books `entry` into the disk tier; returns the blocking work for a worker thread."""
+        if not self.disk_dir or not _SAFE_ID.match(entry.unique_id) or len(entry.data) > self.disk_max_bytes:
+            return []
+        work = [lambda: self._write_disk(entry)]
+        if entry.unique_id not in self._disk:
+            self._disk[entry.unique_id] = len(entry.data)
+            self.disk_bytes += len(entry.data)
+        self._disk.move_to_end(entry.unique_id)
+        while self.disk_bytes > self.disk_max_bytes:
+            old_id, size = self._disk.popitem(last=False)
+            self.disk_bytes -= size
+            work.append(lambda old_id=old_id: self._delete_disk(old_id))
+        return work
+
+    def _run_on_disk_thread(self, work: list):
+        return asyncio.get_running_loop().run_in_executor(self._executor, lambda: [job() for job in work])
+
+    # --- memory tier -------------------------------------------------------
+
+    def _insert(self, entry: CachedFile):
+        old = self._memory.pop(entry.unique_id, None)
+        if old is not None:
+            self.memory_bytes -= len(old.data)
+        if len(entry.data) > self.max_bytes:
+            # Too big for the memory tier; keep it on disk only
+            work = self._spill(entry)
+            if work:
+                self._run_on_disk_thread(work)
+            return
+        self._memory[entry.unique_id] = entry
+        self.memory_bytes += len(entry.data)
+        work = []
+        while self.memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self.memory_bytes -= len(evicted.data)
+            work.extend(self._spill(evicted))
+        if work:
+            self._run_on_disk_thread(work)
+
+    async def get(self, unique_id: str) -> CachedFile | None:
+        entry = self._memory.get(unique_id)
+        if entry is not None:
+            self._memory.move_to_end(unique_id)
+            FILE_CACHE_REQUESTS.inc(tier="memory")
+            return entry
+        if unique_id in self._disk:
+            entry = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_disk, unique_id)
+            if entry is not None:
+                self._disk.move_to_end(unique_id)
+                FILE_CACHE_REQUESTS.inc(tier="disk")
+                self._insert(entry)
+                return entry
+        FILE_CACHE_REQUESTS.inc(tier="miss")
+        return None
+
+    def put(self, unique_id: str, data: bytes, mime_type: str) -> CachedFile:
+        entry = CachedFile(unique_id, data, mime_type)
+        self._insert(entry)
+        return entry
+
+    async def fetch(self, bot, file_id: str, unique_id: str, mime_type: str = "image/jpeg") -> InputImage:
+        """Returns the file as a new InputImage (owned by the caller), downloading it on a miss."""
+        entry = await self.get(unique_id) if unique_id else None
+        if entry is None:
+            image = await InputImage.from_telegram(await bot.get_file(file_id), mime_type)
+            if not unique_id:
+                return image
+            entry = self.put(unique_id, image.data, mime_type)
+        return InputImage(entry.data, entry.mime_type, metadata=entry.metadata)
+
+    async def close(self):
+        """Flushes the memory tier to disk, so its entries (and metadata) survive a restart."""
+        work = []
+        for entry in self._memory.values():
+            work.extend(self._spill(entry))
+        if work:
+            await self._run_on_disk_thread(work)
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,475 @@
+"""Offline stand-in for the Google Labs Flow project page.
+
+Reproduces the DOM contract NanoBananaClient relies on, so the client can be
+benchmarked and regression-tested without touching labs.google:
+
+- textarea#PINHOLE_TEXT_AREA_ELEMENT_ID, the Images/Videos radios and the Create button
+- Settings (tune icon) with the Aspect Ratio combobox and its options
+- Add -> Upload (div[data-index="0"]) -> file chooser -> Crop and Save -> thumbnail with a close icon,
+  plus drag-and-drop onto the prompt area
+- sonner toasts (li[data-sonner-toast][data-visible="true"] with an "error" icon)
+- inline "Something went wrong." results
+- gallery of img[alt*="Flow Image"] with a Download menu offering 1K/2K/4K
+
+Generation latency, error injection and initial gallery size are configurable. With
+--asset-latency the page also pulls a slow web font and a slow "third-party" analytics
+script (served from localhost instead of 127.0.0.1) that sends beacons for a few seconds,
+like the real page's fonts and analytics, so navigation waits can be compared.
+
+Run standalone:
+    python flow_standin.py --port 8765 --latency 3 --error-rate 0.1 --gallery-size 300
+then point the client at it with TARGET_URL=http://127.0.0.1:8765/fx/tools/flow/project/standin
+"""
+import argparse
+import io
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+PROJECT_PATH = "/fx/tools/flow/project/standin"
+
+# Long edge in pixels for each Download option
+SCALE_EDGES = {"1K": 1024, "2K": 2048, "4K": 4096}
+PREVIEW_EDGE = 1024
+
+TOAST_ERRORS = [
+    "Something went wrong",
+    "This prompt may violate our policies. Please try a different prompt.",
+]
+
+PAGE_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Flow (stand-in)</title>
+<style>
+  body { font-family: sans-serif; margin: 0; }
+  #gallery { display: flex; flex-wrap: wrap; gap: 8px; padding: 8px; }
+  .card { position: relative; width: 200px; }
+  .card img { width: 200px; display: block; }
+  .popover { position: fixed; top: 60px; right: 20px; background: #fff; border: 1px solid #999; padding: 8px; z-index: 10; }
+  .dialog { position: fixed; inset: 30% 30%; background: #fff; border: 2px solid #333; padding: 16px; z-index: 20; }
+  ol.toaster { position: fixed; bottom: 8px; right: 8px; list-style: none; z-index: 30; }
+  .thumb { display: inline-flex; align-items: center; gap: 2px; }
+  .thumb img { width: 32px; height: 32px; object-fit: cover; }
+</style>
+__HEAD_EXTRA__
+</head>
+<body>
+<header>
+  <div role="radiogroup">
+    <button role="radio" aria-checked="false" id="mode-videos">Videos</button>
+    <button role="radio" aria-checked="false" id="mode-images">Images</button>
+  </div>
+  <button id="settings-btn"><i>tune</i></button>
+</header>
+
+<div id="prompt-area">
+  <div id="thumbs"></div>
+  <textarea id="PINHOLE_TEXT_AREA_ELEMENT_ID" rows="3" cols="60"></textarea>
+  <button id="add-btn"><i>add</i></button>
+  <button id="create-btn" disabled>Create</button>
+  <input type="file" id="file-input" accept="image/*" style="display:none">
+</div>
+
+<div id="gallery"></div>
+<ol class="toaster" id="toaster"></ol>
+
+<script>
+const CONFIG = __CONFIG__;
+const $ = (sel) => document.querySelector(sel);
+const el = (html) => { const t = document.createElement('template'); t.innerHTML = html.trim(); return t.content.firstChild; };
+const escapeHtml = (s) => s.replace(/[&<>"]/g, (c) => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'}[c]));
+const state = {aspect: 'landscape', uploads: 0, cropQueue: [], busy: false};
+
+// --- Mode radios -----------------------------------------------------------
+for (const id of ['mode-videos', 'mode-images']) {
+  $('#' + id).addEventListener('click', () => {
+    setTimeout(() => {
+      document.querySelectorAll('[role="radio"]').forEach((r) => r.setAttribute('aria-checked', String(r.id === id)));
+    }, CONFIG.ui_delay_ms);
+  });
+}
+$('#mode-videos').setAttribute('aria-checked', 'true');
+
+// --- Settings popover ------------------------------------------------------
+const aspectLabel = () => state.aspect === 'portrait' ? 'Portrait' : 'Landscape';
+const closePopovers = () => document.querySelectorAll('.popover').forEach((p) => p.remove());
+$('#settings-btn').addEventListener('click', () => {
+  closePopovers();
+  setTimeout(() => {
+    const pop = el(`<div class="popover" id="settings-popover">
+      <button role="combobox" id="aspect-combo"><span>Aspect Ratio</span> <span>${aspectLabel()}</span></button>
+    </div>`);
+    document.body.appendChild(pop);
+    $('#aspect-combo').addEventListener('click', () => {
+      const list = el(`<div role="listbox" id="aspect-options">
+        <div role="option" data-value="landscape">Landscape (16:9)</div>
+        <div role="option" data-value="portrait">Portrait (9:16)</div>
+      </div>`);
+      list.querySelectorAll('[role="option"]').forEach((opt) => opt.addEventListener('click', () => {
+        state.aspect = opt.dataset.value;
+        list.remove();
+        $('#aspect-combo').lastElementChild.textContent = aspectLabel();
+      }));
+      pop.appendChild(list);
+    });
+  }, CONFIG.ui_delay_ms);
+});
+document.addEventListener('keydown', (e) => { if (e.key === 'Escape') closePopovers(); });
+
+// --- Prompt + Create -------------------------------------------------------
+const updateCreate = () => { $('#create-btn').disabled = state.busy || !$('#PINHOLE_TEXT_AREA_ELEMENT_ID').value.trim(); };
+$('#PINHOLE_TEXT_AREA_ELEMENT_ID').addEventListener('input', updateCreate);
+
+// --- Uploads ---------------------------------------------------------------
+if (CONFIG.multiple_files) $('#file-input').setAttribute('multiple', '');
+$('#add-btn').addEventListener('click', () => {
+  closePopovers();
+  setTimeout(() => {
+    const menu = el(`<div class="popover" id="add-menu">
+      <div data-index="0"><button id="upload-btn"><i>upload</i>Upload</button></div>
+    </div>`);
+    document.body.appendChild(menu);
+    $('#upload-btn').addEventListener('click', () => { $('#file-input').click(); });
+  }, CONFIG.ui_delay_ms);
+});
+
+const addThumbnail = (file) => {
+  const url = URL.createObjectURL(file);
+  const thumb = el(`<span class="thumb"><img src="${url}" alt="Uploaded image"><button class="remove-upload"><i>close</i></button></span>`);
+  thumb.querySelector('button').addEventListener('click', () => {
+    setTimeout(() => { thumb.remove(); state.uploads--; }, CONFIG.ui_delay_ms);
+  });
+  $('#thumbs').appendChild(thumb);
+  state.uploads++;
+};
+
+const showNextCrop = () => {
+  if ($('#crop-dialog') || !state.cropQueue.length) return;
+  const file = state.cropQueue.shift();
+  const dialog = el(`<div class="dialog" id="crop-dialog" role="dialog"><p>Crop ${escapeHtml(file.name)}</p><button>Crop and Save</button></div>`);
+  dialog.querySelector('button').addEventListener('click', () => {
+    dialog.remove();
+    setTimeout(() => { addThumbnail(file); showNextCrop(); }, CONFIG.upload_latency_ms);
+  });
+  document.body.appendChild(dialog);
+};
+
+$('#file-input').addEventListener('change', (e) => {
+  closePopovers();
+  state.cropQueue.push(...Array.from(e.target.files));
+  e.target.value = '';
+  showNextCrop();
+});
+
+const promptBox = $('#PINHOLE_TEXT_AREA_ELEMENT_ID');
+promptBox.addEventListener('dragover', (e) => e.preventDefault());
+promptBox.addEventListener('drop', (e) => {
+  if (!CONFIG.accept_drop) return;
+  e.preventDefault();
+  const files = Array.from(e.dataTransfer.files).filter((f) => f.type.startsWith('image/'));
+  setTimeout(() => files.forEach(addThumbnail), CONFIG.upload_latency_ms);
+});
+
+// --- Toasts ----------------------------------------------------------------
+const showToast = (message, isError) => {
+  const toast = el(`<li data-sonner-toast data-visible="true">${isError ? '<i>error</i>' : ''}<div data-content><div data-title>${escapeHtml(message)}</div></div></li>`);
+  $('#toaster').appendChild(toast);
+  setTimeout(() => { toast.setAttribute('data-visible', 'false'); setTimeout(() => toast.remove(), 300); }, 4000);
+};
+
+// --- Gallery ---------------------------------------------------------------
+const cardFor = (item) => {
+  const card = el(`<div class="card" data-media-id="${item.id}">
+    <img alt="${escapeHtml(item.alt)}" src="${item.src}">
+    <div class="actions"><button class="download-btn"><i>download</i>Download</button></div>
+  </div>`);
+  card.querySelector('.download-btn').addEventListener('click', () => {
+    closePopovers();
+    setTimeout(() => {
+      const menu = el(`<div class="popover" role="menu" id="download-menu"></div>`);
+      for (const scale of ['1K', '2K', '4K']) {
+        const option = el(`<a role="menuitem" href="/media/${item.id}/download?scale=${scale}" download>Download ${scale}</a>`);
+        option.addEventListener('click', () => setTimeout(closePopovers, 0));
+        menu.appendChild(option);
+      }
+      document.body.appendChild(menu);
+    }, CONFIG.ui_delay_ms);
+  });
+  return card;
+};
+
+fetch('/api/gallery').then((r) => r.json()).then((items) => {
+  const gallery = $('#gallery');
+  items.forEach((item) => gallery.appendChild(cardFor(item)));
+});
+
+$('#create-btn').addEventListener('click', async () => {
+  const prompt = promptBox.value.trim();
+  state.busy = true;
+  updateCreate();
+  try {
+    const resp = await fetch('/api/generate', {
+      method: 'POST',
+      headers: {'Content-Type': 'application/json'},
+      body: JSON.stringify({prompt, aspect: state.aspect, images: state.uploads}),
+    });
+    const result = await resp.json();
+    if (result.error === 'toast') {
+      showToast(result.message, true);
+    } else if (result.error === 'inline') {
+      $('#gallery').prepend(el('<div class="card"><div>Something went wrong.</div></div>'));
+    } else {
+      for (const [i, item] of result.images.entries()) {
+        setTimeout(() => $('#gallery').prepend(cardFor(item)), i * CONFIG.second_image_delay_ms);
+      }
+    }
+  } finally {
+    state.busy = false;
+    updateCreate();
+  }
+});
+</script>
+</body>
+</html>
+"""
+
+
+def render_png(width: int, height: int, seed: str) -> bytes:
+    """A solid-colour PNG whose colour is derived from `seed`."""
+    rng = random.Random(seed)
+    color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def dimensions(aspect: str, long_edge: int) -> tuple[int, int]:
+    short_edge = long_edge * 9 // 16
+    return (short_edge, long_edge) if aspect == "portrait" else (long_edge, short_edge)
+
+
+class FlowStandIn:
+    """Threaded HTTP server hosting the stand-in page, its API and image assets."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency_s: float = 3.0,
+                 latency_jitter_s: float = 0.5, error_rate: float = 0.0, inline_error_rate: float = 0.0,
+                 gallery_size: int = 0, images_per_generation: int = 2, multiple_files: bool = True,
+                 accept_drop: bool = True, ui_delay_ms: int = 50, upload_latency_ms: int = 200,
+                 second_image_delay_ms: int = 300, asset_latency_s: float = 0.0, seed: int = None):
+        self.host = host
+        self.port = port
+        self.asset_latency_s = asset_latency_s
+        # A second name for this server, so the analytics assets look third-party to the page
+        self.third_party_host = "localhost" if host == "127.0.0.1" else host
+        self.latency_s = latency_s
+        self.latency_jitter_s = latency_jitter_s
+        self.error_rate = error_rate
+        self.inline_error_rate = inline_error_rate
+        self.images_per_generation = images_per_generation
+        self.page_config = {
+            "multiple_files": multiple_files,
+            "accept_drop": accept_drop,
+            "ui_delay_ms": ui_delay_ms,
+            "upload_latency_ms": upload_latency_ms,
+            "second_image_delay_ms": second_image_delay_ms,
+        }
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        # Newest first, like the real gallery
+        self.gallery: list[dict] = []
+        self.media: dict[str, dict] = {}
+        self.stats = {"generations": 0, "toast_errors": 0, "inline_errors": 0, "downloads": 0}
+        for i in range(gallery_size):
+            self._add_media(f"seed prompt {i}", "landscape")
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def third_party_url(self) -> str:
+        return f"http://{self.third_party_host}:{self.port}"
+
+    def head_extra(self) -> str:
+        if self.asset_latency_s <= 0:
+            return ""
+        return (f'<link rel="stylesheet" href="/static/fonts.css">\n'
+                f'<script async src="{self.third_party_url}/static/analytics.js"></script>')
+
+    @property
+    def target_url(self) -> str:
+        return self.base_url + PROJECT_PATH
+
+    def _add_media(self, prompt: str, aspect: str) -> dict:
+        media_id = uuid.uuid4().hex[:12]
+        item = {
+            "id": media_id,
+            "alt": f"Flow Image: {prompt}",
+            "src": f"/media/{media_id}.png",
+            "aspect": aspect,
+        }
+        with self._lock:
+            self.media[media_id] = item
+            self.gallery.insert(0, item)
+        return item
+
+    def generate(self, prompt: str, aspect: str) -> dict:
+        """Blocking: simulates one generation and returns the API response body."""
+        time.sleep(max(0.0, self.latency_s + self.random.uniform(-self.latency_jitter_s, self.latency_jitter_s)))
+        with self._lock:
+            self.stats["generations"] += 1
+            roll = self.random.random()
+        if roll < self.error_rate:
+            with self._lock:
+                self.stats["toast_errors"] += 1
+            return {"error": "toast", "message": self.random.choice(TOAST_ERRORS)}
+        if roll < self.error_rate + self.inline_error_rate:
+            with self._lock:
+                self.stats["inline_errors"] += 1
+            return {"error": "inline"}
+        items = [self._add_media(prompt, aspect) for _ in range(self.images_per_generation)]
+        return {"images": [{k: item[k] for k in ("id", "alt", "src")} for item in items]}
+
+    def start(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                logger.debug("standin: " + format % args)
+
+            def _send(self, status: int, body: bytes, content_type: str, headers: dict = None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, payload):
+                self._send(200, json.dumps(payload).encode(), "application/json")
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path
+                if path == "/" or path.startswith("/fx/"):
+                    html = PAGE_HTML.replace("__CONFIG__", json.dumps(standin.page_config))
+                    html = html.replace("__HEAD_EXTRA__", standin.head_extra())
+                    self._send(200, html.encode(), "text/html; charset=utf-8")
+                elif path == "/static/fonts.css":
+                    css = ("@font-face { font-family: 'StandinSans'; src: url('/static/font.woff2') format('woff2'); }\n"
+                           "body { font-family: 'StandinSans', sans-serif; }")
+                    self._send(200, css.encode(), "text/css")
+                elif path == "/static/font.woff2":
+                    time.sleep(standin.asset_latency_s)
+                    self._send(200, b"\0" * 64 * 1024, "font/woff2")
+                elif path == "/static/analytics.js":
+                    time.sleep(standin.asset_latency_s)
+                    js = ("(() => { let n = 0; const t = setInterval(() => {"
+                          f" navigator.sendBeacon('{standin.third_party_url}/collect?n=' + n);"
+                          " if (++n >= 12) clearInterval(t); }, 250); })();")
+                    self._send(200, js.encode(), "application/javascript")
+                elif path == "/api/gallery":
+                    with standin._lock:
+                        items = [{k: item[k] for k in ("id", "alt", "src")} for item in standin.gallery]
+                    self._send_json(items)
+                elif path.startswith("/media/") and path.endswith(".png"):
+                    item = standin.media.get(path[len("/media/"):-len(".png")])
+                    if not item:
+                        self._send(404, b"not found", "text/plain")
+                        return
+                    width, height = dimensions(item["aspect"], PREVIEW_EDGE)
+                    self._send(200, render_png(width, height, item["id"]), "image/png",
+                               {"Cache-Control": "max-age=3600"})
+                elif path.startswith("/media/") and path.endswith("/download"):
+                    item = standin.media.get(path.split("/")[2])
+                    scale = parse_qs(url.query).get("scale", ["1K"])[0]
+                    if not item or scale not in SCALE_EDGES:
+                        self._send(404, b"not found", "text/plain")
+                        return
+                    with standin._lock:
+                        standin.stats["downloads"] += 1
+                    width, height = dimensions(item["aspect"], SCALE_EDGES[scale])
+                    self._send(200, render_png(width, height, item["id"]), "image/png",
+                               {"Content-Disposition": f'attachment; filename="{item["id"]}_{scale}.png"'})
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if urlparse(self.path).path == "/collect":
+                    time.sleep(0.1)
+                    self._send(204, b"", "text/plain")
+                elif urlparse(self.path).path == "/api/generate":
+                    body = json.loads(raw or b"{}")
+                    self._send_json(standin.generate(body.get("prompt", ""), body.get("aspect", "landscape")))
+                else:
+                    self._send(404, b"not found", "text/plain")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="flow-standin", daemon=True)
+        self._thread.start()
+        logger.info(f"Flow stand-in serving {self.target_url}")
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Stand-in options, shared with the benchmark scripts."""
+    parser.add_argument("--latency", type=float, default=3.0, help="generation latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.5, help="+/- random latency jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="probability of an error toast")
+    parser.add_argument("--inline-error-rate", type=float, default=0.0, help="probability of an inline error")
+    parser.add_argument("--gallery-size", type=int, default=0, help="images already in the gallery")
+    parser.add_argument("--single-file-chooser", action="store_true", help="file chooser accepts one file only")
+    parser.add_argument("--no-drop", action="store_true", help="ignore files dropped on the prompt")
+    parser.add_argument("--asset-latency", type=float, default=0.0,
+                        help="serve a slow web font and analytics script (seconds per asset)")
+
+
+def from_arguments(args, host: str = "127.0.0.1", port: int = 0) -> FlowStandIn:
+    return FlowStandIn(
+        host=host, port=port, latency_s=args.latency, latency_jitter_s=args.jitter,
+        error_rate=args.error_rate, inline_error_rate=args.inline_error_rate,
+        gallery_size=args.gallery_size, multiple_files=not args.single_file_chooser,
+        accept_drop=not args.no_drop, asset_latency_s=args.asset_latency,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Offline stand-in for the Flow project page")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, args.host, args.port).start()
+    print(f"Stand-in running at {server.target_url} - Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
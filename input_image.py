@@ -0,0 +1,116 @@
+import io
+import logging
+import uuid
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+EXIF_ORIENTATION = 0x0112
+# EXIF orientations that rotate the image by 90 or 270 degrees
+_ROTATED = {5, 6, 7, 8}
+
+
+def read_header(data: bytes) -> tuple[int, int, int]:
+    """(width, height, EXIF orientation) of an encoded image, with width and height as
+    displayed. Only the header is parsed (Image.open is lazy and the EXIF block is read
+    from its raw bytes), so no pixels are decoded however large the image is."""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        orientation = 1
+        raw = img.info.get("exif")
+        if raw:
+            exif = Image.Exif()
+            try:
+                exif.load(raw)
+                orientation = int(exif.get(EXIF_ORIENTATION, 1))
+            except Exception as e:
+                logger.debug(f"Unreadable EXIF block, assuming no rotation: {e}")
+    # Many phone cameras store images in landscape with EXIF rotation
+    if orientation in _ROTATED:
+        width, height = height, width
+    return width, height, orientation
+
+
+class InputImage:
+    """One reference image, held in memory from the Telegram download to the browser upload.
+
+    Ownership: whoever creates an InputImage (the handler that downloaded it) owns it and
+    must close() it once the request is finished; everything downstream only borrows it.
+    Closing drops the bytes, and using a closed image raises ValueError.
+
+    `metadata` holds what has been decoded about the image ("width", "height" as displayed
+    and the EXIF "orientation" tag). FileCache hands out images that share the dict of their
+    cache entry, so a file is only decoded once however often it is referenced.
+
+        image = await InputImage.from_telegram(file_obj, "image/jpeg")
+        try:
+            await browser_client.generate_image(prompt, [image])
+        finally:
+            image.close()
+    """
+
+    def __init__(self, data: bytes, mime_type: str = "image/jpeg", name: str = None, metadata: dict = None):
+        self._data = data
+        self.mime_type = mime_type or "image/jpeg"
+        self.name = name or f"{uuid.uuid4()}.{EXTENSIONS.get(self.mime_type, 'jpg')}"
+        self.metadata = metadata if metadata is not None else {}
+        # Size of the original this image was preprocessed from (preprocess.py), if any
+        self.source_nbytes: int = None
+
+    @classmethod
+    async def from_telegram(cls, file_obj, mime_type: str = "image/jpeg", name: str = None) -> "InputImage":
+        """Downloads a telegram.File into memory."""
+        buf = io.BytesIO()
+        await file_obj.download_to_memory(buf)
+        return cls(buf.getvalue(), mime_type, name)
+
+    @property
+    def data(self) -> bytes:
+        if self._data is None:
+            raise ValueError(f"InputImage {self.name} is closed")
+        return self._data
+
+    @property
+    def closed(self) -> bool:
+        return self._data is None
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) if self._data is not None else 0
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """(width, height) as displayed, i.e. after applying the EXIF orientation."""
+        if "width" not in self.metadata:
+            width, height, orientation = read_header(self.data)
+            self.metadata.update(width=width, height=height, orientation=orientation)
+        return self.metadata["width"], self.metadata["height"]
+
+    @property
+    def orientation(self) -> str:
+        width, height = self.size
+        return "portrait" if height > width else "landscape"
+
+    def as_file_payload(self) -> dict:
+        """Payload for Playwright's FileChooser.set_files / set_input_files."""
+        return {"name": self.name, "mimeType": self.mime_type, "buffer": self.data}
+
+    def close(self):
+        self._data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        state = "closed" if self.closed else f"{self.nbytes} bytes"
+        return f"<InputImage {self.name} {self.mime_type} {state}>"
+
+
+def close_images(images):
+    """Closes every image in `images` (None and already-closed images are fine)."""
+    for image in images or []:
+        image.close()
@@ -0,0 +1,333 @@
+"""End-to-end load test of bot.py against the fake Bot API (fake_telegram.py).
+
+Runs the real Application and handlers, with updates coming from simulated users and the
+browser replaced either by a stub (default: sleeps, then returns PNGs) or by the real
+client driving the Flow stand-in (--browser standin, needs Chromium; --profiles N runs
+N browser profiles).
+
+Each virtual user has a private chat and runs a closed loop: pick a scenario, wait for the
+bot's final answer, think, repeat. Latency is measured from pushing the update to the
+final bot call in that chat (the last photo, the upscaled document, or an error message),
+and reported per handler.
+
+    python loadtest_bot.py --users 20 --rounds 5 --tabs 3 --latency 2
+    python loadtest_bot.py --mix img=1,photo=1,album=1,album_reply=1,document=1,upscale=2 --sequential-updates
+"""
+import argparse
+import asyncio
+import io
+import logging
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image
+
+import config
+import flow_standin
+import metrics
+from bench_client import percentile
+from browser_client import GeneratedImage, UpscaledFile, WebsiteError
+from fake_telegram import FakeTelegram
+from scheduler import JobScheduler
+from state_db import StateDB
+
+logger = logging.getLogger("loadtest")
+
+# Scenario -> the bot.py handler it exercises
+HANDLERS = {
+    "img": "img_command",
+    "photo": "handle_photo",
+    "album": "handle_photo (album)",
+    "album_reply": "handle_text_reply",
+    "document": "handle_document",
+    "upscale": "upscale_callback",
+}
+DEFAULT_MIX = "img=2,photo=2,album=1,album_reply=1,document=1,upscale=2"
+# Bot messages that are progress updates rather than answers
+STATUS_PREFIXES = ("⏳", "Generating image", "Upscaling image")
+
+
+class StubBrowserClient:
+    """Stands in for NanoBananaClient: sleeps for the generation latency and returns PNGs."""
+
+    def __init__(self, pool_size: int, latency_s: float, jitter_s: float, images_per_job: int = 2,
+                 error_rate: float = 0.0, upscale_latency_s: float = 1.0, seed: int = None):
+        self.pool_size = pool_size
+        self.latency_s = latency_s
+        self.jitter_s = jitter_s
+        self.images_per_job = images_per_job
+        self.error_rate = error_rate
+        self.upscale_latency_s = upscale_latency_s
+        self.random = random.Random(seed)
+        self._previews = [flow_standin.render_png(512, 288, str(i)) for i in range(images_per_job)]
+        self._upscales = {scale: flow_standin.render_png(edge // 4, edge * 9 // 64, scale)
+                          for scale, edge in flow_standin.SCALE_EDGES.items()}
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def _delay(self, seconds: float):
+        await asyncio.sleep(max(0.0, seconds + self.random.uniform(-self.jitter_s, self.jitter_s)))
+
+    async def generate_image(self, prompt, images=None, aspect_ratio=None):
+        await self._delay(self.latency_s)
+        if self.random.random() < self.error_rate:
+            raise WebsiteError("Stub generation failed")
+        return [GeneratedImage(data, f"/media/stub-{i}.png") for i, data in enumerate(self._previews)]
+
+    async def upscale_image(self, prompt, idx, scale, result_id=None):
+        await self._delay(self.upscale_latency_s)
+        # Like the real client: a file on disk, streamed into the upload and deleted on close
+        fd, path = tempfile.mkstemp(prefix="upscale-", suffix=".png")
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._upscales.get(scale, self._upscales["1K"]))
+        return UpscaledFile(path)
+
+
+class Pending:
+    """The answer a virtual user is waiting for in its chat."""
+
+    def __init__(self, expected_photos: int):
+        self.expected_photos = expected_photos
+        self.photos: list[dict] = []
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Results:
+    def __init__(self):
+        self.durations: dict[str, list] = {}
+        self.errors: dict[str, int] = {}
+        self.timeouts: dict[str, int] = {}
+
+    def add(self, handler: str, seconds: float):
+        self.durations.setdefault(handler, []).append(seconds)
+
+    def error(self, handler: str):
+        self.errors[handler] = self.errors.get(handler, 0) + 1
+
+    def timeout(self, handler: str):
+        self.timeouts[handler] = self.timeouts.get(handler, 0) + 1
+
+    def report(self, wall_seconds: float) -> str:
+        lines = [f"{'handler':<22} {'ok':>5} {'err':>5} {'t/o':>5} {'p50':>8} {'p95':>8} {'max':>8} {'req/s':>7}"]
+        for handler in sorted(set(self.durations) | set(self.errors) | set(self.timeouts)):
+            values = self.durations.get(handler, [])
+            lines.append(
+                f"{handler:<22} {len(values):>5} {self.errors.get(handler, 0):>5} {self.timeouts.get(handler, 0):>5} "
+                f"{percentile(values, 50):>7.2f}s {percentile(values, 95):>7.2f}s "
+                f"{max(values, default=0):>7.2f}s {len(values) / wall_seconds if wall_seconds else 0:>7.2f}"
+            )
+        return "\n".join(lines)
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in HANDLERS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(HANDLERS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def input_jpegs() -> list:
+    images = []
+    for i, size in enumerate([(1200, 1600), (1600, 1200), (900, 1200)]):
+        buf = io.BytesIO()
+        Image.new("RGB", size, (i * 70, 120, 200)).save(buf, format="JPEG")
+        images.append(buf.getvalue())
+    return images
+
+
+class LoadTest:
+    def __init__(self, args, fake: FakeTelegram, images_per_job: int):
+        self.args = args
+        self.fake = fake
+        self.images_per_job = images_per_job
+        self.results = Results()
+        self.inputs = input_jpegs()
+        self.mix = parse_mix(args.mix)
+        self.random = random.Random(args.seed)
+        self.pending: dict[int, Pending] = {}
+        self.loop = asyncio.get_running_loop()
+        fake.add_listener(lambda call: self.loop.call_soon_threadsafe(self._on_bot_call, call))
+
+    def _on_bot_call(self, call: dict):
+        pending = self.pending.get(call["chat_id"])
+        if pending is None or pending.future.done():
+            return
+        method = call["method"]
+        if method == "sendPhoto":
+            pending.photos.append(call["result"])
+            if len(pending.photos) >= pending.expected_photos:
+                pending.future.set_result(True)
+        elif method == "sendDocument":
+            pending.future.set_result(True)
+        elif method == "sendMessage" and not call["params"].get("text", "").startswith(STATUS_PREFIXES):
+            logger.info(f"chat {call['chat_id']}: {call['params'].get('text')}")
+            pending.future.set_result(False)
+
+    async def _expect(self, chat_id: int, handler: str, push, expected_photos: int = None) -> list:
+        """Pushes the update(s) and waits for the bot's answer; returns the photo messages sent."""
+        pending = self.pending[chat_id] = Pending(expected_photos or self.images_per_job)
+        start = time.perf_counter()
+        await asyncio.to_thread(push)
+        try:
+            ok = await asyncio.wait_for(pending.future, self.args.timeout)
+        except asyncio.TimeoutError:
+            self.results.timeout(handler)
+            return pending.photos
+        finally:
+            del self.pending[chat_id]
+        if ok:
+            self.results.add(handler, time.perf_counter() - start)
+        else:
+            self.results.error(handler)
+        return pending.photos
+
+    async def virtual_user(self, user_id: int):
+        user = self.fake.user(user_id)
+        chat_id = user_id
+        last_album = None
+        bot_photos: list[dict] = []
+        scenarios, weights = zip(*self.mix.items())
+
+        for round_no in range(self.args.rounds):
+            scenario = self.random.choices(scenarios, weights)[0]
+            prompt = f"load test {user_id}-{round_no} {self.random.randrange(1 << 20):x}"
+            image = self.random.choice(self.inputs)
+
+            if scenario == "album_reply" and last_album is None:
+                scenario = "album"
+            if scenario == "upscale" and not bot_photos:
+                scenario = "img"
+
+            if scenario == "img":
+                photos = await self._expect(chat_id, HANDLERS[scenario],
+                                            lambda: self.fake.send_text(chat_id, user, f"/img {prompt}"))
+            elif scenario == "photo":
+                photos = await self._expect(chat_id, HANDLERS[scenario],
+                                            lambda: self.fake.send_photo(chat_id, user, image, caption=prompt))
+            elif scenario == "document":
+                photos = await self._expect(chat_id, HANDLERS[scenario], lambda: self.fake.send_document(
+                    chat_id, user, image, mime_type="image/jpeg", file_name="input.jpg", caption=prompt))
+            elif scenario == "album":
+                album_images = self.random.sample(self.inputs, k=min(self.args.album_size, len(self.inputs)))
+                album = []
+                photos = await self._expect(chat_id, HANDLERS[scenario], lambda: album.extend(
+                    self.fake.send_album(chat_id, user, album_images, caption=prompt, spacing_s=0.05)))
+                last_album = album[0] if album else None
+            elif scenario == "album_reply":
+                photos = await self._expect(chat_id, HANDLERS[scenario],
+                                            lambda: self.fake.send_text(chat_id, user, prompt, reply_to=last_album))
+            else:
+                message = self.random.choice(bot_photos)
+                buttons = [b for row in (message.get("reply_markup") or {}).get("inline_keyboard", []) for b in row]
+                data = self.random.choice(buttons)["callback_data"] if buttons else "up:missing:0:1K"
+                photos = await self._expect(chat_id, HANDLERS[scenario],
+                                            lambda: self.fake.press_button(user, message, data))
+
+            if photos:
+                bot_photos = photos
+            if self.args.think:
+                await asyncio.sleep(self.random.uniform(0, 2 * self.args.think))
+
+
+async def run(args):
+    import bot
+
+    fake = FakeTelegram(api_latency_s=args.api_latency).start()
+    standin = None
+    workdir = tempfile.TemporaryDirectory(prefix="nb_loadtest_")
+    if args.browser == "standin":
+        standin = flow_standin.from_arguments(args).start()
+        config.BROWSER_CHANNEL = args.channel
+        config.HEADLESS = not args.headed
+        config.MIN_LATENCY = args.min_latency
+        browser = bot.ShardedClient(
+            profiles=[os.path.join(workdir.name, f"profile{i}") for i in range(args.profiles)],
+            pool_size=args.tabs, target_url=standin.target_url,
+        )
+        images_per_job = standin.images_per_generation
+    else:
+        browser = StubBrowserClient(args.tabs, args.latency, args.jitter, args.images_per_job,
+                                    args.error_rate, args.upscale_latency, args.seed)
+        images_per_job = args.images_per_job
+
+    # Swap the bot's globals for the test instances before any handler runs
+    bot.browser_client = browser
+    bot.scheduler = JobScheduler(
+        concurrency=browser.pool_size, max_depth=args.queue_depth,
+        quota_burst=args.quota_burst, quota_per_minute=args.quota_per_minute,
+    )
+    bot.metrics_server = metrics.MetricsServer(config.METRICS_HOST, args.metrics_port) if args.metrics_port else None
+    bot.state_db = StateDB(os.path.join(workdir.name, "state.db"))
+
+    application = bot.build_application(fake.token, fake.api_url, fake.file_url,
+                                        concurrent_updates=False if args.sequential_updates else None)
+    try:
+        await application.initialize()
+        await bot.post_init(application)
+        await application.start()
+        await application.updater.start_polling(poll_interval=0.0, timeout=1)
+
+        test = LoadTest(args, fake, images_per_job)
+        start = time.perf_counter()
+        await asyncio.gather(*(test.virtual_user(1000 + i) for i in range(args.users)))
+        wall = time.perf_counter() - start
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+        fake.stop()
+        if standin:
+            standin.stop()
+        workdir.cleanup()
+
+    print()
+    print(f"Browser: {args.browser} tabs={args.tabs} latency={args.latency}s images/job={images_per_job}")
+    print(f"Load: users={args.users} rounds={args.rounds} think={args.think}s mix={args.mix} "
+          f"concurrent_updates={not args.sequential_updates}")
+    print(test.results.report(wall))
+    total = sum(len(v) for v in test.results.durations.values())
+    print(f"Wall time {wall:.2f}s, {total / wall:.2f} requests/s")
+    print("Bot API calls: " + ", ".join(f"{method}={count}" for method, count in sorted(fake.counts.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test bot.py against a fake Telegram Bot API")
+    flow_standin.add_arguments(parser)
+    parser.add_argument("--browser", choices=["stub", "standin"], default="stub")
+    parser.add_argument("--tabs", type=int, default=config.PAGE_POOL_SIZE)
+    parser.add_argument("--profiles", type=int, default=1, help="browser profiles (--browser standin)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3, help="scenarios per user")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="scenario weights, e.g. img=2,album=1,upscale=1")
+    parser.add_argument("--think", type=float, default=0.5, help="mean pause between a user's requests (s)")
+    parser.add_argument("--album-size", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0, help="give up on an answer after this long (s)")
+    parser.add_argument("--images-per-job", type=int, default=2, help="stub browser only")
+    parser.add_argument("--upscale-latency", type=float, default=1.0, help="stub browser only")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="delay added to every Bot API call (s)")
+    parser.add_argument("--queue-depth", type=int, default=config.QUEUE_MAX_DEPTH)
+    parser.add_argument("--quota-burst", type=float, default=0, help="per-user quota (0 = off)")
+    parser.add_argument("--quota-per-minute", type=float, default=config.USER_QUOTA_PER_MINUTE)
+    parser.add_argument("--sequential-updates", action="store_true",
+                        help="handle updates one at a time (the default is the bot's concurrent setting)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="serve /metrics during the run (0 = off)")
+    parser.add_argument("--channel", default="", help='standin browser channel ("" = bundled Chromium)')
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument("--min-latency", action="store_true")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, force=True)
+    asyncio.run(run(args))
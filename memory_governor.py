@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import time
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TAB_JS_HEAP_BYTES = metrics.Gauge(
+    "nanobanana_tab_js_heap_bytes", "Used JS heap per tab (CDP Performance.getMetrics).", ["shard", "tab"]
+)
+TAB_DOM_NODES = metrics.Gauge("nanobanana_tab_dom_nodes", "DOM nodes per tab (CDP Performance.getMetrics).", ["shard", "tab"])
+TAB_EVENT_LISTENERS = metrics.Gauge("nanobanana_tab_js_event_listeners", "JS event listeners per tab.", ["shard", "tab"])
+PROCESS_MEMORY_BYTES = metrics.Gauge(
+    "nanobanana_process_memory_bytes", "Resident memory (PSS where available) of the bot and of the browser processes.",
+    ["process"],
+)
+SHARD_MEMORY_BYTES = metrics.Gauge(
+    "nanobanana_shard_memory_bytes", "Memory (PSS where available) of each profile's browser process tree.", ["shard"]
+)
+SHARD_CPU_CORES = metrics.Gauge(
+    "nanobanana_shard_cpu_cores", "CPU used by each profile's browser process tree since the last sample, in cores.",
+    ["shard"],
+)
+TAB_RECYCLES = metrics.Counter(
+    "nanobanana_tab_recycles_total", "Tabs recycled by the memory governor, by reason and action.", ["reason", "action"]
+)
+
+
+def _read_proc_memory(pid: int) -> int | None:
+    """Proportional set size of a process in bytes (RSS if smaps_rollup isn't readable)."""
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return None
+
+
+def _stat_fields(pid: int) -> list[str]:
+    """/proc/<pid>/stat fields after the command name (field 3, the state, comes first)."""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        # The command name may contain spaces and parentheses; fields resume after the last ')'
+        return f.read().rsplit(")", 1)[1].split()
+
+
+def _process_tree() -> dict[int, list[int]]:
+    children: dict[int, list[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            ppid = int(_stat_fields(int(name))[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def _descendants(root_pid: int, children: dict[int, list[int]] = None) -> list[int]:
+    children = children if children is not None else _process_tree()
+    found, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def sample_process_memory() -> dict | None:
+    """{"bot": bytes, "browser": bytes} from /proc; the browser figure sums every process
+    started under this one (Playwright driver and Chromium). None where /proc isn't available."""
+    if not os.path.isdir("/proc"):
+        return None
+    own_pid = os.getpid()
+    browser = 0
+    for pid in _descendants(own_pid):
+        browser += _read_proc_memory(pid) or 0
+    return {"bot": _read_proc_memory(own_pid) or 0, "browser": browser}
+
+
+def _cpu_seconds(pid: int) -> float:
+    try:
+        fields = _stat_fields(pid)
+        # utime and stime (fields 14 and 15) in clock ticks
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def _cmdline(pid: int) -> list[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().decode("utf-8", "replace").split("\0")
+    except OSError:
+        return []
+
+
+def sample_profile_usage(user_data_dir: str) -> dict | None:
+    """{"memory": bytes, "cpu_s": seconds} summed over the browser launched on
+    `user_data_dir` (the process started with that --user-data-dir, under this one) and all
+    its children. None where /proc isn't available or that browser isn't running."""
+    if not os.path.isdir("/proc"):
+        return None
+    flags = {f"--user-data-dir={user_data_dir}", f"--user-data-dir={os.path.abspath(user_data_dir)}"}
+    children = _process_tree()
+    candidates = _descendants(os.getpid(), children)
+    roots = [pid for pid in candidates if flags.intersection(_cmdline(pid))]
+    if not roots:
+        return None
+    # Chromium passes the flag on to some children; count each process once
+    pids = set(roots)
+    for root in roots:
+        pids.update(_descendants(root, children))
+    return {
+        "memory": sum(_read_proc_memory(pid) or 0 for pid in pids),
+        "cpu_s": sum(_cpu_seconds(pid) for pid in pids),
+    }
+
+
+class MemoryGovernor:
+    """Keeps browser memory (and gallery-driven DOM growth) flat over long uptimes.
+
+    Every `interval_s` it samples each tab's JS heap, DOM node and listener counts over CDP
+    (Performance.getMetrics), the process memory of the bot and the browser, and the memory
+    and CPU of this client's own browser process tree (its shard), and publishes them as
+    metrics. A tab over the heap or DOM threshold is recycled while idle:
+    reloaded first, and closed and reopened if it's still over on the next check after a
+    reload. If the whole browser is over its memory budget, the heaviest idle tab is
+    reopened. At most one tab is recycled per check, so the pool never loses more than one
+    tab of capacity at a time. A threshold of 0 disables that check."""
+
+    def __init__(self, client, interval_s: float = None, max_heap_mb: float = None, max_dom_nodes: int = None,
+                 max_browser_mb: float = None):
+        self.client = client
+        self.interval_s = interval_s if interval_s is not None else config.MEMORY_CHECK_INTERVAL_S
+        max_heap_mb = max_heap_mb if max_heap_mb is not None else config.TAB_MAX_JS_HEAP_MB
+        self.max_heap_bytes = max_heap_mb * 1024 * 1024
+        self.max_dom_nodes = max_dom_nodes if max_dom_nodes is not None else config.TAB_MAX_DOM_NODES
+        max_browser_mb = max_browser_mb if max_browser_mb is not None else config.BROWSER_MAX_MEMORY_MB
+        self.max_browser_bytes = max_browser_mb * 1024 * 1024
+        self._task: asyncio.Task = None
+        # Tabs reloaded by the governor that haven't come back under the thresholds yet
+        self._reloaded: set[int] = set()
+        # (monotonic time, CPU seconds) of this profile's browser at the previous sample
+        self._last_cpu: tuple[float, float] = None
+
+    def start(self):
+        if self._task or self.interval_s <= 0:
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Memory governor started (every {self.interval_s:.0f}s)")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.warning(f"Memory governor check failed: {e}")
+
+    async def _tab_metrics(self, tab) -> dict:
+        if tab.cdp is None:
+            tab.cdp = await self.client.context.new_cdp_session(tab.page)
+            await tab.cdp.send("Performance.enable")
+        result = await tab.cdp.send("Performance.getMetrics")
+        return {m["name"]: m["value"] for m in result.get("metrics", [])}
+
+    async def sample(self) -> tuple[dict, dict | None]:
+        """Returns ({tab: {"heap": bytes, "nodes": count}}, process memory) and updates the
+        gauges. The process memory gets a "shard" entry for this client's own browser."""
+        shard = self.client.name
+        tabs = {}
+        for tab in list(self.client.pool.tabs):
+            try:
+                values = await self._tab_metrics(tab)
+            except Exception as e:
+                # Page closed or navigating; the session is re-created next time
+                logger.debug(f"[tab {tab.index}] Could not read performance metrics: {e}")
+                await tab.drop_cdp()
+                continue
+            heap, nodes = values.get("JSHeapUsedSize", 0), values.get("Nodes", 0)
+            tabs[tab] = {"heap": heap, "nodes": nodes}
+            TAB_JS_HEAP_BYTES.set(heap, shard=shard, tab=str(tab.index))
+            TAB_DOM_NODES.set(nodes, shard=shard, tab=str(tab.index))
+            TAB_EVENT_LISTENERS.set(values.get("JSEventListeners", 0), shard=shard, tab=str(tab.index))
+        process = await asyncio.to_thread(sample_process_memory)
+        if process:
+            for name, value in process.items():
+                PROCESS_MEMORY_BYTES.set(value, process=name)
+            usage = await asyncio.to_thread(sample_profile_usage, self.client.user_data_dir)
+            if usage:
+                process["shard"] = usage["memory"]
+                SHARD_MEMORY_BYTES.set(usage["memory"], shard=shard)
+                now = time.monotonic()
+                if self._last_cpu and now > self._last_cpu[0]:
+                    cores = max(0.0, usage["cpu_s"] - self._last_cpu[1]) / (now - self._last_cpu[0])
+                    SHARD_CPU_CORES.set(cores, shard=shard)
+                self._last_cpu = (now, usage["cpu_s"])
+        return tabs, process
+
+    def _over_limit(self, sample: dict) -> str | None:
+        if self.max_heap_bytes > 0 and sample["heap"] > self.max_heap_bytes:
+            return "js_heap"
+        if self.max_dom_nodes > 0 and sample["nodes"] > self.max_dom_nodes:
+            return "dom_nodes"
+        return None
+
+    async def check(self):
+        tabs, process = await self.sample()
+        candidates = []
+        for tab, sample in tabs.items():
+            reason = self._over_limit(sample)
+            if reason is None:
+                self._reloaded.discard(tab.index)
+                continue
+            candidates.append((sample["heap"], tab, reason))
+        # With several profiles each governor only answers for its own browser
+        browser_bytes = process.get("shard", process["browser"]) if process else 0
+        if not candidates and self.max_browser_bytes > 0 and browser_bytes > self.max_browser_bytes:
+            candidates = [(sample["heap"], tab, "browser_memory") for tab, sample in tabs.items()]
+
+        # Heaviest first; busy tabs are skipped and get another chance on the next check
+        for _, tab, reason in sorted(candidates, key=lambda c: c[0], reverse=True):
+            reopen = reason == "browser_memory" or tab.index in self._reloaded
+            if await self.client.recycle_tab(tab, reopen=reopen, reason=reason):
+                TAB_RECYCLES.inc(reason=reason, action="reopen" if reopen else "reload")
+                if reopen:
+                    self._reloaded.discard(tab.index)
+                else:
+                    self._reloaded.add(tab.index)
+                return
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets (seconds) covering a fast DOM step up to a slow generation
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: dict = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down. Pass `func` to read it at scrape time instead of setting it."""
+    kind = "gauge"
+
+    def __init__(self, *args, func=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._func = func
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._func is not None:
+            return self._func()
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        if self._func is not None:
+            try:
+                return [f"{self.name} {_format_value(self._func())}"]
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+                return []
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # key -> [bucket counts..., sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def _samples(self):
+        lines = []
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in items:
+            for bound, bucket_count in zip(self.buckets, state):
+                labels = _format_labels(self.labelnames, key, {"le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Shared metrics. Stages are labelled by operation ("bot", "generate", "upscale")
+# and stage name, so one histogram covers the whole request path.
+STAGE_SECONDS = Histogram(
+    "nanobanana_stage_seconds", "Duration of each stage of the request path.", ["operation", "stage"]
+)
+JOBS_TOTAL = Counter(
+    "nanobanana_jobs_total", "Finished jobs by kind and outcome.", ["kind", "outcome"]
+)
+WEBSITE_ERRORS_TOTAL = Counter(
+    "nanobanana_website_errors_total", "WebsiteError occurrences by message.", ["kind", "message"]
+)
+UPSCALE_SECONDS = Histogram(
+    "nanobanana_upscale_seconds", "End-to-end upscale duration by scale.", ["scale"]
+)
+
+
+def observe_stage(operation: str, stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, operation=operation, stage=stage)
+
+
+@contextmanager
+def time_stage(operation: str, stage: str):
+    """Observes the duration of the with-block as one stage (errors included)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(operation, stage, time.perf_counter() - start)
+
+
+def record_website_error(kind: str, message: str):
+    # Website messages are free text; cap them so a strange toast can't explode cardinality
+    WEBSITE_ERRORS_TOTAL.inc(kind=kind, message=(message or "unknown")[:80])
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing REGISTRY in Prometheus text format at /metrics."""
+
+    def __init__(self, host: str, port: int, registry: Registry = None):
+        self.host = host
+        self.port = port
+        self.registry = registry or REGISTRY
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"Metrics endpoint listening on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Drain headers
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 else ""
+            if path == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status, body, content_type = "404 Not Found", b"Not found\n", "text/plain"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
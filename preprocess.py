@@ -0,0 +1,212 @@
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import config
+import metrics
+from input_image import InputImage, read_header
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_IMAGES = metrics.Counter(
+    "nanobanana_preprocess_images_total",
+    "Input images by preprocessing outcome (cropped, resized, rotated, reencoded, kept, failed; the first that "
+    "applies).", ["outcome"],
+)
+PREPROCESS_BYTES = metrics.Counter(
+    "nanobanana_preprocess_bytes_total", "Input image bytes before (in) and after (out) preprocessing.", ["stage"]
+)
+# Output shape per aspect ratio, as offered by Flow's settings
+CROP_RATIOS = {"landscape": 16 / 9, "portrait": 9 / 16}
+# Images within this relative difference of the target ratio aren't cropped
+_CROP_TOLERANCE = 0.01
+# Quality steps tried (from the configured quality down) while the output is over the byte budget
+_MIN_QUALITY = 60
+_QUALITY_STEP = 8
+_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp"), "png": ("PNG", "image/png")}
+
+
+def _needs_crop(width: int, height: int, ratio: float = None) -> bool:
+    return ratio is not None and abs(width / height - ratio) > ratio * _CROP_TOLERANCE
+
+
+def _crop_size(width: int, height: int, ratio: float) -> tuple[int, int]:
+    if width / height > ratio:
+        return round(height * ratio), height
+    return width, round(width / ratio)
+
+
+def _center_crop(img: Image.Image, ratio: float) -> Image.Image:
+    width, height = img.size
+    new_width, new_height = _crop_size(width, height, ratio)
+    left, top = (width - new_width) // 2, (height - new_height) // 2
+    return img.crop((left, top, left + new_width, top + new_height))
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        # optimize=True is several times slower for a few percent
+        img.save(buf, fmt, compress_level=6)
+    elif fmt == "WEBP":
+        img.save(buf, fmt, quality=quality, method=4)
+    else:
+        img.save(buf, fmt, quality=quality, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def preprocess_bytes(data: bytes, max_edge: int, fmt: str, quality: int, max_bytes: int,
+                     crop_ratio: float = None) -> tuple[bytes, str, int, int, str] | None:
+    """Process-pool worker: returns (data, mime_type, width, height, outcome) of the prepared
+    image, or None when the original is already within budget and should be uploaded as is.
+
+    The EXIF orientation is applied to the pixels (the output carries no EXIF), the
+    longest edge is capped at `max_edge`, and the image is re-encoded, stepping the quality
+    down and then the edge while it's over `max_bytes`. Images with transparency are
+    written as PNG whatever `fmt` says. `outcome` is the first of "cropped", "resized",
+    "rotated" that was done, else "reencoded"."""
+    width, height, orientation = read_header(data)
+    crop = _needs_crop(width, height, crop_ratio)
+    if not crop and orientation == 1 and max(width, height) <= max_edge and len(data) <= max_bytes:
+        return None
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEGs can decode straight at a reduced scale (the draft size is in stored orientation)
+        scale = max_edge / max(width, height)
+        if img.format == "JPEG" and scale < 1:
+            stored = (width, height) if orientation < 5 else (height, width)
+            img.draft("RGB", (int(stored[0] * scale), int(stored[1] * scale)))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha else "RGB")
+    if crop:
+        img = _center_crop(img, crop_ratio)
+    # Full-resolution edge after the crop (a JPEG draft may already have decoded it smaller)
+    full_edge = max(_crop_size(width, height, crop_ratio) if crop else (width, height))
+    if has_alpha:
+        fmt = "PNG"
+    mime_type = next(mime for name, mime in _FORMATS.values() if name == fmt)
+
+    edge = max_edge
+    while True:
+        if max(img.size) > edge:
+            img.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        for q in range(quality, _MIN_QUALITY - 1, -_QUALITY_STEP):
+            out = _encode(img, fmt, q)
+            if len(out) <= max_bytes or fmt == "PNG":
+                break
+        if len(out) <= max_bytes or edge <= 512:
+            break
+        # Encoded size goes roughly with the pixel count
+        edge = int(max(img.size) * min(0.9, max(0.5, math.sqrt(max_bytes / len(out)) * 0.95)))
+    resized = max(img.size) < full_edge - 1
+    if not (crop or resized or orientation != 1) and len(out) >= len(data):
+        return None
+    outcome = "cropped" if crop else "resized" if resized else "rotated" if orientation != 1 else "reencoded"
+    return out, mime_type, img.size[0], img.size[1], outcome
+
+
+class ImagePreprocessor:
+    """Prepares input images for upload on a process pool, so large originals don't slow
+    the file chooser upload and Flow's own processing.
+
+    Each image whose longest edge is over `max_edge`, whose size is over `max_bytes` or
+    that carries an EXIF rotation is decoded, resized and re-encoded (`fmt`, `quality`);
+    with `crop`, images not already at the requested aspect ratio are also center-cropped
+    to it, which leaves Flow's "Crop and Save" nothing to do. Everything else skips the pool
+    and is uploaded byte for byte. The images of an album are processed concurrently.
+    Anything that fails keeps its original.
+    The pool starts with the first image that needs work and uses the forkserver method,
+    so workers don't inherit the bot's threads or import the bot."""
+
+    def __init__(self, enabled: bool = None, max_edge: int = None, fmt: str = None, quality: int = None,
+                 max_kb: float = None, crop: bool = None, workers: int = None):
+        self.enabled = enabled if enabled is not None else config.PREPROCESS_IMAGES
+        self.max_edge = max_edge or config.PREPROCESS_MAX_EDGE
+        fmt = (fmt or config.PREPROCESS_FORMAT).lower()
+        self.fmt = _FORMATS.get(fmt, _FORMATS["jpeg"])[0]
+        self.quality = quality or config.PREPROCESS_QUALITY
+        self.max_bytes = int((max_kb or config.PREPROCESS_MAX_KB) * 1024)
+        self.crop = crop if crop is not None else config.PREPROCESS_CROP
+        self.workers = workers or config.PREPROCESS_WORKERS or min(4, os.cpu_count() or 1)
+        self._executor: ProcessPoolExecutor = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("forkserver")
+                # Without this the fork server imports __main__ (the whole bot); workers only need us
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def _prepare(self, image: InputImage, crop_ratio: float = None) -> InputImage:
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._pool(), preprocess_bytes, image.data, self.max_edge, self.fmt, self.quality, self.max_bytes,
+                crop_ratio,
+            )
+        except Exception as e:
+            logger.warning(f"Could not preprocess {image.name}, uploading the original: {e}")
+            PREPROCESS_IMAGES.inc(outcome="failed")
+            return image
+        if result is None:
+            return await self._keep(image)
+        data, mime_type, width, height, outcome = result
+        PREPROCESS_BYTES.inc(image.nbytes, stage="in")
+        PREPROCESS_IMAGES.inc(outcome=outcome)
+        PREPROCESS_BYTES.inc(len(data), stage="out")
+        name = f"{os.path.splitext(image.name)[0]}.{mime_type.split('/')[1].replace('jpeg', 'jpg')}"
+        prepared = InputImage(data, mime_type, name, metadata={"width": width, "height": height, "orientation": 1})
+        prepared.source_nbytes = image.nbytes
+        logger.info(f"Preprocessed {image.name}: {image.nbytes / 1e6:.1f} MB -> {len(data) / 1e6:.2f} MB "
+                    f"({width}x{height})")
+        return prepared
+
+    def _needs_work(self, image: InputImage, crop_ratio: float = None) -> bool:
+        """Whether the image has to go to the pool: over the edge or byte budget, EXIF-rotated,
+        or not yet at the requested aspect ratio."""
+        try:
+            width, height = image.size
+            return (max(width, height) > self.max_edge or image.nbytes > self.max_bytes
+                    or image.metadata.get("orientation", 1) != 1 or _needs_crop(width, height, crop_ratio))
+        except Exception:
+            # Not an image Pillow can read; the browser gets it as is
+            return False
+
+    async def _keep(self, image: InputImage) -> InputImage:
+        PREPROCESS_IMAGES.inc(outcome="kept")
+        PREPROCESS_BYTES.inc(image.nbytes, stage="in")
+        PREPROCESS_BYTES.inc(image.nbytes, stage="out")
+        return image
+
+    async def prepare(self, images: list, aspect_ratio: str = None) -> list:
+        """Returns the images to upload, in order: originals where nothing needed doing, new
+        InputImages (owned by the caller, see release()) elsewhere."""
+        if not self.enabled or not images:
+            return images
+        crop_ratio = CROP_RATIOS.get(aspect_ratio) if self.crop else None
+        jobs = [
+            self._prepare(image, crop_ratio) if self._needs_work(image, crop_ratio) else self._keep(image)
+            for image in images
+        ]
+        with metrics.time_stage("bot", "preprocess"):
+            return list(await asyncio.gather(*jobs))
+
+    @staticmethod
+    def release(prepared: list, originals: list):
+        """Closes the images prepare() created (the originals stay with their owner)."""
+        for image in prepared or []:
+            if not any(image is original for original in originals or []):
+                image.close()
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,72 @@
+import logging
+from urllib.parse import urlsplit
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_REQUESTS = metrics.Counter(
+    "nanobanana_blocked_requests_total", "Browser requests aborted by the request policy, by matching rule.", ["rule"]
+)
+
+
+def _parse_list(value: str) -> set[str]:
+    return {item.strip().lower() for item in (value or "").split(",") if item.strip()}
+
+
+def _host_rule(host: str, rules: set[str]) -> str | None:
+    """The rule matching `host` itself or one of its parent domains, if any."""
+    parts = host.split(".")
+    for i in range(len(parts)):
+        candidate = ".".join(parts[i:])
+        if candidate in rules:
+            return candidate
+    return None
+
+
+class RequestPolicy:
+    """Allow/deny policy for the browser's requests, installed with context.route.
+
+    A request is aborted if its resource type (Playwright's request.resource_type: font,
+    media, ping, ...) or its host (or a parent domain) is denied, unless the host is on
+    the allow list. Documents are never blocked. Blocking fonts, media and analytics
+    beacons keeps them from delaying page loads; note that any route disables Chromium's
+    HTTP cache for the context, so it's a trade worth benchmarking (bench_client.py)."""
+
+    def __init__(self, block_types: str = None, block_hosts: str = None, allow_hosts: str = None):
+        self.block_types = _parse_list(block_types if block_types is not None else config.BLOCK_RESOURCE_TYPES)
+        self.block_hosts = _parse_list(block_hosts if block_hosts is not None else config.BLOCK_HOSTS)
+        self.allow_hosts = _parse_list(allow_hosts if allow_hosts is not None else config.ALLOW_HOSTS)
+        self.block_types.discard("document")
+
+    def block_rule(self, resource_type: str, url: str) -> str | None:
+        """The rule that blocks this request ("type:font", "host:example.com"), or None."""
+        if resource_type == "document":
+            return None
+        host = (urlsplit(url).hostname or "").lower()
+        if host and _host_rule(host, self.allow_hosts):
+            return None
+        if resource_type in self.block_types:
+            return f"type:{resource_type}"
+        rule = _host_rule(host, self.block_hosts) if host else None
+        return f"host:{rule}" if rule else None
+
+    async def handle(self, route):
+        """context.route handler."""
+        request = route.request
+        try:
+            rule = self.block_rule(request.resource_type, request.url)
+            if rule:
+                BLOCKED_REQUESTS.inc(rule=rule)
+                await route.abort("blockedbyclient")
+            else:
+                await route.fallback()
+        except Exception as e:
+            # The page or context went away mid-request
+            logger.debug(f"Request policy could not handle {request.url[:60]}: {e}")
+
+    async def install(self, context):
+        if not self.block_types and not self.block_hosts:
+            return
+        await context.route("**/*", self.handle)
+        logger.info(f"Request policy: blocking types {sorted(self.block_types)} and hosts {sorted(self.block_hosts)}")
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_REQUESTS = metrics.Counter(
+    "nanobanana_result_cache_requests_total",
+    "Generation requests by how the result cache answered (hit, coalesced, coalesced_error, miss, bypass).",
+    ["outcome"],
+)
+RESULT_CACHE_EVICTIONS = metrics.Counter(
+    "nanobanana_result_cache_evictions_total", "Cached results dropped, by reason (ttl or capacity).", ["reason"]
+)
+_FRESH = re.compile(r"(?:(?<=\s)|^)/fresh\b", re.IGNORECASE)
+
+
+def parse_fresh_command(prompt: str) -> tuple[str, bool]:
+    """Strips /fresh (which bypasses the result cache) from anywhere in the prompt, like
+    /portrait and /landscape, but only as a word of its own (not in a/fresh or a URL).
+    Returns (prompt, fresh)."""
+    clean_prompt, count = _FRESH.subn("", prompt)
+    if count:
+        clean_prompt = re.sub(r"\s+", " ", clean_prompt).strip()
+    return clean_prompt, count > 0
+
+
+def image_digest(image) -> str:
+    """sha256 of an InputImage's bytes, kept in its metadata (shared with the FileCache entry,
+    so each file is hashed once)."""
+    digest = image.metadata.get("sha256")
+    if digest is None:
+        digest = hashlib.sha256(image.data).hexdigest()
+        image.metadata["sha256"] = digest
+    return digest
+
+
+async def digest_images(images: list):
+    """Fills in image_digest() of every image that doesn't have one yet, on a worker thread:
+    hashing an album of full-size originals would hold up the event loop."""
+    missing = [image for image in images or [] if "sha256" not in image.metadata]
+    if missing:
+        await asyncio.to_thread(lambda: [image_digest(image) for image in missing])
+
+
+class CachedResult:
+    __slots__ = ("images", "nbytes", "expires_at")
+
+    def __init__(self, images: list[tuple[bytes, str]], expires_at: float):
+        self.images = images
+        self.nbytes = sum(len(data) for data, _ in images)
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    """Generated images keyed by what produced them, so a repeated request skips the browser.
+
+    The key is the normalized prompt (case and whitespace folded), the sha256 of every input
+    image in order, and the aspect ratio. Entries expire `ttl_s` after they were generated
+    and are evicted least recently used first beyond `max_bytes`. Identical requests that
+    arrive while one is generating wait for that run instead of starting their own. If it
+    fails, the waiters get the same error, except for errors tied to the user who ran it
+    (`private_errors`, e.g. quota or a full queue): then each waiter runs the request itself.
+    Only non-empty results are cached.
+
+    Callers always get new streams built by `make_image(data, result_id)`, so they can be
+    consumed (sent, closed) independently, and keep their result_id for upscaling."""
+
+    def __init__(self, max_bytes: int, ttl_s: float, make_image, private_errors: tuple = ()):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.make_image = make_image
+        self.private_errors = tuple(private_errors)
+        self._entries: OrderedDict[str, CachedResult] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.nbytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.ttl_s > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def make_key(self, prompt: str, images: list = None, aspect_ratio: str = None) -> str:
+        """key(), with the image digests computed off the event loop."""
+        await digest_images(images)
+        return self.key(prompt, images, aspect_ratio)
+
+    @staticmethod
+    def key(prompt: str, images: list = None, aspect_ratio: str = None) -> str:
+        parts = [" ".join(prompt.casefold().split()), aspect_ratio or ""]
+        parts.extend(image_digest(image) for image in images or [])
+        return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
+
+    def _streams(self, entry: CachedResult) -> list:
+        return [self.make_image(data, result_id) for data, result_id in entry.images]
+
+    def _drop(self, key: str, reason: str):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        RESULT_CACHE_EVICTIONS.inc(reason=reason)
+
+    def _lookup(self, key: str) -> CachedResult | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._drop(key, "ttl")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, results: list) -> CachedResult:
+        images = []
+        for stream in results:
+            stream.seek(0)
+            images.append((stream.getvalue(), getattr(stream, "result_id", None)))
+        entry = CachedResult(images, time.monotonic() + self.ttl_s)
+        if key in self._entries:
+            self._drop(key, "replaced")
+        if entry.nbytes > self.max_bytes:
+            logger.debug(f"Result cache: {entry.nbytes / 1e6:.1f} MB result is over the budget, not cached")
+            return entry
+        now = time.monotonic()
+        for old_key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            self._drop(old_key, "ttl")
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes:
+            self._drop(next(iter(self._entries)), "capacity")
+        return entry
+
+    async def get_or_generate(self, key: str, generate, fresh: bool = False) -> list:
+        """Returns the cached result for `key`, or awaits `generate()` (a coroutine function
+        returning a list of image streams) and caches what it returns. `fresh` skips the
+        lookup and any identical run in flight, but still caches the new result."""
+        if not self.enabled:
+            return await generate()
+        if fresh:
+            RESULT_CACHE_REQUESTS.inc(outcome="bypass")
+        while not fresh:
+            entry = self._lookup(key)
+            if entry is not None:
+                RESULT_CACHE_REQUESTS.inc(outcome="hit")
+                return self._streams(entry)
+            pending = self._inflight.get(key)
+            if pending is None:
+                RESULT_CACHE_REQUESTS.inc(outcome="miss")
+                break
+            try:
+                entry = await asyncio.shield(pending)
+            except Exception:
+                RESULT_CACHE_REQUESTS.inc(outcome="coalesced_error")
+                raise
+            if entry is not None:
+                RESULT_CACHE_REQUESTS.inc(outcome="coalesced")
+                return self._streams(entry)
+            # The run we waited on came back empty or hit an error of its own user's: look
+            # again, then run our own
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        entry = None
+        error = None
+        try:
+            results = await generate()
+            if results:
+                entry = self._store(key, results)
+                for stream in results:
+                    stream.seek(0)
+            # The first caller keeps the original streams; waiters get copies
+            return results
+        except self.private_errors:
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if error is not None:
+                future.set_exception(error)
+                # Marks it retrieved, so a run nobody waited on doesn't log a warning
+                future.exception()
+            else:
+                future.set_result(entry)
@@ -0,0 +1,338 @@
+import asyncio
+import time
+import logging
+from collections import OrderedDict, deque
+from enum import IntEnum
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower value runs first."""
+    UPSCALE = 0
+    GENERATE = 1
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler already holds its maximum number of waiting jobs."""
+    pass
+
+
+class QuotaExceededError(Exception):
+    """Raised when a user has used up their token bucket."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Quota exceeded, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float = 1.0) -> float:
+        """Takes `cost` tokens. Returns 0 on success, otherwise seconds until enough tokens exist."""
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (cost - self.tokens) / self.rate
+
+    @property
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+BYTE_BUDGET_IN_USE = metrics.Gauge("nanobanana_byte_budget_bytes", "Bytes currently held per byte budget.", ["budget"])
+
+
+class ByteBudget:
+    """Caps the bytes held by concurrent operations (e.g. upscale files between download and upload).
+
+    acquire(n) waits, first come first served, until `n` more bytes fit under `max_bytes`;
+    release(n) hands them back and can be called from synchronous code such as close().
+    A request larger than the whole budget goes through once nothing else is held, so it
+    can't wait forever. max_bytes <= 0 disables the cap."""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self._waiters: deque = deque()
+        BYTE_BUDGET_IN_USE.set(0, budget=name)
+
+    def _fits(self, n: int) -> bool:
+        return self.in_use == 0 or self.in_use + n <= self.max_bytes
+
+    def _take(self, n: int):
+        self.in_use += n
+        BYTE_BUDGET_IN_USE.set(self.in_use, budget=self.name)
+
+    def _wake(self):
+        while self._waiters:
+            n, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(n):
+                break
+            self._waiters.popleft()
+            self._take(n)
+            future.set_result(None)
+
+    async def acquire(self, n: int) -> int:
+        """Reserves `n` bytes; returns the amount to release() later (0 when the cap is off)."""
+        if self.max_bytes <= 0 or n <= 0:
+            return 0
+        if not self._waiters and self._fits(n):
+            self._take(n)
+            return n
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((n, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the bytes straight back
+                self.release(n)
+            else:
+                # We may have been the one holding up the queue
+                self._wake()
+            raise
+        return n
+
+    def release(self, n: int):
+        if n <= 0:
+            return
+        self.in_use = max(0, self.in_use - n)
+        BYTE_BUDGET_IN_USE.set(self.in_use, budget=self.name)
+        self._wake()
+
+
+def _close_undelivered(result):
+    """Closes a job result nobody is waiting for any more, e.g. an upscale file that holds a
+    temp file and in-flight budget until it's closed (or each item of a list of them)."""
+    for item in result if isinstance(result, list) else [result]:
+        close = getattr(item, "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                logger.debug(f"Could not close an undelivered job result: {e}")
+
+
+class Job:
+    def __init__(self, chat_id, user_id, priority: Priority, func, on_position=None):
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.priority = priority
+        self.func = func
+        self.on_position = on_position
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        # Position reporting: callbacks run one at a time, always with the latest position
+        self._reported_position = None
+        self._pending_position = None
+        self._notifier = None
+
+    def notify_position(self, position: int):
+        """Reports the job's queue position (1-based), or 0 once it has started."""
+        if not self.on_position:
+            return
+        self._pending_position = position
+        if self._notifier is None or self._notifier.done():
+            self._notifier = asyncio.create_task(self._run_notifier())
+
+    async def _run_notifier(self):
+        while self._pending_position != self._reported_position:
+            position = self._pending_position
+            try:
+                await self.on_position(position)
+            except Exception as e:
+                logger.debug(f"Queue position callback failed: {e}")
+            self._reported_position = position
+
+
+class JobScheduler:
+    """Runs browser jobs with bounded concurrency, priority classes and per-chat fairness.
+
+    Within a priority class, chats take turns (round-robin), so one chat sending many
+    albums can't starve the others. Each user draws from a token bucket on submit."""
+
+    def __init__(self, concurrency: int, max_depth: int = 50, quota_burst: float = 5,
+                 quota_per_minute: float = 10):
+        self.concurrency = max(1, concurrency)
+        self.max_depth = max_depth
+        self.quota_burst = quota_burst
+        self.quota_rate = quota_per_minute / 60.0
+        # priority -> OrderedDict(chat_id -> deque[Job]); dict order is the round-robin order
+        self._queues: dict[Priority, OrderedDict] = {p: OrderedDict() for p in Priority}
+        self._buckets: dict[object, TokenBucket] = {}
+        self._depth = 0
+        self._running = 0
+        self._wakeup = asyncio.Event()
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        """Number of jobs waiting (not yet started)."""
+        return self._depth
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+        logger.info(f"Scheduler started with {self.concurrency} workers (max queue depth {self.max_depth})")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for queue in self._queues.values():
+            for jobs in queue.values():
+                for job in jobs:
+                    if not job.future.done():
+                        job.future.cancel()
+            queue.clear()
+        self._depth = 0
+
+    def _check_quota(self, user_id):
+        if user_id is None or self.quota_burst <= 0:
+            return
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            # Forget users whose buckets have fully refilled; they'd get a fresh one anyway
+            for uid in [uid for uid, b in self._buckets.items() if b.is_full]:
+                del self._buckets[uid]
+            bucket = self._buckets[user_id] = TokenBucket(self.quota_burst, self.quota_rate)
+        retry_after = bucket.take()
+        if retry_after:
+            raise QuotaExceededError(retry_after)
+
+    async def submit(self, chat_id, user_id, priority: Priority, func, on_position=None, on_admitted=None):
+        """Queues `func` (an async callable taking no arguments) and returns its result.
+
+        `on_position(n)` is awaited whenever the job's place in line changes: n >= 1 while
+        waiting, 0 once the job has started. `on_admitted()` is called once the job is queued,
+        e.g. to start work the job will need while it waits. Raises QueueFullError or
+        QuotaExceededError without queueing anything (or calling on_admitted)."""
+        if self._depth >= self.max_depth:
+            raise QueueFullError(f"Queue is full ({self._depth} waiting)")
+        self._check_quota(user_id)
+        if not self._workers:
+            self.start()
+
+        job = Job(chat_id, user_id, priority, func, on_position)
+        self._queues[priority].setdefault(chat_id, deque()).append(job)
+        self._depth += 1
+        if on_admitted:
+            on_admitted()
+        self._publish_positions()
+        self._wakeup.set()
+
+        try:
+            return await asyncio.shield(job.future)
+        except asyncio.CancelledError:
+            # Caller went away: drop the job if it hasn't started yet
+            if job.started_at is None and self._remove(job):
+                self._publish_positions()
+            elif not job.future.done():
+                job.future.cancel()
+            raise
+
+    def _remove(self, job: Job) -> bool:
+        jobs = self._queues[job.priority].get(job.chat_id)
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        if not jobs:
+            del self._queues[job.priority][job.chat_id]
+        self._depth -= 1
+        return True
+
+    def _pop_next(self) -> Job | None:
+        for priority in Priority:
+            queue = self._queues[priority]
+            if not queue:
+                continue
+            chat_id, jobs = queue.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                # Chat goes to the back of the line for its next job
+                queue[chat_id] = jobs
+            self._depth -= 1
+            return job
+        return None
+
+    def _dispatch_order(self) -> list[Job]:
+        """Waiting jobs in the order _pop_next would hand them out."""
+        order = []
+        for priority in Priority:
+            lanes = [list(jobs) for jobs in self._queues[priority].values()]
+            turn = 0
+            while any(lanes):
+                for lane in lanes:
+                    if turn < len(lane):
+                        order.append(lane[turn])
+                turn += 1
+                lanes = [lane for lane in lanes if turn < len(lane)]
+        return order
+
+    def _publish_positions(self):
+        for position, job in enumerate(self._dispatch_order(), start=1):
+            job.notify_position(position)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job = self._pop_next()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if job.future.done():
+                continue
+
+            job.started_at = time.monotonic()
+            wait = job.started_at - job.enqueued_at
+            metrics.observe_stage(job.priority.name.lower(), "queue_wait", wait)
+            logger.info(f"[worker {worker_id}] Starting {job.priority.name.lower()} job for chat {job.chat_id} (waited {wait:.1f}s, {self._depth} still queued)")
+            self._publish_positions()
+            job.notify_position(0)
+
+            self._running += 1
+            try:
+                result = await job.func()
+                if not job.future.done():
+                    job.future.set_result(result)
+                else:
+                    # The caller was cancelled while the job ran
+                    _close_undelivered(result)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                self._running -= 1
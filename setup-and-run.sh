@@ -121,7 +121,6 @@ fi
 
 # Step 8: Create necessary directories
 echo "Step 8: Creating necessary directories..."
-mkdir -p temp
 mkdir -p user_data
 echo -e "${GREEN}✓ Directories created${NC}"
 
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    req_id       TEXT PRIMARY KEY,
+    prompt       TEXT NOT NULL,
+    chat_id      INTEGER,
+    image_index  INTEGER NOT NULL DEFAULT 0,
+    aspect_ratio TEXT,
+    result_id    TEXT,
+    created_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_created_at ON requests (created_at);
+CREATE TABLE IF NOT EXISTS media_group_files (
+    media_group_id TEXT NOT NULL,
+    file_unique_id TEXT NOT NULL,
+    file_id        TEXT NOT NULL,
+    file_type      TEXT NOT NULL,
+    position       INTEGER NOT NULL,
+    created_at     REAL NOT NULL,
+    PRIMARY KEY (media_group_id, file_unique_id)
+);
+CREATE INDEX IF NOT EXISTS media_group_files_created_at ON media_group_files (created_at);
+CREATE TABLE IF NOT EXISTS media_group_messages (
+    chat_id        INTEGER NOT NULL,
+    message_id     INTEGER NOT NULL,
+    media_group_id TEXT NOT NULL,
+    created_at     REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS media_group_messages_created_at ON media_group_messages (created_at);
+"""
+
+SAVE_REQUEST_SQL = (
+    "INSERT OR REPLACE INTO requests (req_id, prompt, chat_id, image_index, aspect_ratio, result_id, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SAVE_MEDIA_GROUP_FILE_SQL = (
+    "INSERT OR IGNORE INTO media_group_files (media_group_id, file_unique_id, file_id, file_type, position, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SAVE_MEDIA_GROUP_MESSAGE_SQL = (
+    "INSERT OR REPLACE INTO media_group_messages (chat_id, message_id, media_group_id, created_at) VALUES (?, ?, ?, ?)"
+)
+
+
+class StateDB:
+    """Persistent bot state (Upscale button records, album membership) in SQLite.
+
+    The connection lives on one worker thread, so the event loop never blocks on disk.
+    Writes are write-behind: save_*() only queues a row, and a flusher task commits the
+    queue every `flush_interval_s` (or once `batch_size` rows are waiting) in a single
+    transaction. Reads flush first, so they always see earlier writes. The database runs
+    in WAL mode, and rows older than `retention_days` are deleted every
+    `compact_interval_s`, followed by an incremental vacuum and a WAL checkpoint."""
+
+    def __init__(self, path: str, flush_interval_s: float = 0.2, batch_size: int = 500,
+                 retention_days: float = 30, compact_interval_s: float = 3600):
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+        self.batch_size = batch_size
+        self.retention_s = retention_days * 86400
+        self.compact_interval_s = compact_interval_s
+        self._conn: sqlite3.Connection = None
+        self._executor: ThreadPoolExecutor = None
+        self._pending: list[tuple[str, tuple]] = []
+        self._wakeup: asyncio.Event = None
+        self._flusher: asyncio.Task = None
+        self._last_compaction = 0.0
+
+    # --- lifecycle ---------------------------------------------------------
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # auto_vacuum only takes effect on a new database (before the first table exists)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        # WAL + NORMAL: commits don't fsync; a power cut can lose the last moments, never corrupt
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def start(self):
+        if self._executor or not self.path:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-db")
+        await self._run(self._open)
+        self._wakeup = asyncio.Event()
+        self._last_compaction = time.monotonic()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        logger.info(f"State DB open at {self.path}")
+
+    async def close(self):
+        if not self._executor:
+            return
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    # --- writes ------------------------------------------------------------
+
+    def _queue(self, sql: str, params: tuple):
+        if not self._executor:
+            return
+        self._pending.append((sql, params))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    def _write_batch(self, batch: list):
+        by_sql: dict[str, list] = {}
+        for sql, params in batch:
+            by_sql.setdefault(sql, []).append(params)
+        self._conn.execute("BEGIN")
+        try:
+            for sql, rows in by_sql.items():
+                self._conn.executemany(sql, rows)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self):
+        if not self._pending or not self._executor:
+            return
+        batch, self._pending = self._pending, []
+        with metrics.time_stage("state_db", "flush"):
+            try:
+                await self._run(self._write_batch, batch)
+            except Exception as e:
+                logger.error(f"State DB: failed to write {len(batch)} rows: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.monotonic() - self._last_compaction >= self.compact_interval_s:
+                self._last_compaction = time.monotonic()
+                await self.compact()
+
+    def save_request(self, req_id: str, prompt: str, chat_id: int = None, image_index: int = 0,
+                     aspect_ratio: str = None, result_id: str = None):
+        self._queue(SAVE_REQUEST_SQL, (req_id, prompt, chat_id, image_index, aspect_ratio, result_id, time.time()))
+
+    def save_media_group_file(self, media_group_id: str, chat_id: int, message_id: int, file_id: str,
+                              file_type: str, file_unique_id: str, position: int):
+        now = time.time()
+        self._queue(SAVE_MEDIA_GROUP_FILE_SQL, (media_group_id, file_unique_id, file_id, file_type, position, now))
+        self._queue(SAVE_MEDIA_GROUP_MESSAGE_SQL, (chat_id, message_id, media_group_id, now))
+
+    # --- reads -------------------------------------------------------------
+
+    def _fetch(self, sql: str, params: tuple) -> list:
+        return [dict(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    async def _query(self, sql: str, params: tuple) -> list:
+        if not self._executor:
+            return []
+        await self.flush()
+        with metrics.time_stage("state_db", "read"):
+            return await self._run(self._fetch, sql, params)
+
+    async def load_request(self, req_id: str) -> dict | None:
+        rows = await self._query("SELECT * FROM requests WHERE req_id = ?", (req_id,))
+        return rows[0] if rows else None
+
+    async def load_media_group(self, media_group_id: str) -> list[dict]:
+        """The album's files in the order they were received."""
+        return await self._query(
+            "SELECT file_id, file_type, file_unique_id FROM media_group_files "
+            "WHERE media_group_id = ? ORDER BY position", (media_group_id,),
+        )
+
+    async def find_media_group(self, chat_id: int, message_id: int) -> str | None:
+        rows = await self._query(
+            "SELECT media_group_id FROM media_group_messages WHERE chat_id = ? AND message_id = ?",
+            (chat_id, message_id),
+        )
+        return rows[0]["media_group_id"] if rows else None
+
+    # --- maintenance -------------------------------------------------------
+
+    def _compact(self, cutoff: float) -> int:
+        deleted = 0
+        for table in ("requests", "media_group_files", "media_group_messages"):
+            deleted += self._conn.execute(f"DELETE FROM {table} WHERE created_at < ?", (cutoff,)).rowcount
+        self._conn.execute("PRAGMA incremental_vacuum")
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+    async def compact(self):
+        await self.flush()
+        with metrics.time_stage("state_db", "compact"):
+            try:
+                deleted = await self._run(self._compact, time.time() - self.retention_s)
+            except Exception as e:
+                logger.error(f"State DB compaction failed: {e}")
+                return
+        logger.info(f"State DB compacted: {deleted} rows older than {self.retention_s / 86400:.0f} days removed")
@@ -0,0 +1,96 @@
+import asyncio
+import io
+
+import pytest
+
+from result_cache import ResultCache, parse_fresh_command
+from scheduler import QuotaExceededError
+
+
+class Stream(io.BytesIO):
+    def __init__(self, data: bytes, result_id: str = None):
+        super().__init__(data)
+        self.result_id = result_id
+
+
+def make_cache(**kwargs) -> ResultCache:
+    return ResultCache(max_bytes=1 << 20, ttl_s=60, make_image=Stream, **kwargs)
+
+
+def counting_generator(outcome):
+    """A generate() that yields to the loop once (so identical calls overlap) and counts runs."""
+    runs = []
+
+    async def generate():
+        runs.append(True)
+        await asyncio.sleep(0.01)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return [Stream(outcome, "r1")]
+
+    return generate, runs
+
+
+def test_identical_requests_share_one_run():
+    async def scenario():
+        cache = make_cache()
+        generate, runs = counting_generator(b"image")
+        results = await asyncio.gather(*(cache.get_or_generate("k", generate) for _ in range(3)))
+        again = await cache.get_or_generate("k", generate)
+        return runs, results, again
+
+    runs, results, again = asyncio.run(scenario())
+    assert len(runs) == 1
+    streams = [stream for result in results + [again] for stream in result]
+    assert [(s.getvalue(), s.result_id) for s in streams] == [(b"image", "r1")] * 4
+    # Every caller gets a stream of its own
+    assert len({id(s) for s in streams}) == 4
+
+
+def test_failure_is_shared_with_waiters():
+    async def scenario():
+        cache = make_cache()
+        generate, runs = counting_generator(RuntimeError("page crashed"))
+        results = await asyncio.gather(*(cache.get_or_generate("k", generate) for _ in range(3)),
+                                       return_exceptions=True)
+        return runs, results, len(cache)
+
+    runs, results, cached = asyncio.run(scenario())
+    assert len(runs) == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "page crashed" for r in results)
+    assert cached == 0
+
+
+def test_private_error_makes_each_waiter_run_its_own():
+    async def scenario():
+        cache = make_cache(private_errors=(QuotaExceededError,))
+        generate, runs = counting_generator(QuotaExceededError(30))
+        results = await asyncio.gather(*(cache.get_or_generate("k", generate) for _ in range(3)),
+                                       return_exceptions=True)
+        return runs, results
+
+    runs, results = asyncio.run(scenario())
+    assert len(runs) == 3
+    assert all(isinstance(r, QuotaExceededError) for r in results)
+
+
+def test_fresh_skips_cached_result():
+    async def scenario():
+        cache = make_cache()
+        generate, runs = counting_generator(b"image")
+        await cache.get_or_generate("k", generate)
+        await cache.get_or_generate("k", generate, fresh=True)
+        return runs
+
+    assert len(asyncio.run(scenario())) == 2
+
+
+@pytest.mark.parametrize("prompt, expected", [
+    ("/fresh a cat", ("a cat", True)),
+    ("a cat /FRESH in the rain", ("a cat in the rain", True)),
+    ("a/fresh cat", ("a/fresh cat", False)),
+    ("see https://example.com/fresh", ("see https://example.com/fresh", False)),
+    ("a /freshly baked loaf", ("a /freshly baked loaf", False)),
+])
+def test_parse_fresh_command(prompt, expected):
+    assert parse_fresh_command(prompt) == expected
@@ -0,0 +1,183 @@
+import asyncio
+
+import pytest
+
+from scheduler import ByteBudget, JobScheduler, Priority, QueueFullError, QuotaExceededError
+
+
+class Closable:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_scheduler(**kwargs) -> JobScheduler:
+    kwargs.setdefault("quota_burst", 0)
+    return JobScheduler(concurrency=1, **kwargs)
+
+
+def test_chats_take_turns_within_a_priority():
+    async def scenario():
+        scheduler = make_scheduler()
+        order = []
+        started = asyncio.Event()
+        gate = asyncio.Event()
+
+        async def blocker():
+            started.set()
+            await gate.wait()
+
+        def job(name):
+            async def run():
+                order.append(name)
+            return run
+
+        first = asyncio.create_task(scheduler.submit("busy", None, Priority.GENERATE, blocker))
+        await started.wait()
+        submits = [scheduler.submit("a", None, Priority.GENERATE, job(f"a{i}")) for i in range(3)]
+        submits.append(scheduler.submit("b", None, Priority.GENERATE, job("b0")))
+        submits.append(scheduler.submit("c", None, Priority.UPSCALE, job("c0")))
+        tasks = [asyncio.create_task(coro) for coro in submits]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.gather(first, *tasks)
+        await scheduler.stop()
+        return order
+
+    assert asyncio.run(scenario()) == ["c0", "a0", "b0", "a1", "a2"]
+
+
+def test_cancelled_caller_drops_queued_job():
+    async def scenario():
+        scheduler = make_scheduler()
+        started = asyncio.Event()
+        gate = asyncio.Event()
+        ran = []
+
+        async def blocker():
+            started.set()
+            await gate.wait()
+
+        async def job():
+            ran.append(True)
+
+        first = asyncio.create_task(scheduler.submit(1, None, Priority.GENERATE, blocker))
+        await started.wait()
+        queued = asyncio.create_task(scheduler.submit(2, None, Priority.GENERATE, job))
+        await asyncio.sleep(0)
+        assert scheduler.depth == 1
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert scheduler.depth == 0
+        gate.set()
+        await first
+        await asyncio.sleep(0)
+        await scheduler.stop()
+        return ran
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_cancelled_caller_gets_running_result_closed():
+    async def scenario():
+        scheduler = make_scheduler()
+        started = asyncio.Event()
+        gate = asyncio.Event()
+        result = Closable()
+
+        async def job():
+            started.set()
+            await gate.wait()
+            return result
+
+        task = asyncio.create_task(scheduler.submit(1, None, Priority.UPSCALE, job))
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        gate.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        await scheduler.stop()
+        return result
+
+    assert asyncio.run(scenario()).closed
+
+
+def test_rejected_submit_is_not_admitted():
+    async def scenario():
+        admitted = []
+
+        async def job():
+            return None
+
+        scheduler = make_scheduler(quota_burst=1, quota_per_minute=1)
+        await scheduler.submit(1, "user", Priority.GENERATE, job, on_admitted=lambda: admitted.append(1))
+        with pytest.raises(QuotaExceededError):
+            await scheduler.submit(1, "user", Priority.GENERATE, job, on_admitted=lambda: admitted.append(2))
+        await scheduler.stop()
+
+        scheduler = make_scheduler(max_depth=0)
+        with pytest.raises(QueueFullError):
+            await scheduler.submit(1, "user", Priority.GENERATE, job, on_admitted=lambda: admitted.append(3))
+        return admitted
+
+    assert asyncio.run(scenario()) == [1]
+
+
+def test_byte_budget_is_first_come_first_served():
+    async def scenario():
+        budget = ByteBudget("test_fifo", 10)
+        order = []
+        held = await budget.acquire(8)
+
+        async def take(name, n):
+            order.append((name, await budget.acquire(n)))
+
+        large = asyncio.create_task(take("large", 6))
+        await asyncio.sleep(0)
+        # Would fit right now, but has to wait behind the larger request
+        small = asyncio.create_task(take("small", 2))
+        await asyncio.sleep(0)
+        assert order == []
+        budget.release(held)
+        await asyncio.gather(large, small)
+        return order, budget.in_use
+
+    assert asyncio.run(scenario()) == ([("large", 6), ("small", 2)], 8)
+
+
+def test_byte_budget_release_skips_cancelled_waiter():
+    async def scenario():
+        budget = ByteBudget("test_release", 10)
+        held = await budget.acquire(10)
+        blocked = asyncio.create_task(budget.acquire(8))
+        behind = asyncio.create_task(budget.acquire(1))
+        await asyncio.sleep(0)
+        blocked.cancel()
+        await asyncio.gather(blocked, return_exceptions=True)
+        assert not behind.done()
+        budget.release(held)
+        assert await behind == 1
+        return budget.in_use
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_byte_budget_oversized_request_and_disabled_cap():
+    async def scenario():
+        budget = ByteBudget("test_oversized", 10)
+        held = await budget.acquire(4)
+        oversized = asyncio.create_task(budget.acquire(25))
+        await asyncio.sleep(0)
+        assert not oversized.done()
+        budget.release(held)
+        assert await oversized == 25
+        budget.release(25)
+
+        disabled = ByteBudget("test_disabled", 0)
+        assert await disabled.acquire(1 << 30) == 0
+        return budget.in_use, disabled.in_use
+
+    assert asyncio.run(scenario()) == (0, 0)
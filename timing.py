@@ -0,0 +1,47 @@
+import time
+import logging
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StepTimer:
+    """Collects per-step durations for one job and logs them as a single report line.
+
+    When `operation` is given, every step is also observed in the
+    nanobanana_stage_seconds histogram under that operation.
+
+    Usage:
+        timer = StepTimer("generate tab 0", operation="generate")
+        with timer.step("upload"):
+            ...
+        timer.record("first_image", seconds)
+        logger.info(timer.report())
+    """
+
+    def __init__(self, label: str, operation: str = None):
+        self.label = label
+        self.operation = operation
+        self.started = time.perf_counter()
+        self.steps: list[tuple[str, float]] = []
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float):
+        self.steps.append((name, seconds))
+        if self.operation:
+            metrics.observe_stage(self.operation, name, seconds)
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self) -> str:
+        parts = " ".join(f"{name}={seconds:.2f}s" for name, seconds in self.steps)
+        return f"Timing [{self.label}]: {parts} total={self.since_start():.2f}s"
@@ -24,13 +24,14 @@ async def test_upscale():
         
         # 2. Upscale the first one
         logger.info("Testing upscale for index 0...")
-        upscaled_stream = await client.upscale_image(prompt, 0, "2K")
+        upscaled_stream = await client.upscale_image(prompt, 0, "2K", images[0].result_id)
         
         if upscaled_stream:
-            size = upscaled_stream.getbuffer().nbytes
-            logger.info(f"Upscale successful! Got {size} bytes.")
+            with upscaled_stream:
+                data = upscaled_stream.read()
+            logger.info(f"Upscale successful! Got {len(data)} bytes.")
             with open("test_upscaled_result.png", "wb") as f:
-                f.write(upscaled_stream.getbuffer())
+                f.write(data)
         else:
             logger.error("Upscale returned None.")
 